@@ -0,0 +1,50 @@
+import os
+import json
+import time
+import math
+
+
+def path_script(name):
+    """
+    Returns the path of a benchmark script, run on the examiner
+    """
+    return f"./benchmarks/{name}.py"
+
+
+def percentile(values, p):
+    """
+    Returns the p percentile of a list of values, by the nearest rank method
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+def summarize(values):
+    """
+    Returns count, minimum, maximum and p50, p90 and p99 percentiles of a list of values
+    """
+    if len(values) == 0:
+        return { "count": 0 }
+
+    return {
+        "count": len(values),
+        "min": round(min(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p90": round(percentile(values, 90), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def report_save(path, name, report):
+    """
+    Writes a benchmark report as json in a given directory, named after the benchmark and the current time.
+    Returns the path of the report
+    """
+    os.makedirs(path, exist_ok = True)
+
+    filename = f"{path}/{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(filename, "w") as f:
+        json.dump(report, f, indent = 4)
+
+    return filename
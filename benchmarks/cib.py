@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# CIB load benchmark, run on a cluster node. Dummy primitives are added in bulk up to every given
+# number of resources, grouped and with a location constraint per group, and at every step it measures:
+#
+#   commit       seconds to commit the bulk update of the step to the CIB
+#   update       median seconds to commit a single attribute change, over a number of updates
+#   scheduler    seconds the scheduler takes to compute a transition for the live CIB
+#   convergence  seconds since the bulk commit until the cluster has no pending actions
+#
+# Results are written to stdout as a json list, one entry per step. Everything created is removed at the end.
+#
+# Usage: cib.py TIMEOUT GROUP_SIZE UPDATES STEP [STEP ...]
+
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+
+PREFIX = "bench-cib"
+
+
+def log(message):
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+def timed(command, input = None, timeout = None):
+    start = time.time()
+    res = subprocess.run(command, input=input, capture_output=True, text=True, shell=True, timeout=timeout)
+    if res.returncode != 0:
+        raise RuntimeError(f"{command}: {res.stderr.strip()}")
+    return time.time() - start
+
+
+def resources_xml(first, last, group_size):
+    """
+    Returns the resources section with the primitives from first to last, in groups of group_size
+    """
+    groups = []
+    for start in range(first, last, group_size):
+        primitives = "".join(
+            f'<primitive id="{PREFIX}-{index}" class="ocf" provider="heartbeat" type="Dummy">'
+            f'<operations><op id="{PREFIX}-{index}-monitor" name="monitor" interval="60s"/></operations>'
+            f'</primitive>'
+            for index in range(start, min(start + group_size, last)))
+        groups.append(f'<group id="{PREFIX}-group-{start}">{primitives}</group>')
+    return f'<resources>{"".join(groups)}</resources>'
+
+
+def constraints_xml(first, last, group_size, node):
+    """
+    Returns the constraints section with a location preference for every group from first to last
+    """
+    constraints = "".join(
+        f'<rsc_location id="{PREFIX}-location-{start}" rsc="{PREFIX}-group-{start}" node="{node}" score="{start % 100}"/>'
+        for start in range(first, last, group_size))
+    return f'<constraints>{constraints}</constraints>'
+
+
+def step(created, target, group_size, updates, timeout, node):
+    result = { "resources": target }
+
+    # bulk update with the new resources and their constraints
+    update = f'<cib><configuration>{resources_xml(created, target, group_size)}{constraints_xml(created, target, group_size, node)}</configuration></cib>'
+    start = time.time()
+    timed("cibadmin --modify --allow-create --xml-pipe", input=update, timeout=timeout)
+    result["commit"] = time.time() - start
+
+    # the cluster converges when there are no pending actions
+    timed(f"crm_resource --wait --timeout={timeout}s", timeout=timeout + 30)
+    result["convergence"] = time.time() - start
+
+    # single updates at this size
+    samples = [ timed(f"crm_attribute --type crm_config --name {PREFIX}-update --update {sample}") for sample in range(updates) ]
+    result["update"] = statistics.median(samples)
+
+    # a scheduler run over the live CIB, without executing anything
+    result["scheduler"] = timed("crm_simulate --live-check --simulate --quiet", timeout=timeout)
+
+    return result
+
+
+def cleanup(timeout):
+    for xpath in [f"//rsc_location[starts-with(@id,'{PREFIX}-')]", f"//group[starts-with(@id,'{PREFIX}-')]", f"//nvpair[@name='{PREFIX}-update']"]:
+        subprocess.run(f'cibadmin --delete-all --force --xpath "{xpath}"', shell=True, capture_output=True)
+    subprocess.run(f"crm_resource --wait --timeout={timeout}s", shell=True, capture_output=True)
+
+
+def main(timeout, group_size, updates, steps):
+    node = subprocess.run("crm_node -n", shell=True, capture_output=True, text=True).stdout.strip()
+
+    results = []
+    created = 0
+    try:
+        for target in sorted(steps):
+            log(f"Scaling up to {target} resources")
+            results.append(step(created, target, group_size, updates, timeout, node))
+            created = target
+            log(f"{target} resources: {results[-1]}")
+    except Exception as e:
+        log(f"Step failed: {e}")
+        return 1
+    finally:
+        log("Removing benchmark resources")
+        cleanup(timeout)
+        print(json.dumps(results))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]), [ int(step) for step in sys.argv[4:] ]))
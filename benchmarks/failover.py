@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Failover benchmark, run from the examiner against the cluster nodes through ssh with the cluster key.
+# Every scenario is repeated a number of times on a Dummy resource created for it, and the timings
+# of every event are written to stdout as json:
+#
+#   { "node-kill": [ { "detection": 1.2, "fencing": 20.3, "restart": 22.1 }, ... ], ... }
+#
+# Timings are seconds since the failure was injected. Events that do not apply to a scenario
+# are not reported, and a repetition that does not complete in time is reported with its error.
+#
+# Usage: failover.py TIMEOUT REPETITIONS NODE [NODE ...] -- SCENARIO [SCENARIO ...]
+
+import sys
+import json
+import time
+import subprocess
+import xml.etree.ElementTree as ET
+
+
+RESOURCE = "bench-failover-dummy"
+INTERVAL = 0.2
+
+SSH = [
+    "ssh", "-o", "BatchMode=yes", "-o", "StrictHostKeyChecking=no",
+    "-o", "ControlMaster=auto", "-o", "ControlPath=/tmp/bench-failover-%h", "-o", "ControlPersist=60",
+    "-o", "ConnectTimeout=2",
+]
+
+
+def log(message):
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+def run(node, command, timeout = 30):
+    try:
+        res = subprocess.run(SSH + [f"root@{node}", command], capture_output=True, text=True, timeout=timeout)
+        return res.returncode, res.stdout
+    except subprocess.TimeoutExpired:
+        return 124, ""
+
+
+def status(node):
+    """
+    Returns the state of every node and the node the resource runs on, as seen by a given node
+    """
+    rc, out = run(node, "crm_mon -1 --output-as=xml", timeout=5)
+    if rc != 0:
+        return None, None
+
+    try:
+        root = ET.fromstring(out)
+    except ET.ParseError:
+        return None, None
+
+    nodes = {}
+    for entry in root.iter("node"):
+        if entry.get("name") is None or entry.get("online") is None:
+            continue
+        if entry.get("online") == "true":
+            nodes[entry.get("name")] = "online"
+        elif entry.get("unclean") == "true":
+            nodes[entry.get("name")] = "unclean"
+        else:
+            nodes[entry.get("name")] = "offline"
+
+    location = None
+    for resource in root.iter("resource"):
+        if resource.get("id") == RESOURCE and resource.get("role") == "Started":
+            for node in resource.iter("node"):
+                location = node.get("name")
+
+    return nodes, location
+
+
+def wait(observer, condition, timeout):
+    """
+    Polls the cluster status from an observer node until a condition holds, returns when it did or None
+    """
+    start = time.time()
+    while time.time() - start < timeout:
+        nodes, location = status(observer)
+        if nodes is not None and condition(nodes, location):
+            return time.time()
+        time.sleep(INTERVAL)
+    return None
+
+
+def settle(nodes, timeout):
+    """
+    Waits for every node to be online and the resource to be started, starting the cluster on rebooted nodes
+    """
+    start = time.time()
+    while time.time() - start < timeout:
+        for node in nodes:
+            if run(node, "systemctl is-active -q pacemaker || crm cluster start", timeout=60)[0] != 0:
+                break
+        else:
+            if wait(nodes[0], lambda states, location: all(states.get(node) == "online" for node in nodes) and location, 10):
+                return True
+        time.sleep(5)
+    return False
+
+
+def node_kill(nodes, victim, observer):
+    start = time.time()
+    run(victim, "echo b > /proc/sysrq-trigger", timeout=2)
+    return start
+
+
+def fence(nodes, victim, observer):
+    start = time.time()
+    subprocess.Popen(SSH + [f"root@{observer}", f"stonith_admin --reboot {victim}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return start
+
+
+def network_split(nodes, victim, observer):
+    start = time.time()
+    run(victim, "iptables -I INPUT -p udp --dport 5405 -j DROP; iptables -I OUTPUT -p udp --dport 5405 -j DROP", timeout=5)
+    return start
+
+
+def resource_move(nodes, victim, observer):
+    start = time.time()
+    run(observer, f"crm resource move {RESOURCE} {observer}")
+    return start
+
+
+SCENARIOS = {
+    "node-kill": (node_kill, True),
+    "fence": (fence, True),
+    "network-split": (network_split, True),
+    "resource-move": (resource_move, False),
+}
+
+
+def repetition(scenario, nodes, timeout):
+    inject, fenced = SCENARIOS[scenario]
+
+    _, victim = status(nodes[0])
+    observer = [ node for node in nodes if node != victim ][0]
+
+    start = inject(nodes, victim, observer)
+    timings = {}
+
+    if fenced:
+        detected = wait(observer, lambda states, location: states.get(victim) != "online", timeout)
+        if detected is None:
+            return { "error": "failure not detected" }
+        timings["detection"] = detected - start
+
+        fenced_at = wait(observer, lambda states, location: states.get(victim) == "offline", timeout)
+        if fenced_at is None:
+            return dict(timings, error = "node not fenced")
+        timings["fencing"] = fenced_at - start
+
+    restarted = wait(observer, lambda states, location: location is not None and location != victim, timeout)
+    if restarted is None:
+        return dict(timings, error = "resource not restarted")
+    timings["restart"] = restarted - start
+
+    if scenario == "resource-move":
+        run(observer, f"crm resource clear {RESOURCE}")
+
+    return timings
+
+
+def main(timeout, repetitions, nodes, scenarios):
+    unknown = [ scenario for scenario in scenarios if scenario not in SCENARIOS ]
+    if unknown:
+        log(f"Unknown scenarios: {', '.join(unknown)}")
+        return 1
+
+    run(nodes[0], f"crm configure primitive {RESOURCE} ocf:heartbeat:Dummy op monitor interval=10s")
+    results = {}
+
+    try:
+        for scenario in scenarios:
+            results[scenario] = []
+            for index in range(repetitions):
+                if not settle(nodes, timeout):
+                    log("Cluster did not settle, stopping")
+                    return 1
+
+                log(f"{scenario} {index + 1}/{repetitions}")
+                results[scenario].append(repetition(scenario, nodes, timeout))
+                log(f"{scenario} {index + 1}/{repetitions}: {results[scenario][-1]}")
+    finally:
+        settle(nodes, timeout)
+        run(nodes[0], f"crm configure delete --force {RESOURCE}")
+        print(json.dumps(results))
+
+    return 0
+
+
+if __name__ == "__main__":
+    separator = sys.argv.index("--")
+    sys.exit(main(int(sys.argv[1]), int(sys.argv[2]), sys.argv[3:separator], sys.argv[separator + 1:]))
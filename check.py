@@ -0,0 +1,289 @@
+import os
+import re
+import ipaddress
+import urllib.request
+
+import tasks
+import timing
+import libvirt
+import utils
+
+
+#
+# Schema of the environment, once merged with defaults and sunk. Every entry is the path of a key, the types
+# it can take and its allowed values, any if None
+#
+schema = [
+    ("name", str, None),
+    ("provider", str, ["libvirt", "azure", "container"]),
+    ("node.count", int, None),
+    ("common.private_ip_range", str, None),
+    ("common.shared_storage_type", str, ["shared-disk", "iscsi", "none"]),
+    ("common.terraform_render", str, ["files", "for_each"]),
+    ("common.reg_code", str, None),
+    ("provision.ready_timeout", int, None),
+    ("provision.backend", str, ["local", "salt-ssh"]),
+    ("provision.upload", str, ["direct", "relay"]),
+    ("provision.relay_width", int, None),
+    ("provision.stall_timeout", int, None),
+    ("provision.stall_retries", int, None),
+    ("provision.stall_backoff", int, None),
+    ("timing.preset", str, [""] + list(timing.presets)),
+    ("timing.override", dict, None),
+    ("collect.max_size", int, None),
+    ("check.timeout", int, None),
+]
+
+provider_schema = {
+    "libvirt": [
+        ("common.qemu_uri", str, None),
+        ("common.storage_pool", str, None),
+        ("common.public_ip_range", str, None),
+        ("common.network.ring1", bool, None),
+        ("common.network.ring1_ip_range", str, None),
+        ("common.shared_storage_type", str, ["shared-disk", "iscsi"]),
+    ],
+    "azure": [
+        ("common.region", str, None),
+        ("common.shared_storage_type", str, ["iscsi"]),
+    ],
+    "container": [
+        ("common.container_host", str, None),
+        ("common.shared_storage_type", str, ["none"]),
+    ],
+}
+
+#
+# Schema of every machine, taken from its role or node entry
+#
+machine_common_schema = [
+    ("username", str, None),
+    ("password", str, None),
+    ("additional_repos", (dict, type(None)), None),
+    ("additional_pkgs", (list, type(None)), None),
+]
+
+machine_schema = {
+    "libvirt": [
+        ("cpus", int, None),
+        ("memory", int, None),
+    ],
+    "azure": [
+        ("vm_size", str, None),
+        ("offer", str, None),
+        ("sku", (str, int), None),
+        ("version", str, None),
+        ("public_key_file", str, None),
+    ],
+    "container": [
+        ("base_image", str, None),
+        ("cpus", (int, float), None),
+        ("memory", int, None),
+    ],
+}
+
+
+def lookup(entry, path):
+    """
+    Returns the value of a dotted path in a nested dictionary, raising KeyError if missing
+    """
+    for key in path.split("."):
+        if not isinstance(entry, dict) or key not in entry:
+            raise KeyError(path)
+        entry = entry[key]
+    return entry
+
+
+def validate(entry, entries, prefix = ""):
+    """
+    Validates a dictionary against a list of schema entries. Returns the list of problems found
+    """
+    problems = []
+    for path, types, values in entries:
+        try:
+            value = lookup(entry, path)
+        except KeyError:
+            problems.append(f"{prefix}{path} is missing")
+            continue
+
+        # bool is an int for isinstance, but never a valid number here
+        if not isinstance(value, types) or (isinstance(value, bool) and types in [int, (int, float)]):
+            problems.append(f"{prefix}{path} has an invalid value {value!r}")
+        elif values is not None and value not in values:
+            problems.append(f"{prefix}{path} is {value!r}, must be one of: {', '.join(map(str, values))}")
+
+    return problems
+
+
+def machines(env):
+    """
+    Returns the name and the environment entry of every machine of a deployment
+    """
+    entries = [ (env[role].get("name", role), env[role]) for role in ["iscsi", "qdevice", "examiner"] if role in env ]
+    entries += [ (env["node"][index + 1].get("name", f"node{index + 1:0>2}"), env["node"][index + 1]) for index in range(int(env["node"]["count"])) ]
+    return entries
+
+
+def addresses(env, path, subnet = None):
+    """
+    Checks the range of a network given in a path has an address for every machine, as numbered in the
+    infrastructure files. Returns the list of problems found
+    """
+    try:
+        network = ipaddress.ip_network(lookup(env, path), strict=False)
+    except ValueError as e:
+        return [f"{path} is not a valid network: {e}"]
+
+    if subnet is not None:
+        if network.prefixlen + subnet > network.max_prefixlen:
+            return [f"{path} is too small to hold a /{network.prefixlen + subnet} subnet"]
+        network = list(network.subnets(prefixlen_diff=subnet))[1]
+
+    highest = libvirt.private_host_numbers["node"] + int(env["node"]["count"])
+    if highest > network.num_addresses - 2:
+        return [f"{path} {network} has {max(network.num_addresses - 2, 0)} usable addresses, {env['node']['count']} nodes need up to the host number {highest}"]
+
+    return []
+
+
+def schema_problems(env):
+    """
+    Validates an environment against the schema of its provider. Returns the list of problems found
+    """
+    problems = validate(env, schema)
+    if problems and any(problem.startswith("provider") for problem in problems):
+        return problems
+
+    provider = env["provider"]
+    problems += validate(env, provider_schema[provider])
+    if len(problems) > 0:
+        return problems
+
+    if env["name"] == "" or not re.match(r"^[a-zA-Z0-9][a-zA-Z0-9_-]*$", env["name"]):
+        problems.append(f"name {env['name']!r} must be letters, digits, - and _")
+
+    if env["node"]["count"] < 1:
+        problems.append(f"node.count must be at least 1")
+
+    for name, entry in machines(env):
+        problems += validate(entry, machine_schema[provider] + machine_common_schema, prefix = f"{name}: ")
+
+        if provider == "libvirt" and not entry.get("source_image") and not entry.get("volume_name"):
+            problems.append(f"{name}: source_image or volume_name must be given")
+        if provider in ["libvirt", "container"] and isinstance(entry.get("cpus"), (int, float)) and entry["cpus"] <= 0:
+            problems.append(f"{name}: cpus must be positive")
+        if provider in ["libvirt", "container"] and isinstance(entry.get("memory"), int) and entry["memory"] <= 0:
+            problems.append(f"{name}: memory must be positive")
+        if provider == "azure" and isinstance(entry.get("public_key_file"), str) and not os.path.isfile(os.path.expanduser(entry["public_key_file"])):
+            problems.append(f"{name}: public_key_file {entry['public_key_file']} does not exist")
+
+    if provider == "azure":
+        problems += addresses(env, "common.private_ip_range", subnet = 8)
+    else:
+        problems += addresses(env, "common.private_ip_range")
+    if provider == "libvirt" and env["common"]["network"]["ring1"]:
+        problems += addresses(env, "common.network.ring1_ip_range")
+
+    if env["provision"]["relay_width"] < 1:
+        problems.append("provision.relay_width must be at least 1")
+
+    profile = ["token", "token_coefficient", "consensus", "join", "max_messages", "token_retransmits_before_loss_const", "join_timeout", "sbd_watchdog", "sbd_msgwait"]
+    for key in env["timing"]["override"]:
+        if key not in profile:
+            problems.append(f"timing.override has an unknown key {key}")
+
+    return problems
+
+
+#
+# Environmental probes. Every one returns the list of problems found
+#
+def probe_command(command, message, timeout):
+    res = tasks.run(command, timeout=timeout)
+    if tasks.has_failed(res):
+        return [f"{message}: {tasks.get_stderr(res).strip()}"]
+    return []
+
+
+def probe_url(url, message, timeout):
+    try:
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request, timeout=timeout):
+            pass
+    except Exception as e:
+        return [f"{message}: {e}"]
+    return []
+
+
+def probe_image(source, timeout):
+    if utils.image_is_url(source):
+        return probe_url(source, f"Image {source} is not reachable", timeout)
+    if not os.path.isfile(utils.image_local_path(source)):
+        return [f"Image {source} does not exist"]
+    return []
+
+
+def probe_repo(name, url, timeout):
+    return probe_url(f"{url.rstrip('/')}/repodata/repomd.xml", f"Repository {name} {url} is not reachable", timeout)
+
+
+def probe_capacity(uri, env, timeout):
+    """
+    Checks the hypervisor has cpus for the largest machine and memory for all of them
+    """
+    res = tasks.run(f"virsh -c {uri} nodeinfo", timeout=timeout)
+    if tasks.has_failed(res):
+        return [f"Cannot get capacity of {uri}: {tasks.get_stderr(res).strip()}"]
+
+    info = dict( line.split(":", 1) for line in tasks.get_stdout(res).splitlines() if ":" in line )
+    cpus = int(info["CPU(s)"].strip())
+    memory = int(info["Memory size"].split()[0]) // 1024
+
+    problems = []
+    for name, entry in machines(env):
+        if entry["cpus"] > cpus:
+            problems.append(f"{name}: {entry['cpus']} cpus, but {uri} has {cpus}")
+
+    total = sum(entry["memory"] for _, entry in machines(env))
+    if total > memory:
+        problems.append(f"Machines need {total} MiB of memory, but {uri} has {memory} MiB")
+
+    return problems
+
+
+def probes(env, timeout):
+    """
+    Returns the environmental probes of a deployment as (description, function) pairs, to be run concurrently
+    """
+    provider = env["provider"]
+    common = env["common"]
+
+    checks = [ ("terraform", lambda: probe_command("terraform version", "Terraform is not available", timeout)) ]
+
+    if provider == "libvirt":
+        uri = common["qemu_uri"]
+        pool = common["storage_pool"]
+        checks.append( (f"uri {uri}", lambda: probe_command(f"virsh -c {uri} uri", f"Hypervisor {uri} is not reachable", timeout)) )
+        checks.append( (f"pool {pool}", lambda: probe_command(f"virsh -c {uri} pool-info {pool}", f"Storage pool {pool} not found in {uri}", timeout)) )
+        checks.append( (f"capacity of {uri}", lambda: probe_capacity(uri, env, timeout)) )
+
+        for volume in sorted({ entry["volume_name"] for _, entry in machines(env) if entry.get("volume_name") and not entry.get("source_image") }):
+            checks.append( (f"volume {volume}", lambda volume=volume: probe_command(f"virsh -c {uri} vol-info --pool {pool} {volume}", f"Volume {volume} not found in pool {pool}", timeout)) )
+
+        for source in sorted(utils.get_images_from_env(env)):
+            checks.append( (f"image {source}", lambda source=source: probe_image(source, timeout)) )
+
+    if provider == "azure":
+        checks.append( ("azure login", lambda: probe_command("az account show", "Not logged in Azure", timeout)) )
+
+    if provider == "container":
+        host = common["container_host"]
+        checks.append( (f"container host {host}", lambda: probe_command(f"docker -H {host} info", f"Container host {host} is not reachable", timeout)) )
+
+    repos = {}
+    for _, entry in machines(env):
+        repos.update(entry.get("additional_repos") or {})
+    for repo, url in sorted(repos.items()):
+        checks.append( (f"repository {repo}", lambda repo=repo, url=url: probe_repo(repo, url, timeout)) )
+
+    return checks
@@ -8,10 +8,23 @@ import functools
 import logging
 import time
 import json
+import re
+import ipaddress
+import tarfile
 import yaml
 
 import tasks
 import terraform
+import libvirt
+import saltssh
+import bench
+import timing
+import check
+import logs
+import ready
+import diag
+import snapshots
+import replace
 import ssh
 import utils
 
@@ -40,6 +53,9 @@ def read_deployment_file(filename):
     # sink group options
     env = utils.sink(env)
 
+    # log every host of the deployment to its own file
+    logs.deployment(env["name"], env["logs"]["json"])
+
     return env
 
 
@@ -86,6 +102,113 @@ def prepare(**env):
     return tasks.success()
 
 
+#
+# Seconds to wait for a base volume being cloned by another deployment
+#
+image_clone_timeout = 600
+
+def image_cache_task(deployment_name, uri, pool, source):
+    """
+    Imports an image as a base volume in the storage pool, unless it was already imported completely.
+    """
+    volume = utils.image_cache_name(source)
+
+    if volume is not None and libvirt.volume_complete(uri, pool, volume):
+        logging.info(f"Reusing base volume [{volume}] for {source}")
+        return (tasks.success(), volume)
+
+    logging.info(f"Importing {source} as base volume [{volume or 'named after its content'}]")
+
+    # images to be named after their content are told apart by their source while downloaded
+    download_name = volume if volume is not None else f"image-{abs(hash(source)):x}"
+    download = f"{utils.path_deployment(deployment_name)}/{download_name}.download"
+    try:
+        path = utils.image_fetch(source, download)
+    except Exception as e:
+        return (tasks.failure(f"Cannot fetch {source}: {e}"), volume)
+
+    try:
+        if volume is None:
+            volume = utils.image_content_name(path)
+            if libvirt.volume_complete(uri, pool, volume):
+                logging.info(f"Reusing base volume [{volume}] for {source}")
+                return (tasks.success(), volume)
+
+        # the image is uploaded under a name of its own and the base volume is cloned from it once complete,
+        # so a base volume is never reused half uploaded, by this or any other deployment
+        partial = f"{volume}.{os.urandom(4).hex()}.part"
+        res = libvirt.volume_create(uri, pool, partial, os.path.getsize(path), utils.image_format(path))
+        if tasks.has_succeeded(res):
+            try:
+                res = libvirt.volume_upload(uri, pool, partial, path)
+                if tasks.has_succeeded(res):
+                    res = libvirt.volume_clone(uri, pool, partial, volume)
+                    # another deployment imported it meanwhile, and may be still cloning it
+                    if libvirt.volume_create_collided(res):
+                        deadline = time.time() + image_clone_timeout
+                        while not libvirt.volume_complete(uri, pool, volume):
+                            if time.time() > deadline:
+                                return (tasks.failure(f"Base volume [{volume}] imported meanwhile is not complete"), volume)
+                            time.sleep(5)
+                        logging.info(f"Reusing base volume [{volume}] for {source}, imported meanwhile")
+                        return (tasks.success(), volume)
+            finally:
+                libvirt.volume_delete(uri, pool, partial)
+    finally:
+        if path == download:
+            os.remove(download)
+
+    if tasks.has_succeeded(res):
+        logging.info(f"Imported {source} as base volume [{volume}]")
+
+    return (res, volume)
+
+
+def infrastructure_images(name):
+    """
+    Import every distinct source image once in the storage pool, so machines are created as copy-on-write overlays of it
+    """
+
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    if env["provider"] != "libvirt" or not env["common"].get("image_cache", False):
+        return tasks.success()
+
+    #
+    # Import images
+    #
+    logging.info("[X] Importing images...")
+
+    images = utils.get_images_from_env(env)
+
+    uri = env["common"]["qemu_uri"]
+    pool = env["common"]["storage_pool"]
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(images))) as executor:
+        futures = { source: executor.submit(image_cache_task, name, uri, pool, source) for source in images }
+
+        for source, future in futures.items():
+            res, volume = future.result()
+            if tasks.has_failed(res):
+                logging.critical(f"Cannot import {source}")
+                logging.critical(tasks.get_stderr(res))
+                return res
+
+            for entry in images[source]:
+                entry["base_volume"] = volume
+
+    utils.environment_save(name, **env)
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
 
 def infrastructure_render(name):
     """
@@ -100,6 +223,22 @@ def infrastructure_render(name):
         logging.critical(tasks.get_stderr(res))
         return res
 
+    if env["provider"] == "azure":
+        if env["common"]["availability_set"] and env["common"]["zones"]:
+            res = tasks.failure("An availability set cannot be used along with zones")
+            logging.critical(tasks.get_stderr(res))
+            return res
+
+        if env["common"]["proximity_placement_group"] and len(env["common"]["zones"]) > 1:
+            res = tasks.failure("Machines in a proximity placement group cannot be spread across zones")
+            logging.critical(tasks.get_stderr(res))
+            return res
+
+    if env["provider"] == "container" and env["common"]["shared_storage_type"] != "none":
+        res = tasks.failure("Containers cannot share storage, shared_storage_type must be none")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
     #
     # Render infrastructure files
     #
@@ -113,11 +252,24 @@ def infrastructure_render(name):
 
     utils.template_render(path_infrastructure, "main.tf.j2", path_render, "main.tf", **env)
     
-    for index in range(0, int(env["node"]["count"])):
-        utils.template_render(path_infrastructure, "node.tf.j2", path_render, f"node{(index + 1):0>2}.tf", index = index + 1, **env)
+    if env["common"].get("terraform_render", "files") == "for_each":
+        utils.template_render(path_infrastructure, "nodes.tf.j2", path_render, "nodes.tf", **env)
+    else:
+        for index in range(0, int(env["node"]["count"])):
+            utils.template_render(path_infrastructure, "node.tf.j2", path_render, f"node{(index + 1):0>2}.tf", index = index + 1, **env)
 
+    # libvirt domains are tuned with their performance profile through a xsl transform each
     if(env["provider"] == "libvirt"):
-        shutil.copy(path_infrastructure + "/node.xsl", path_render)
+        for index in range(0, int(env["node"]["count"])):
+            utils.template_render(path_infrastructure, "domain.xsl.j2", path_render, f"node{(index + 1):0>2}.xsl", performance = env["node"][index + 1]["performance"], **env)
+
+        for role in ["iscsi", "qdevice", "examiner"]:
+            if role in env:
+                utils.template_render(path_infrastructure, "domain.xsl.j2", path_render, f"{role}.xsl", performance = env[role]["performance"], **env)
+
+    # containers are built from the base images by this dockerfile
+    if env["provider"] == "container":
+        shutil.copy(path_infrastructure + "/Dockerfile", path_render)
 
     if env["common"]["shared_storage_type"] == "iscsi":
         utils.template_render(path_infrastructure, "iscsi.tf.j2", path_render, "iscsi.tf", **env)
@@ -138,6 +290,48 @@ def infrastructure_render(name):
     return tasks.success()
 
 
+def infrastructure_validate(name):
+    """
+    Validate the rendered infrastructure files of a deployment, without creating anything.
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    path_infrastructure = utils.path_deployment_infrastructure(env["name"])
+
+    #
+    # Validate infrastructure
+    #
+    logging.info("[X] Validating infrastructure...")
+
+    # init
+    logging.info("Initializing Terraform")
+    res = terraform.init(path_infrastructure)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+    else:
+        logs.payload("terraform.log", tasks.get_stdout(res))
+
+    # validate
+    logging.info("Validating files")
+    res = terraform.validate(path_infrastructure)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+    else:
+        logs.payload("terraform.log", tasks.get_stdout(res))
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
 def infrastructure_execute(name):
     """
     Create infrastructure for a deployment.
@@ -164,7 +358,7 @@ def infrastructure_execute(name):
         logging.critical(tasks.get_stderr(res))
         return res
     else:
-        logging.debug(tasks.get_stdout(res))
+        logs.payload("terraform.log", tasks.get_stdout(res))
 
     # apply
     logging.info(f"Executing plan")
@@ -173,10 +367,20 @@ def infrastructure_execute(name):
         logging.critical(tasks.get_stderr(res))
         return res
     else:
-        logging.debug(tasks.get_stdout(res))
+        logs.payload("terraform.log", tasks.get_stdout(res))
 
     logging.info("OK\n")
 
+    return infrastructure_outputs(env)
+
+
+def infrastructure_outputs(env):
+    """
+    Adds the outputs of the created infrastructure to the environment of a deployment.
+    """
+    name = env["name"]
+    path_infrastructure = utils.path_deployment_infrastructure(name)
+
     #
     # Get terraform outputs
     #
@@ -189,7 +393,7 @@ def infrastructure_execute(name):
         logging.critical(tasks.get_stderr(res))
         return res
     else:
-        logging.debug(tasks.get_stdout(res))
+        logs.payload("terraform.log", tasks.get_stdout(res))
 
     # capture output
     logging.info(f"Capturing output")
@@ -198,33 +402,196 @@ def infrastructure_execute(name):
         logging.critical(tasks.get_stderr(res))
         return res
     else:
-        logging.debug(tasks.get_stdout(res))
+        logs.payload("terraform.log", tasks.get_stdout(res))
 
     # load as json
     terraform_json = json.loads(tasks.get_stdout(res))
 
-    # translate "a_b = v" outputs to env[terraform][a][b] = v
     logging.info(f"Translating output")
-    for _, (k, v) in enumerate(terraform_json.items()):
-        if v["value"]:
-            key, _, subkey = k.partition("_")
-            if "node" in key:
-                key, index = key[:len("node")], key[len("node"):]
-                env[key][int(index)][subkey] = v["value"]
-            else:
-                env[key][subkey] = v["value"]
+    utils.outputs_translate(env, terraform_json)
 
     # save enriched enviroment data        
     utils.environment_save(name, **env)
     
     logging.info(f"Updated environment")
-    logging.debug(f"{json.dumps(env, indent = 4)}\n")
+    logs.payload("environment.json", f"{json.dumps(env, indent = 4)}\n")
 
     logging.info("OK\n")
     
     return tasks.success()
 
 
+def infrastructure_plan(name):
+    """
+    Adds the names and private addresses of the machines to the environment of a deployment before creating them,
+    so provisioning files can be rendered beforehand. They are the ones given in the infrastructure files, and
+    public addresses are left empty until machines are created.
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    logging.info("[X] Planning addresses...")
+
+    private = ipaddress.ip_network(env["common"]["private_ip_range"])
+    ring1 = ipaddress.ip_network(env["common"]["network"]["ring1_ip_range"])
+    numbers = libvirt.private_host_numbers
+
+    for role in ["iscsi", "qdevice", "examiner"]:
+        if role in env:
+            env[role].update({ "name": f"{name}-{role}", "private_ip": str(private[numbers[role]]), "public_ip": "" })
+
+    for index in range(1, int(env["node"]["count"]) + 1):
+        env["node"][index].update({ "name": f"{name}-node{index:0>2}", "private_ip": str(private[numbers["node"] + index]), "public_ip": "" })
+        if env["common"]["network"]["ring1"]:
+            env["node"][index]["ring1_ip"] = str(ring1[numbers["node"] + index])
+
+    for _, _, host_name, _, _, _ in utils.get_hosts_from_env(env):
+        logging.info(f"Planned {host_name}")
+
+    utils.environment_save(name, **env)
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
+def infrastructure_execute_pipelined(name, function, skipped = None):
+    """
+    Create infrastructure for a deployment, running a function on every host as soon as its machine is created
+    and ready, while the rest are still being created. The function receives the host entry from
+    utils.get_hosts_from_env. If skipped is given, it is called with the entry of every host the function is not
+    run on, as soon as it is known. Returns the results of all of them, along with the one of the creation if it failed.
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return [res]
+
+    path_infrastructure = utils.path_deployment_infrastructure(env["name"])
+
+    #
+    # Create infrastructure
+    #
+    logging.info("[X] Creating infrastructure, provisioning machines as they are created...")
+
+    # init
+    logging.info("Initializing Terraform")
+    res = terraform.init(path_infrastructure)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return [res]
+    else:
+        logs.payload("terraform.log", tasks.get_stdout(res))
+
+    pending = { host[2]: host for host in utils.get_hosts_from_env(env) }
+
+    results = []
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(pending))) as executor:
+        futures = []
+
+        def dispatch(addresses):
+            for host_name, address in addresses.items():
+                if host_name in pending and address:
+                    role, index, _, _, username, password = pending.pop(host_name)
+                    logging.info(f"Machine created [{host_name}={address}]")
+                    futures.append( executor.submit(logs.hosted(host_name, ready.on_ready), env, [(role, index, host_name, address, username, password)], function, skipped) )
+
+        payload = logs.payload_lines("terraform.log")
+
+        uri = env["common"]["qemu_uri"]
+
+        def on_line(line):
+            payload(line)
+            # ie: libvirt_domain.node01_domain: Creation complete after 31s [id=...]
+            # The domain is asked to libvirt, as the Terraform state is only complete once applied. Domains
+            # libvirt knows no address of yet are reached at the addresses in the outputs
+            match = re.match(r"^libvirt_domain\.\S+: Creation complete .*\[id=([^\]]+)\]", line)
+            if match is not None:
+                domain = match.group(1)
+                dispatch({ libvirt.domain_name(uri, domain): libvirt.domain_address(uri, domain) })
+
+        # apply
+        logging.info(f"Executing plan")
+        res = terraform.apply_streamed(path_infrastructure, on_line)
+        if tasks.has_failed(res):
+            logging.critical(tasks.get_stderr(res))
+            results.append(res)
+        else:
+            res = infrastructure_outputs(env)
+            if tasks.has_failed(res):
+                results.append(res)
+            else:
+                # machines not seen while applying are reached at the addresses in the outputs
+                dispatch({ host_name: host for _, _, host_name, host, _, _ in utils.get_hosts_from_env(env) })
+
+        # machines not created at all are not provisioned
+        if skipped is not None:
+            for host in pending.values():
+                skipped(*host)
+
+        for future in futures:
+            results += future.result()
+
+    return results
+
+
+def provision_timing(env):
+    """
+    Computes the corosync and sbd timings of a deployment, probing the latency between nodes first if enabled.
+    They are kept in the environment under timing.profile, so the grains and later runs use the same values.
+    """
+    logging.info("[X] Computing cluster timings...")
+
+    latency = None
+    nodes = [ host for host in utils.get_hosts_from_env(env) if host[0] == "node" ]
+
+    # machines may not exist yet when creation and provisioning are pipelined
+    if env["timing"]["probe"] and len(nodes) > 1 and nodes[0][3] == "":
+        logging.warning("Latency probe skipped, nodes are not created yet")
+    elif env["timing"]["probe"] and len(nodes) > 1:
+        ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+        _, _, name, host, username, password = nodes[0]
+        targets = [ env["node"][index]["private_ip"] for _, index, _, _, _, _ in nodes[1:] ]
+
+        res = ssh.wait_for_login(username, password, host)
+        if tasks.has_succeeded(res):
+            res, latency = timing.latency_probe(username, password, host, targets)
+        if tasks.has_failed(res):
+            logging.critical(f"Cannot probe latency between nodes")
+            logging.critical(tasks.get_stderr(res))
+            return res
+
+        logging.info(f"Latency from {name} to the rest of nodes: {latency['average']:.3f} ms average, {latency['maximum']:.3f} ms maximum")
+
+    res, profile = timing.compute(env, latency)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    totem = timing.tunes_totem(env)
+    logging.info(f"Timing profile {env['timing']['preset'] or 'default'}: {', '.join(f'{key}={value}' for key, value in profile.items())}")
+    if not totem:
+        logging.info("Totem timings are left to corosync, no preset, override nor probe given")
+
+    env["timing"]["profile"] = profile
+    env["timing"]["totem"] = totem
+    utils.environment_save(env["name"], **env)
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
 def provision_render(name):
     """
     Render salt files for a deployment.
@@ -237,6 +604,10 @@ def provision_render(name):
         logging.critical(tasks.get_stderr(res))
         return res
 
+    res = provision_timing(env)
+    if tasks.has_failed(res):
+        return res
+
     #
     # Copy provision files
     #
@@ -255,8 +626,7 @@ def provision_render(name):
         utils.template_render(path_provision, "grains.j2", path_render, f"{name}.grains", role=role, index=index, env=env, **env)
 
         logging.info(f"Rendered {name}.grains")
-        with open(f"{path_render}/{name}.grains", "r") as f:
-            logging.debug(f"{f.read()}")
+        logging.debug(f"Rendered grains written to {path_render}/{name}.grains")
 
     logging.info("OK\n")
 
@@ -274,129 +644,548 @@ def provision_render(name):
 
     logging.info("OK\n")
 
+    if env.get("provision", {}).get("backend", "local") == "salt-ssh":
+        provision_render_saltssh(env)
+
     return tasks.success()
 
 
+def provision_render_saltssh(env):
+    """
+    Render roster and configuration to provision a deployment from here through salt-ssh.
+    Every role gets its own configuration, as each one has its own file and pillar roots.
+    """
+    logging.info("[X] Rendering salt-ssh roster and configuration...")
+
+    path_render = utils.path_deployment_saltssh(env["name"])
+    path_provision = utils.path_provision(env["provider"])
+    path_deployment_provision = utils.path_deployment_provision(env["name"])
+    formulas = env["provision"].get("formulas", "/usr/share/salt-formulas/states")
+
+    # cluster key, served as salt://key
+    os.makedirs(f"{path_render}/files/key", exist_ok = True)
+    for key in ["id_rsa", "id_rsa.pub"]:
+        shutil.copy(f"{path_deployment_provision}/{key}", f"{path_render}/files/key/")
+
+    roster = {}
+    for role, index, name, host, username, password in utils.get_hosts_from_env(env):
+        with open(f"{path_deployment_provision}/{name}.grains", "r") as f:
+            grains = yaml.load(f, Loader=yaml.FullLoader)
+
+        roster[name] = {
+            "host": host,
+            "user": username,
+            "passwd": password,
+            "sudo": username != "root",
+            "minion_opts": { "grains": grains },
+        }
+
+        entry = utils.get_host_entry(env, role, index)
+        if "public_key_file" in entry:
+            roster[name]["priv"] = os.path.expanduser(entry["public_key_file"][:-len(".pub")])
+
+        file_roots = [ f"{path_provision}/{role}/file_roots", f"{path_provision}/{role}", path_provision, f"{path_render}/files", formulas ]
+        pillar_roots = [ f"{path_provision}/{role}/pillar_roots" ]
+        saltssh.config_save(path_render, role, file_roots, pillar_roots, utils.path_deployment_known_hosts(env["name"]))
+
+    saltssh.roster_save(path_render, roster)
+
+    logging.info("OK\n")
+
+
 def upload_task(name, host, username, password, origin, destiny):
-    res = ssh.safe_copy_to_host(username, password, host, origin, destiny)
+    res = ssh.copy_to_host(username, password, host, origin, destiny)
     if tasks.has_failed(res):
         logging.critical(f"Cannot copy [{origin}] -> [({name}={host}):{destiny}]")
         logging.critical(tasks.get_stderr(res))
-    
-    logging.info(f"Uploaded [{origin}] -> [({name}={host}):{destiny}]")
+    else:
+        logging.info(f"Uploaded [{origin}] -> [({name}={host}):{destiny}]")
+
+    return res
 
 
-def upload(name):
+def upload_host(env, role, index, name, host, username, password):
     """
-    Upload provisioning files for a deployment.
+    Upload provisioning files to a given host.
     """
-    #
-    # Check deployment does exist
-    #
-    res, env = utils.deployment_verify(name)
+    command = f"'rm -rf /tmp/salt && mkdir -p /tmp/salt/file_roots/key'"
+    res = ssh.run(username, password, host, command)
     if tasks.has_failed(res):
+        logging.critical(f"Cannot create directory structure on [{name}={host}]")
         logging.critical(tasks.get_stderr(res))
         return res
 
-    #
-    # Execute uploads
-    #
-    logging.info("[X] Uploading files...")
+    # copy salt directory and grains files to machines
+    path_deployment_provision = utils.path_deployment_provision(env["name"])
+    path_provision = utils.path_provision(env["name"])
 
-    for role, _, name, host, username, password in utils.get_hosts_from_env(env):
-        command = f"rm -rf /tmp/salt"
-        ssh.run(username, password, host, command)
+    uploads = []
+    uploads.append( (f"{path_provision}/provision.sh", f"/tmp/salt/") )
+    uploads.append( (f"{path_provision}/phases.py", f"/tmp/salt/") )
+    uploads.append( (f"{path_provision}/sbd_latency.py", f"/tmp/salt/") )
+    uploads.append( (f"{path_provision}/minion", "/tmp/salt/") )
+    uploads.append( (f"{path_deployment_provision}/{name}.grains", "/tmp/salt/grains") )
+    uploads.append( (f"{path_provision}/{role}/file_roots", f"/tmp/salt/") )
+    uploads.append( (f"{path_provision}/common", "/tmp/salt/file_roots/") )
+    uploads.append( (f"{path_provision}/{role}/pillar_roots", f"/tmp/salt/file_roots/") )
+    uploads.append( (f"{path_deployment_provision}/id_rsa", "/tmp/salt/file_roots/key/") )
+    uploads.append( (f"{path_deployment_provision}/id_rsa.pub", "/tmp/salt/file_roots/key/") )
 
-        command = f"mkdir /tmp/salt"
-        res = ssh.run(username, password, host, command)
-        if tasks.has_failed(res):
-            logging.info(f"Cannot create directory structure on [{name}={host}]")
-            logging.info(tasks.get_stderr(res))
-            return res
+    # Execute upload in parallel
+    with concurrent.futures.ThreadPoolExecutor(len(uploads)) as executor:
+        futures = [ executor.submit(logs.hosted(name, upload_task), name, host, username, password, origin, destiny) for origin, destiny in uploads ]
+        results = [ future.result() for future in futures ]
 
-        command = f"mkdir /tmp/salt/file_roots"
-        res = ssh.run(username, password, host, command)
-        if tasks.has_failed(res):
-            logging.info(f"Cannot create file_roots directory on [{name}={host}]")
-            logging.info(tasks.get_stderr(res))
-            return res
+    for result in results:
+        if tasks.has_failed(result):
+            return result
 
-        command = f"mkdir /tmp/salt/file_roots/key"
-        res = ssh.run(username, password, host, command)
-        if tasks.has_failed(res):
-            logging.info(f"Cannot create key directory on [{name}={host}]")
-            logging.info(tasks.get_stderr(res))
-            return res
+    return tasks.success()
 
-    uploads = []
 
-    # copy salt directory and grains files to machines
+#
+# Paths of the shared provisioning files in hosts, with relay upload
+#
+relay_payload = "/tmp/salt-payload.tar.gz"
+relay_path = "/tmp/salt-payload"
+
+def upload_payload(env, known_hosts):
+    """
+    Packs the provisioning files shared by all hosts, along with the cluster key and the given known_hosts
+    lines with the host keys of all of them, in a single archive. Returns its path.
+    """
     path_deployment_provision = utils.path_deployment_provision(env["name"])
-    path_provision = utils.path_provision(env["name"])
-    for role, _, name, host, username, password in utils.get_hosts_from_env(env):
-        uploads.append( (name, host, username, password, f"{path_provision}/provision.sh", f"/tmp/salt/") )
-        uploads.append( (name, host, username, password, f"{path_provision}/minion", "/tmp/salt/") )
-        uploads.append( (name, host, username, password, f"{path_deployment_provision}/{name}.grains", "/tmp/salt/grains") )
-        uploads.append( (name, host, username, password, f"{path_provision}/{role}/file_roots", f"/tmp/salt/") )
-        uploads.append( (name, host, username, password, f"{path_provision}/common", "/tmp/salt/file_roots/") )
-        uploads.append( (name, host, username, password, f"{path_provision}/{role}/pillar_roots", f"/tmp/salt/file_roots/") )
-        uploads.append( (name, host, username, password, f"{path_deployment_provision}/id_rsa", "/tmp/salt/file_roots/key/") )
-        uploads.append( (name, host, username, password, f"{path_deployment_provision}/id_rsa.pub", "/tmp/salt/file_roots/key/") )
-        
-        
-    upload_tasks  = [threading.Thread(target=upload_task, args=(name, host, username, password, origin, destiny)) for name, host, username, password, origin, destiny in uploads]
+    path_provision = utils.path_provision(env["provider"])
+    payload = f"{path_deployment_provision}/payload.tar.gz"
 
-    # Execute upload in parallel
-    for task in upload_tasks:
-        task.start()
+    def shared(info):
+        return None if "__pycache__" in info.name or info.name.endswith(".j2") else info
 
-    for task in upload_tasks:
-        task.join()
+    with tarfile.open(payload, "w:gz") as tar:
+        tar.add(path_provision, arcname=".", filter=shared)
+        for key in ["id_rsa", "id_rsa.pub"]:
+            tar.add(f"{path_deployment_provision}/{key}", arcname=f"./key/{key}")
 
-    logging.info("OK\n")
+        with open(f"{path_deployment_provision}/relay_known_hosts", "w") as f:
+            f.write(known_hosts)
+        tar.add(f"{path_deployment_provision}/relay_known_hosts", arcname="./key/known_hosts")
 
-    return tasks.success()
+    return payload
 
 
-def provision_task(name, host, username, password, phases):
+def relay_authorize_host(env, role, index, name, host, username, password):
     """
-    Executes the provisioning in a given host.
+    Authorizes the cluster key in a given host, so other hosts can relay files to it. Returns the result with
+    the host keys of the host as known_hosts lines for its private address in its stdout, read along the session
+    already verified against the known_hosts of the deployment, so hosts relaying to it can check them.
     """
-    #
-    # Execute provisioning
-    #
-    for phase in phases:
-        res = ssh.run(username, password, host, f"sudo sh /tmp/salt/provision.sh -{phase[0]} -l /var/log/provision.log")
-        if tasks.has_failed(res):
-            logging.info(f"phase {phase} error -> [{name}={host}]")
-            break
-        else:
-            logging.info(f"phase {phase} executed -> [{name}={host}]")
+    with open(f"{utils.path_deployment_provision(env['name'])}/id_rsa.pub", "r") as f:
+        key = f.read().strip()
 
-    #
-    # Independently of success of provisioning process, cat logs
-    #
-    destiny = f"./{name}.tmp"
-    #logs = ["/var/log/provision.log", "/var/log/salt/minion"]
-    logs = ["/var/log/provision.log"]
-    for log in logs:
-        rcopy = ssh.copy_from_host(username, password, host, log, destiny)
-        if tasks.has_succeeded(rcopy):
-            with open(destiny, "r") as f:
-                logging.debug(f"[{name}={host}] {log} =\n{f.read()}")
-    tasks.run(f"rm -f {destiny}")
+    command = f"'mkdir -p ~/.ssh && chmod 700 ~/.ssh && echo \"{key}\" >> ~/.ssh/authorized_keys && chmod 600 ~/.ssh/authorized_keys && cat /etc/ssh/ssh_host_*_key.pub'"
+    res = ssh.run(username, password, host, command)
+    if tasks.has_failed(res):
+        logging.critical(f"Cannot authorize cluster key on [{name}={host}]")
+        logging.critical(tasks.get_stderr(res))
+        return res
 
-    #
-    # Log global result
-    #
-    if tasks.has_succeeded(res):
-        logging.info(f"provisioning SUCCESS -> [{name}={host}] for {phases}")
-    else:
-        logging.error(f"provisioning FAILED -> [{name}={host}] for {phases}")
+    # ie: ssh-ed25519 AAAAC3Nza... root@host
+    private_ip = utils.get_host_entry(env, role, index)["private_ip"]
+    keys = [ line.split()[:2] for line in tasks.get_stdout(res).splitlines() if len(line.split()) >= 2 ]
+    if len(keys) == 0:
+        return tasks.failure(f"No host keys found on [{name}={host}]")
 
-    return res
+    return tasks.success("".join(f"{private_ip} {keytype} {value}\n" for keytype, value in keys))
 
-#
+
+def relay_host(env, hosts, width, position):
+    """
+    Sets up the provisioning files of the host at a given position of hosts from the shared files it received,
+    uploads its grains and relays the shared files to its children in a tree of the given width, over the
+    private network. Children go on in parallel. Returns the results of the whole subtree.
+    """
+    role, _, name, host, username, password = hosts[position]
+
+    # same layout upload_host leaves
+    p = relay_path
+    command = (f"'rm -rf {p} /tmp/salt && mkdir -p {p} /tmp/salt/file_roots/key && tar -xzf {relay_payload} -C {p}"
+               f" && chmod 600 {p}/key/id_rsa && cp -r {p}/provision.sh {p}/phases.py {p}/sbd_latency.py {p}/minion /tmp/salt/"
+               f" && cp -r {p}/{role}/file_roots /tmp/salt/ && cp -r {p}/common {p}/{role}/pillar_roots /tmp/salt/file_roots/"
+               f" && cp {p}/key/id_rsa {p}/key/id_rsa.pub /tmp/salt/file_roots/key/'")
+    res = ssh.run(username, password, host, command)
+    if tasks.has_failed(res):
+        logging.critical(f"Cannot set up provisioning files on [{name}={host}]")
+        logging.critical(tasks.get_stderr(res))
+        return [res]
+
+    res = upload_task(name, host, username, password, f"{utils.path_deployment_provision(env['name'])}/{name}.grains", "/tmp/salt/grains")
+    if tasks.has_failed(res):
+        return [res]
+
+    def relay(child):
+        child_role, child_index, child_name, _, child_username, _ = hosts[child]
+        private_ip = utils.get_host_entry(env, child_role, child_index)["private_ip"]
+
+        # children are checked against the host keys collected from them beforehand
+        options = f"-o UserKnownHostsFile={relay_path}/key/known_hosts -o StrictHostKeyChecking=yes -o BatchMode=yes"
+        res = ssh.run(username, password, host, f"'scp -i {relay_path}/key/id_rsa {options} {relay_payload} {child_username}@{private_ip}:{relay_payload}'")
+        if tasks.has_failed(res):
+            logging.critical(f"Cannot relay [({name}={host})] -> [{child_name}={private_ip}]")
+            logging.critical(tasks.get_stderr(res))
+            return [res]
+
+        logging.info(f"Relayed [({name}={host})] -> [{child_name}={private_ip}]")
+
+        return relay_host(env, hosts, width, child)
+
+    children = range(position * width + 1, min(position * width + width + 1, len(hosts)))
+
+    results = [res]
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(children))) as executor:
+        futures = [ executor.submit(logs.hosted(hosts[child][2], relay), child) for child in children ]
+        for future in futures:
+            results += future.result()
+
+    return results
+
+
+def upload_relay(env, hosts):
+    """
+    Upload provisioning files to the given hosts, sending the files shared by all of them only once, to the first
+    host, which relays them to other hosts over the private network, and so on, in a tree of width
+    provision.relay_width. Only the grains of every host are uploaded to it from here.
+    Returns the results of all hosts.
+    """
+    # every host must accept the cluster key before relaying starts
+    results = ready.on_ready(env, hosts, functools.partial(relay_authorize_host, env))
+    if tasks.any_failed(results):
+        return results
+
+    payload = upload_payload(env, "".join(tasks.get_stdout(res) for res in results))
+    logging.info(f"Packed shared files in {payload} ({os.path.getsize(payload) / 1024:.0f} KiB)")
+
+    _, _, name, host, username, password = hosts[0]
+    res = upload_task(name, host, username, password, payload, relay_payload)
+    if tasks.has_failed(res):
+        return [res]
+
+    return relay_host(env, hosts, max(1, int(env["provision"]["relay_width"])), 0)
+
+
+def upload(name):
+    """
+    Upload provisioning files for a deployment.
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+    #
+    # Execute uploads, on every host as soon as it is ready
+    #
+    logging.info("[X] Uploading files...")
+
+    hosts = utils.get_hosts_from_env(env)
+
+    if env["provision"].get("upload", "direct") == "relay":
+        results = upload_relay(env, hosts)
+    else:
+        results = ready.on_ready(env, hosts, functools.partial(upload_host, env))
+
+    if tasks.any_failed(results):
+        return tasks.failure("Cannot upload files to all hosts")
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
+#
+# provision.sh flag of every phase
+#
+provision_flags = {
+    "install": "i",
+    "config": "c",
+    "start": "s",
+    "iscsi": "n",
+    "sbd_probe": "b",
+}
+
+def provision_output(stdout):
+    """
+    Parses the output of provision.sh. Returns the (phase, return code, seconds) of every "phase" line and the
+    (read p99, write p99, watchdog, msgwait) of every "sbd" line, in order, ignoring any other line
+    """
+    phase_lines = []
+    sbd_lines = []
+    for line in stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 4 and fields[0] == "phase":
+            phase_lines.append(tuple(fields[1:]))
+        elif len(fields) == 5 and fields[0] == "sbd":
+            sbd_lines.append(tuple(fields[1:]))
+    return phase_lines, sbd_lines
+
+
+def provision_task(settings, name, host, username, password, phases, sbd_timing = None):
+    """
+    Executes the provisioning phases in a given host, in a single ssh session. With provision.single_session,
+    consecutive config and start phases run in a single salt process. Returns the result with a
+    "<host name> <phase> <return code> <seconds>" line in its stdout for every executed phase, and a
+    "<host name> sbd <read p99> <write p99> <watchdog> <msgwait>" line for every sbd latency measured.
+    If sbd_timing has the watchdog and msgwait timeouts, they are given to the start phase as pillar.
+    If provision.stall_timeout is set, a watchdog tracks the progress of the run as the output streamed back
+    along the session, with the provisioning log mirrored on it. If it makes no progress for that many seconds,
+    the run is killed and the phases not completed are retried, after provision.stall_backoff seconds, doubled
+    on every retry, up to provision.stall_retries times.
+    """
+    idle = settings.get("stall_timeout", 0)
+    retries = settings.get("stall_retries", 0)
+    delay = settings.get("stall_backoff", 30)
+
+    #
+    # Execute provisioning, retrying the pending phases after a stall
+    #
+    executed = []
+    pending = list(phases)
+    while True:
+        flags = " ".join(f"-{provision_flags[phase]}" for phase in pending)
+        if settings.get("single_session", False):
+            flags = f"{flags} -m"
+        if sbd_timing and "start" in pending:
+            flags = f"{flags} -t {sbd_timing['watchdog']}:{sbd_timing['msgwait']}"
+        command = f"sudo sh /tmp/salt/provision.sh {flags} -l /var/log/provision.log"
+        if idle:
+            res = ssh.run_watched(username, password, host, f"{command} -w", idle)
+        else:
+            res = ssh.run(username, password, host, command)
+
+        phase_lines, sbd_lines = provision_output(tasks.get_stdout(res))
+        for phase, return_code, seconds in phase_lines:
+            executed.append(f"{name} {phase} {return_code} {seconds}")
+            if return_code == "0":
+                logging.info(f"phase {phase} executed in {seconds} seconds -> [{name}={host}]")
+                if phase in pending:
+                    pending.remove(phase)
+            else:
+                logging.info(f"phase {phase} error after {seconds} seconds -> [{name}={host}]")
+        for read_p99, write_p99, watchdog, msgwait in sbd_lines:
+            executed.append(f"{name} sbd {read_p99} {write_p99} {watchdog} {msgwait}")
+            logging.info(f"sbd device p99 latency read {read_p99} ms, write {write_p99} ms -> watchdog {watchdog}s, msgwait {msgwait}s -> [{name}={host}]")
+
+        # only stalls are retried, failed phases fail the same way again
+        if tasks.get_return_code(res) != 125 or len(pending) == 0:
+            break
+
+        # kill whatever is left of the run, ie: a hung zypper or SUSEConnect
+        ssh.run(username, password, host, "sudo sh /tmp/salt/provision.sh -k", timeout=60)
+
+        executed.append(f"{name} {pending[0]} 125 {idle}")
+
+        if retries == 0:
+            logging.error(f"phases {pending} stalled for {idle} seconds, no retries left -> [{name}={host}]")
+            break
+
+        logging.warning(f"phases {pending} stalled for {idle} seconds, retrying in {delay} seconds -> [{name}={host}]")
+        time.sleep(delay)
+        retries = retries - 1
+        delay = delay * 2
+
+    res = (tasks.get_return_code(res), "\n".join(executed), tasks.get_stderr(res))
+
+    #
+    # Independently of success of provisioning process, copy logs next to the log of the host,
+    # or log them if there is no log directory
+    #
+    #remote_logs = ["/var/log/provision.log", "/var/log/salt/minion"]
+    remote_logs = ["/var/log/provision.log"]
+    for log in remote_logs:
+        destiny = logs.payload_path(f"{name}.{os.path.basename(log)}")
+        if destiny is not None:
+            rcopy = ssh.copy_from_host(username, password, host, log, destiny)
+            if tasks.has_succeeded(rcopy):
+                logging.debug(f"[{name}={host}] {log} copied to {destiny}")
+            continue
+
+        destiny = f"./{name}.tmp"
+        rcopy = ssh.copy_from_host(username, password, host, log, destiny)
+        if tasks.has_succeeded(rcopy):
+            with open(destiny, "r") as f:
+                logging.debug(f"[{name}={host}] {log} =\n{f.read()}")
+        tasks.run(f"rm -f {destiny}")
+
+    #
+    # Log global result
+    #
+    if tasks.has_succeeded(res):
+        logging.info(f"provisioning SUCCESS -> [{name}={host}] for {phases}")
+    else:
+        logging.error(f"provisioning FAILED -> [{name}={host}] for {phases}")
+
+    return res
+
+
+def provision_ssh_sbd_device(env, name, host, username, password):
+    """
+    Looks up the multipath sbd device of a node on the node itself, as pillars are rendered here with salt-ssh.
+    Returns the result and the device, None if the node has its device given in the grains
+    """
+    with open(f"{utils.path_deployment_provision(env['name'])}/{name}.grains", "r") as f:
+        grains = yaml.load(f, Loader=yaml.FullLoader)
+
+    if grains["shared_storage_type"] != "iscsi" or grains.get("sbd_disk_device") or not grains.get("iscsi_multipath"):
+        return tasks.success(), None
+
+    # ie: [2:0:0:0]  disk  LIO-ORG  sbd  4.0  /dev/sda  36001405c0d5b5f7a3c64e4c9a0c5e0c1
+    res = ssh.run(username, password, host, "lsscsi -i")
+    devices = [ line.split()[-1] for line in tasks.get_stdout(res).splitlines() if "LIO-ORG" in line ]
+    if tasks.has_failed(res) or len(devices) < grains["sbd_disk_index"]:
+        return tasks.failure(f"Cannot find the sbd device on [{name}={host}]: {tasks.get_stderr(res)}"), None
+
+    return tasks.success(), f"/dev/mapper/{devices[grains['sbd_disk_index'] - 1]}"
+
+
+def provision_ssh_task(env, role, name, host, username, password, phases):
+    """
+    Executes the provisioning phases in a given host from here through salt-ssh. Returns the result with
+    a "<host name> <phase> <return code> <seconds>" line in its stdout for every executed phase, like provision_task.
+    """
+    path = utils.path_deployment_saltssh(env["name"])
+
+    functions = {
+        "config": "state.highstate saltenv=config",
+        "start": "state.highstate saltenv=base",
+        "iscsi": "state.sls on_start.iscsi_initiator saltenv=base",
+    }
+
+    executed = []
+    res = tasks.success()
+    for phase in phases:
+        function = functions[phase]
+        if phase == "start" and role == "node":
+            res, device = provision_ssh_sbd_device(env, name, host, username, password)
+            if tasks.has_failed(res):
+                executed.append(f"{name} {phase} 1 0")
+                logging.error(tasks.get_stderr(res))
+                break
+            if device is not None:
+                function = f"{function} pillar='{json.dumps({ 'cluster': { 'sbd': { 'device': device } } })}'"
+
+        start = time.time()
+        res = saltssh.run(path, role, name, function)
+        seconds = int(time.time() - start)
+
+        with open(f"{path}/{name}.log", "a") as f:
+            f.write(tasks.get_stdout(res))
+            f.write(tasks.get_stderr(res))
+
+        if saltssh.has_succeeded(res, name):
+            executed.append(f"{name} {phase} 0 {seconds}")
+            logging.info(f"phase {phase} executed in {seconds} seconds -> [{name}={host}]")
+        else:
+            executed.append(f"{name} {phase} 1 {seconds}")
+            logging.info(f"phase {phase} error after {seconds} seconds -> [{name}={host}]")
+            res = tasks.failure(f"Phase {phase} failed on [{name}={host}], see {path}/{name}.log")
+            break
+
+    res = (tasks.get_return_code(res), "\n".join(executed), tasks.get_stderr(res))
+
+    #
+    # Log global result
+    #
+    if tasks.has_succeeded(res):
+        logging.info(f"provisioning SUCCESS -> [{name}={host}] for {phases}")
+    else:
+        logging.error(f"provisioning FAILED -> [{name}={host}] for {phases}")
+
+    return res
+
+
+def iscsi_target_task(function, target, name, host, username, password, phases):
+    """
+    Provisions the iscsi server with a given provisioning function, and signals when its target is exported or cannot be
+    """
+    try:
+        res = function(name, host, username, password, phases)
+        if tasks.has_succeeded(res):
+            target["exported"] = time.time()
+            logging.info(f"iSCSI target exported -> [{name}={host}]")
+        return res
+    finally:
+        target["event"].set()
+
+
+def iscsi_initiator_task(function, target, timeout, name, host, username, password, phases):
+    """
+    Provisions a node with a given provisioning function and logs it in the iscsi target as soon as it is exported.
+    The time since the target was exported until the node is logged in is reported as the iscsi_latency phase.
+    The sbd_probe phase, if given, runs once logged in, as the sbd device is not there before.
+    """
+    probe = [ phase for phase in phases if phase == "sbd_probe" ]
+
+    res = function(name, host, username, password, [ phase for phase in phases if phase not in probe ])
+    if tasks.has_failed(res):
+        return res
+
+    if not target["event"].wait(timeout) or target["exported"] is None:
+        logging.error(f"iSCSI target not exported, cannot log in -> [{name}={host}]")
+        return (1, tasks.get_stdout(res), "iSCSI target not exported")
+
+    login = function(name, host, username, password, ["iscsi"])
+    latency = time.time() - target["exported"]
+    if tasks.has_succeeded(login):
+        logging.info(f"iSCSI target discovered {latency:.1f} seconds after being exported -> [{name}={host}]")
+
+    executed = [ line for line in [tasks.get_stdout(res), tasks.get_stdout(login)] if line ]
+    executed.append(f"{name} iscsi_latency {tasks.get_return_code(login)} {latency:.1f}")
+
+    if probe and tasks.has_succeeded(login):
+        probed = function(name, host, username, password, probe)
+        executed += [ line for line in [tasks.get_stdout(probed)] if line ]
+        return (tasks.get_return_code(probed), "\n".join(executed), tasks.get_stderr(probed))
+
+    return (tasks.get_return_code(login), "\n".join(executed), tasks.get_stderr(login))
+
+
+def provision_sbd_timing(results):
+    """
+    Returns the sbd watchdog and msgwait timeouts covering the worst latency of the sbd device measured by any
+    node, from the results of provision_task, empty if no node measured it
+    """
+    sbd_timing = {}
+    for result in results:
+        for line in tasks.get_stdout(result).splitlines():
+            fields = line.split()
+            if len(fields) == 6 and fields[1] == "sbd":
+                watchdog, msgwait = int(fields[4]), int(fields[5])
+                sbd_timing["watchdog"] = max(sbd_timing.get("watchdog", 0), watchdog)
+                sbd_timing["msgwait"] = max(sbd_timing.get("msgwait", 0), msgwait)
+    return sbd_timing
+
+
+def provision_report(results):
+    """
+    Logs the results of every phase executed on every host, from the results of provision_task
+    """
+    report = {}
+    for result in results:
+        for line in tasks.get_stdout(result).splitlines():
+            fields = line.split()
+            if len(fields) == 4:
+                host_name, phase, return_code, seconds = fields
+                report.setdefault(host_name, []).append(f"{phase}={'OK' if return_code == '0' else 'FAILED'} ({seconds}s)")
+
+    logging.info("Provisioning results:")
+    for host_name, phases in report.items():
+        logging.info(f"    {host_name}: {', '.join(phases)}")
+
+#
 # Globals to comunicate with clock task
 #
 clock_task_mutex = threading.Lock()
@@ -424,9 +1213,12 @@ def clock_task(subject):
             logging.info(f"[{subject}] {elapsed} seconds elapsed")
 
 
-def provision_execute(name):
+def provision_execute(name, upload = False, first = None):
     """
     Executes in parallel the provisioning of the nodes.
+    If upload is set, provisioning files are uploaded to every host as soon as it is ready, and its first stage starts right after.
+    If first is given, it runs the first stage on the hosts instead, taking the function to run on every host and
+    the one to call with every host it is not run on, and returns its results.
     """
     #
     # Check deployment does exist
@@ -436,6 +1228,8 @@ def provision_execute(name):
         logging.critical(tasks.get_stderr(res))
         return res
 
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
     #
     # Launch provision.sh
     #
@@ -456,52 +1250,181 @@ def provision_execute(name):
    
     clock.start()     
 
-    group1 = [ host for host in hosts]
-    group2 = [ host for host in hosts if host[0] != "node" or "node01" in host[2]]
-    group3 = [ host for host in hosts if host[0] == "node" and "node01" not in host[2]]
-
-    provision_tasks1  = [(provision_task, name, host, username, password, ["install", "config"]) for role, index, name, host, username, password in group1]
-    provision_tasks2  = [(provision_task, name, host, username, password, ["start"])             for role, index, name, host, username, password in group2]
-    stages = [provision_tasks1, provision_tasks2]
-
-    serialized_joining = env["debug"]["serialized_join"]
-    if serialized_joining:
-        for _, _, name, host, username, password in group3:
-            new_provision_task = [(provision_task, name, host, username, password, ["start"])]
+    # With a single session, hosts other than nodes are completely provisioned in the first stage,
+    # as their start does not depend on other hosts, running config and start in a single salt process
+    single_session = env.get("provision", {}).get("single_session", False)
+
+    # With salt-ssh, hosts are provisioned from here and there is no salt to install on them
+    backend = env.get("provision", {}).get("backend", "local")
+
+    # The sbd device is probed by every node in the first stage, and the timeouts covering the worst latency
+    # measured are given to all of them when they start
+    sbd_probe = env["timing"].get("sbd_probe", False) and backend == "local"
+    sbd_timing = {}
+
+    def provisioner(role):
+        if backend == "salt-ssh":
+            return functools.partial(provision_ssh_task, env, role)
+        return functools.partial(provision_task, env["provision"], sbd_timing = sbd_timing if role == "node" else None)
+
+    # The iscsi server is always started in the first stage, and nodes log in its target as soon as it is exported,
+    # not when the first stage is over
+    iscsi = env["common"]["shared_storage_type"] == "iscsi"
+    iscsi_target = { "event": threading.Event(), "exported": None }
+    iscsi_timeout = env.get("provision", {}).get("iscsi_timeout", 2400)
+
+    def started_first(role):
+        return role != "node" and (single_session or role == "iscsi")
+
+    def first_phases(role):
+        phases = ["install", "config", "start"] if started_first(role) else ["install", "config"]
+        if role == "node" and sbd_probe:
+            phases.append("sbd_probe")
+        return phases[1:] if backend == "salt-ssh" else phases
+
+    def first_provisioner(role):
+        if iscsi and role == "iscsi":
+            return functools.partial(iscsi_target_task, provisioner(role), iscsi_target)
+        if iscsi and role == "node":
+            return functools.partial(iscsi_initiator_task, provisioner(role), iscsi_target, iscsi_timeout)
+        return provisioner(role)
+
+    def provision_stages(hosts):
+        group1 = [ host for host in hosts]
+        group2 = [ host for host in hosts if (host[0] != "node" and not started_first(host[0])) or "node01" in host[2]]
+        group3 = [ host for host in hosts if host[0] == "node" and "node01" not in host[2]]
+
+        provision_tasks1  = [(first_provisioner(role), name, host, username, password, first_phases(role)) for role, index, name, host, username, password in group1]
+        provision_tasks2  = [(provisioner(role), name, host, username, password, ["start"])          for role, index, name, host, username, password in group2]
+        stages = [provision_tasks1, provision_tasks2]
+
+        serialized_joining = env["debug"]["serialized_join"]
+        if serialized_joining:
+            for _, _, name, host, username, password in group3:
+                new_provision_task = [(provisioner("node"), name, host, username, password, ["start"])]
+                stages.append(new_provision_task)
+        else:
+            new_provision_task = [(provisioner("node"), name, host, username, password, ["start"]) for role, index, name, host, username, password in group3]
             stages.append(new_provision_task)
-    else:
-        new_provision_task = [(provision_task, name, host, username, password, ["start"]) for role, index, name, host, username, password in group3]
-        stages.append(new_provision_task)
 
+        return stages
+
+    stages = provision_stages(hosts)
+
+
+    failed = False
+    executed = []
+
+    def first_stage(role, index, name, host, username, password):
+        try:
+            if backend == "local":
+                res = upload_host(env, role, index, name, host, username, password)
+                if tasks.has_failed(res):
+                    return res
+
+            return first_provisioner(role)(name, host, username, password, first_phases(role))
+        finally:
+            # nodes waiting for the target are released whatever happened to the iscsi server
+            if role == "iscsi":
+                iscsi_target["event"].set()
+
+    def first_skipped(role, index, name, host, username, password):
+        if role == "iscsi":
+            iscsi_target["event"].set()
+
+    # First stage runs on every host as soon as it is ready, right after uploading its files
+    if first is not None:
+        logging.info(f"Running stage on hosts as they are created")
+        results = first(first_stage, first_skipped)
+        executed += results
+        failed = tasks.any_failed(results)
+        # the first stage is over, for the iscsi server too
+        iscsi_target["event"].set()
+
+        # the rest of stages reach hosts at the addresses learned while creating them
+        if not failed:
+            res, env = utils.deployment_verify(name)
+            failed = tasks.has_failed(res)
+            stages = [] if failed else provision_stages(utils.get_hosts_from_env(env))[1:]
+    elif upload and backend == "local" and env["provision"].get("upload", "direct") == "relay":
+        # files reach hosts through each other, so the first stage runs once all of them have them
+        logging.info(f"Relaying files to hosts")
+        results = upload_relay(env, hosts)
+        failed = tasks.any_failed(results)
+    elif upload:
+        logging.info(f"Running stage on hosts as they are ready")
+        stages = stages[1:]
+        results = ready.on_ready(env, hosts, first_stage, first_skipped)
+        executed += results
+        failed = tasks.any_failed(results)
+        iscsi_target["event"].set()
 
     for stage in stages:
+        if failed:
+            break
+
+        if sbd_probe and not sbd_timing:
+            sbd_timing.update(provision_sbd_timing(executed))
+            if sbd_timing:
+                logging.info(f"sbd timeouts covering the worst latency measured: watchdog {sbd_timing['watchdog']}s, msgwait {sbd_timing['msgwait']}s")
+
         logging.info(f"Running stage")
         results = []
-        # provision_task1 and 2 are assynchronous.
-        max_executors = len(hosts)
-        # provision_task3 creates the qnetd node (if required)
-        # When the qnetd node exists, it initializes the cluster on node01
-        # When the cluster exists, it joins sequentially all other nodes.
-        # Those steps should be done one after another, so we reduce the
-        # number of executors to 1.
-        if stage == provision_tasks3:
-            max_executors = 1
-        with concurrent.futures.ThreadPoolExecutor(max_executors) as executor:
+        # Stages are assynchronous, all their tasks run in parallel.
+        # The qnetd node (if required) and the iscsi server are started before or along with node01,
+        # which initializes the cluster. When the cluster exists, the rest of nodes join it,
+        # one after another in a stage of their own if joining is serialized.
+        with concurrent.futures.ThreadPoolExecutor(len(stage)) as executor:
             futures = []
             for task in stage:
                 function, host_name, host_ip, username, password, parameters = task
-                futures.append( executor.submit(function, host_name, host_ip, username, password, parameters) )
+                futures.append( executor.submit(logs.hosted(host_name, function), host_name, host_ip, username, password, parameters) )
     
             for future in futures:
                 results.append( future.result() )
 
-        if functools.reduce(lambda x, y: x or tasks.get_return_code(y) != 0, results, False):
-            break
+        executed += results
+        failed = tasks.any_failed(results)
+
+    provision_report(executed)
     
     with clock_task_mutex:        
         clock_task_active = False
     clock.join()
 
+    if failed:
+        return tasks.failure("Provisioning failed")
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
+def check_environment(env):
+    """
+    Validates the environment of a deployment against the schema of its provider and, if it is valid, runs the
+    environmental probes concurrently. All the problems found are reported at once.
+    """
+    logging.info("[X] Checking deployment...")
+
+    problems = check.schema_problems(env)
+
+    # probes need a valid environment
+    if len(problems) == 0:
+        probes = check.probes(env, env["check"]["timeout"])
+        with concurrent.futures.ThreadPoolExecutor(len(probes)) as executor:
+            futures = [ (description, executor.submit(function)) for description, function in probes ]
+            for description, future in futures:
+                found = future.result()
+                logging.debug(f"Probe {description} -> {'FAILED' if found else 'OK'}")
+                problems += found
+
+    for problem in problems:
+        logging.critical(problem)
+
+    if len(problems) > 0:
+        return tasks.failure(f"{len(problems)} problems found in deployment {env['name']}")
+
     logging.info("OK\n")
 
     return tasks.success()
@@ -522,6 +1445,11 @@ def create_infrastructure(filename):
     if tasks.has_failed(res):
         logging.critical(f"Phase 'prepare' failed")
         return res
+
+    res = infrastructure_images(name)
+    if tasks.has_failed(res):
+        logging.critical(f"Phase 'infrastructure_images' failed")
+        return res
     
     res = infrastructure_render(name)
     if tasks.has_failed(res):
@@ -536,6 +1464,39 @@ def create_infrastructure(filename):
     return tasks.success()
 
 
+def validate_infrastructure(filename):
+    """
+    Renders the infrastructure files of a deployment and validates them. Nothing is created: a deployment
+    prepared only to be validated is removed afterwards, and an already existing one is validated as it is.
+    """
+    env = read_deployment_file(filename)
+
+    name = env["name"]
+
+    if utils.deployment_exists(name):
+        return infrastructure_validate(name)
+
+    res = prepare(**env)
+    if tasks.has_failed(res):
+        logging.critical(f"Phase 'prepare' failed")
+        return res
+
+    try:
+        res = infrastructure_render(name)
+        if tasks.has_failed(res):
+            logging.critical(f"Phase 'infrastructure_render' failed")
+            return res
+
+        res = infrastructure_validate(name)
+        if tasks.has_failed(res):
+            logging.critical(f"Phase 'infrastructure_validate' failed")
+            return res
+    finally:
+        shutil.rmtree(utils.path_deployment(name))
+
+    return tasks.success()
+
+
 def create_provision(filename):
     
     env = read_deployment_file(filename)
@@ -549,14 +1510,57 @@ def create_provision(filename):
         logging.critical(f"Phase 'provision_render' failed")
         return res
 
-    res = upload(name)
+    res = provision_execute(name, upload=True)
     if tasks.has_failed(res):
-        logging.critical(f"Phase 'upload' failed")
+        logging.critical(f"Phase 'provision_execute' failed")
+        diag.collect_on_failure(env)
         return res
 
-    res = provision_execute(name)
+    return tasks.success()
+
+
+def create_pipelined(filename):
+    """
+    Creates a deployment overlapping the creation of machines with their provisioning. Provisioning files are
+    rendered from the planned addresses before creating anything, and every machine gets its files uploaded and
+    runs its first stage as soon as it is created and ready.
+    """
+    env = read_deployment_file(filename)
+
+    name = env["name"]
+
+    #
+    # Run phases in sequence, but for creation and first stage of provisioning
+    #
+    res = prepare(**env)
+    if tasks.has_failed(res):
+        logging.critical(f"Phase 'prepare' failed")
+        return res
+
+    res = infrastructure_images(name)
+    if tasks.has_failed(res):
+        logging.critical(f"Phase 'infrastructure_images' failed")
+        return res
+
+    res = infrastructure_render(name)
+    if tasks.has_failed(res):
+        logging.critical(f"Phase 'infrastructure_render' failed")
+        return res
+
+    res = infrastructure_plan(name)
+    if tasks.has_failed(res):
+        logging.critical(f"Phase 'infrastructure_plan' failed")
+        return res
+
+    res = provision_render(name)
+    if tasks.has_failed(res):
+        logging.critical(f"Phase 'provision_render' failed")
+        return res
+
+    res = provision_execute(name, upload=True, first=functools.partial(infrastructure_execute_pipelined, name))
     if tasks.has_failed(res):
         logging.critical(f"Phase 'provision_execute' failed")
+        diag.collect_on_failure(env)
         return res
 
     return tasks.success()
@@ -564,34 +1568,67 @@ def create_provision(filename):
 
 def create_all(filename):
 
-    res = create_infrastructure(filename)
-    if tasks.has_failed(res):
-        return res
+    env = read_deployment_file(filename)
 
-    res = create_provision(filename)
+    # Fail fast, before creating anything
+    res = check_environment(env)
     if tasks.has_failed(res):
+        logging.critical(f"Phase 'check' failed")
         return res
 
+    # Machines are learned as they are created from the state of libvirt domains, and provisioned through ssh
+    pipelined = env["provision"].get("pipelined", False)
+    if pipelined and (env["provider"] != "libvirt" or env["provision"]["backend"] != "local"):
+        logging.warning("Pipelined creation needs libvirt provider and local provisioning backend, creating in sequence")
+        pipelined = False
+
+    if pipelined:
+        res = create_pipelined(filename)
+        if tasks.has_failed(res):
+            return res
+    else:
+        res = create_infrastructure(filename)
+        if tasks.has_failed(res):
+            return res
+
+        res = create_provision(filename)
+        if tasks.has_failed(res):
+            return res
+
+    # a clean state to reset the cluster to
+    if env["provider"] == "libvirt" and env["snapshot"]["after_create"]:
+        res = snapshots.snapshot_execute(env["name"], "provisioned")
+
     return res
 
 
-def destroy_task(name, host, username, password):
+def destroy_task(name, host, username, password, command, timeout):
     """
-    Destroys the provisioning in a given host.
+    Destroys the provisioning in a given host. Unreachable hosts are skipped and the rest are given timeout seconds.
     """
-    res = ssh.run(username, password, host, f"sudo sh /tmp/salt/provision.sh -d -l /var/log/destroying.log")
-        
-    logging.info(f"Provision destroy on [{name}={host}]")
+    if not ssh.is_reachable(host, timeout=min(timeout, 5)):
+        logging.warning(f"Provision destroy skipped, host unreachable [{name}={host}]")
+        return tasks.failure(f"Host unreachable [{name}={host}]")
+
+    res = ssh.run(username, password, host, command, timeout=timeout)
+    if tasks.has_failed(res):
+        logging.warning(f"Provision destroy failed on [{name}={host}]")
+        logging.warning(tasks.get_stderr(res))
+    else:
+        logging.info(f"Provision destroy on [{name}={host}]")
  
     return res
 
 
-def destroy(filename):
+def bench_failover(filename):
     """
-    Destroys a deployed infrastructure.
+    Runs the failover scenarios from the examiner against a deployed cluster, and reports the percentiles
+    of the timings of every event across repetitions.
+    Scenarios, repetitions and timeout are taken from the deployment file, so they can change between runs.
     """
     env = read_deployment_file(filename)
     name = env["name"]
+    settings = env["bench"]["failover"]
 
     #
     # Check deployment does exist
@@ -601,45 +1638,305 @@ def destroy(filename):
         logging.critical(tasks.get_stderr(res))
         return res
 
-    path = utils.path_deployment(env["name"])
+    if "examiner" not in env:
+        res = tasks.failure("Failover benchmark needs the examiner enabled")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+    examiner = env["examiner"]
+    nodes = [ env["node"][index + 1]["name"] for index in range(int(env["node"]["count"])) ]
 
     #
-    # Execute on destroy actions on nodes
+    # Run scenarios
     #
-    logging.info("[X] Executing on destroy actions on nodes...")
+    logging.info("[X] Running failover scenarios from examiner...")
+
+    res = ssh.copy_to_host(examiner["username"], examiner["password"], examiner["public_ip"], bench.path_script("failover"), "/tmp/bench_failover.py")
+    if tasks.has_failed(res):
+        logging.critical(f"Cannot copy failover benchmark to examiner")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    scenarios = " ".join(settings["scenarios"])
+    logging.info(f"Scenarios: {scenarios}, {settings['repetitions']} repetitions each")
+
+    command = f"'sudo python3 /tmp/bench_failover.py {settings['timeout']} {settings['repetitions']} {' '.join(nodes)} -- {scenarios}'"
+    res = ssh.run(examiner["username"], examiner["password"], examiner["public_ip"], command)
+    logs.payload("bench-failover.log", tasks.get_stderr(res))
 
     try:
-        hosts = utils.get_hosts_from_env(env)
+        results = json.loads(tasks.get_stdout(res).splitlines()[-1])
+    except Exception:
+        res = tasks.failure(f"Failover benchmark did not report results: {tasks.get_stderr(res)}")
+        logging.critical(tasks.get_stderr(res))
+        return res
 
-        destroy_tasks  = [threading.Thread(target=destroy_task, args=(name, host, username, password)) for role, index, name, host, username, password in hosts]
+    logging.info("OK\n")
 
-        for task in destroy_tasks:
-            task.start()
+    #
+    # Report
+    #
+    logging.info("[X] Reporting failover timings...")
+
+    summary = {}
+    errors = 0
+    for scenario, repetitions in results.items():
+        errors += len([ repetition for repetition in repetitions if "error" in repetition ])
+        events = sorted({ event for repetition in repetitions for event in repetition if event != "error" })
+        summary[scenario] = { event: bench.summarize([ repetition[event] for repetition in repetitions if event in repetition ]) for event in events }
+
+        for event, stats in summary[scenario].items():
+            logging.info(f"    {scenario} {event}: " + ", ".join(f"{key}={value}" for key, value in stats.items()))
+
+    report = {
+        "deployment": env["name"],
+        "provider": env["provider"],
+        "nodes": len(nodes),
+        "timing": env.get("timing", {}).get("profile", {}),
+        "settings": settings,
+        "summary": summary,
+        "results": results,
+    }
+    path = bench.report_save(utils.path_deployment_bench(env["name"]), "failover", report)
+    logging.info(f"Report saved in {path}")
+
+    if errors > 0 or tasks.has_failed(res):
+        res = tasks.failure(f"Failover benchmark failed, {errors} repetitions did not complete")
+        logging.critical(tasks.get_stderr(res))
+        return res
 
-        for task in destroy_tasks:
-            task.join()
+    logging.info("OK\n")
 
-    except:
-        logging.info("No actions performed...")
+    return tasks.success()
+
+
+def bench_cib(filename):
+    """
+    Measures CIB commit latency, scheduler time and convergence time in a deployed cluster as the number of
+    resources grows, from its first node. Steps, group size and timeout are taken from the deployment file.
+    """
+    env = read_deployment_file(filename)
+    name = env["name"]
+    settings = env["bench"]["cib"]
+
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+    node = env["node"][1]
+
+    #
+    # Run steps
+    #
+    logging.info(f"[X] Loading the CIB from {node['name']}...")
+
+    res = ssh.copy_to_host(node["username"], node["password"], node["public_ip"], bench.path_script("cib"), "/tmp/bench_cib.py")
+    if tasks.has_failed(res):
+        logging.critical(f"Cannot copy CIB benchmark to {node['name']}")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    steps = " ".join(str(step) for step in settings["steps"])
+    logging.info(f"Steps: {steps} resources, in groups of {settings['group_size']}")
+
+    command = f"'sudo python3 /tmp/bench_cib.py {settings['timeout']} {settings['group_size']} {settings['updates']} {steps}'"
+    res = ssh.run(node["username"], node["password"], node["public_ip"], command)
+    logs.payload("bench-cib.log", tasks.get_stderr(res))
+
+    try:
+        results = json.loads(tasks.get_stdout(res).splitlines()[-1])
+    except Exception:
+        res = tasks.failure(f"CIB benchmark did not report results: {tasks.get_stderr(res)}")
+        logging.critical(tasks.get_stderr(res))
+        return res
 
     logging.info("OK\n")
 
     #
-    # Eliminate entries from known_hosts
+    # Report
     #
-    logging.info("[X] Removing servers from known_hosts...")
+    logging.info("[X] Reporting CIB scaling curve...")
+
+    for result in results:
+        logging.info(f"    {result['resources']} resources: commit={result['commit']:.3f}s, update={result['update']:.3f}s, scheduler={result['scheduler']:.3f}s, convergence={result['convergence']:.3f}s")
+
+    report = {
+        "deployment": env["name"],
+        "provider": env["provider"],
+        "nodes": int(env["node"]["count"]),
+        "settings": settings,
+        "results": results,
+    }
+    path = bench.report_save(utils.path_deployment_bench(env["name"]), "cib", report)
+    logging.info(f"Report saved in {path}")
+
+    if tasks.has_failed(res) or len(results) < len(settings["steps"]):
+        res = tasks.failure(f"CIB benchmark failed after {len(results)} of {len(settings['steps'])} steps")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
+def check_deployment(filename):
+    """
+    Checks a deployment file before creating it, reporting all the problems found at once.
+    """
+    env = read_deployment_file(filename)
+
+    return check_environment(env)
+
+
+def snapshot(filename, name):
+    """
+    Takes a snapshot of a deployment, replacing a previous one with the same name.
+    """
+    env = read_deployment_file(filename)
+
+    return snapshots.snapshot_execute(env["name"], name)
+
+
+def reset(filename, name):
+    """
+    Reverts a deployment to a snapshot, booting all its machines cold from their disks.
+    """
+    env = read_deployment_file(filename)
+
+    return snapshots.reset_execute(env["name"], name)
+
+
+def replace_node_provision(env, hosts):
+    """
+    Provisions from scratch the machines replacing nodes, every one as soon as it is ready: uploads its files,
+    or renders the salt-ssh configuration, and runs all the phases of a node on it. Returns the results of all of them.
+    """
+    backend = env["provision"].get("backend", "local")
+    if backend == "salt-ssh":
+        provision_render_saltssh(env)
+
+    logging.info(f"[X] Provisioning {', '.join(host[2] for host in hosts)}...")
+
+    iscsi = env["common"]["shared_storage_type"] == "iscsi"
+
+    def provision(role, index, name, host, username, password):
+        if backend == "salt-ssh":
+            provisioner = functools.partial(provision_ssh_task, env, role)
+            stages = [["config"]]
+        else:
+            res = upload_host(env, role, index, name, host, username, password)
+            if tasks.has_failed(res):
+                return res
+            provisioner = functools.partial(provision_task, env["provision"])
+            stages = [["install", "config"]]
+
+        stages += [["iscsi"], ["start"]] if iscsi else [["start"]]
+
+        executed = []
+        for phases in stages:
+            res = provisioner(name, host, username, password, phases)
+            executed.append(tasks.get_stdout(res))
+            if tasks.has_failed(res):
+                break
+
+        return (tasks.get_return_code(res), "\n".join(executed), tasks.get_stderr(res))
+
+    results = ready.on_ready(env, hosts, provision)
+    provision_report(results)
+
+    return results
+
+
+def replace_node(filename, number):
+    """
+    Replaces a node of a deployment with a new machine.
+    """
+    env = read_deployment_file(filename)
+
+    try:
+        number = int(number)
+    except ValueError:
+        res = tasks.failure(f"Invalid node number {number}")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    return replace.replace_node_execute(env["name"], number, infrastructure_outputs, replace_node_provision)
+
+
+def collect(filename):
+    """
+    Collects a diagnostic bundle of every host of a deployment.
+    Size, time span and timeout are taken from the deployment file, so they can change between runs.
+    """
+    env = read_deployment_file(filename)
+
+    return diag.collect_execute(env["name"], env["collect"])
+
+
+def destroy(filename):
+    """
+    Destroys a deployed infrastructure.
+    """
+    env = read_deployment_file(filename)
+    name = env["name"]
+
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    path = utils.path_deployment(env["name"])
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
 
     try:
         hosts = utils.get_hosts_from_env(env)
-        
-        for _, _, host_name, host_ip, _, _ in hosts:
-            tasks.run(f"ssh-keygen -R {host_ip} -f ~/.ssh/known_hosts")
-            logging.info(f"Eliminated from known_hosts [{host_name}={host_ip}]")
     except:
+        hosts = []
+
+    #
+    # Execute on destroy actions on nodes, only needed to deregister them
+    #
+    logging.info("[X] Executing on destroy actions on nodes...")
+
+    timeout = env.get("destroy", {}).get("timeout", 60)
+
+    # provision.sh is not uploaded to hosts provisioned through salt-ssh
+    if env.get("provision", {}).get("backend", "local") == "salt-ssh":
+        command = "sudo SUSEConnect -d"
+    else:
+        command = "sudo sh /tmp/salt/provision.sh -d -l /var/log/destroying.log"
+
+    if env["common"].get("reg_code", "") and len(hosts) > 0:
+        with concurrent.futures.ThreadPoolExecutor(len(hosts)) as executor:
+            futures = [ executor.submit(logs.hosted(host_name, destroy_task), host_name, host, username, password, command, timeout) for _, _, host_name, host, username, password in hosts ]
+            concurrent.futures.wait(futures)
+    else:
         logging.info("No actions performed...")
 
     logging.info("OK\n")
 
+    #
+    # Delete snapshots, domains holding them cannot be destroyed
+    #
+    if env.get("snapshots", {}):
+        logging.info("[X] Deleting snapshots...")
+
+        snapshots.snapshot_delete_all(env)
+
+        logging.info("OK\n")
 
     #
     # Destroy infrastructure
@@ -658,12 +1955,12 @@ def destroy(filename):
         logging.critical(tasks.get_stderr(res))
         return res
     else:
-        logging.debug(tasks.get_stdout(res))
+        logs.payload("terraform.log", tasks.get_stdout(res))
 
     logging.info("OK\n")
 
     #
-    # Deleting deployment
+    # Deleting deployment, along with its known_hosts
     #
     logging.info("[X] Deleting deployment...")
 
@@ -682,13 +1979,24 @@ if __name__ == "__main__":
 Usage:
     deploy.py create DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
     deploy.py infrastructure DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py validate DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py check DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
     deploy.py provision DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py bench-failover DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py bench-cib DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py collect DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py snapshot DEPLOYMENT_FILE [SNAPSHOT] [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py reset DEPLOYMENT_FILE [SNAPSHOT] [-q] [-f LOG_FILE] [-l LOG_LEVEL]
+    deploy.py replace-node DEPLOYMENT_FILE NODE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
     deploy.py destroy DEPLOYMENT_FILE [-q] [-f LOG_FILE] [-l LOG_LEVEL]
     deploy.py (-h | --help)
     deploy.py (-v | --version)
 
 Arguments:
     DEPLOYMENT_FILE                      File containing deployment specification
+    SNAPSHOT                             Name of a snapshot, provisioned if not given. Snapshots hold
+                                         disks only, so reset is a cold boot of all the machines
+    NODE                                 Number of a node, ie: 2 for node02
     HOST                                 Host IP to provision
 
 Options:
@@ -716,10 +2024,9 @@ Examples:
             handlers.append(logging.FileHandler(logfile,  mode="w"))
 
         loglevel = utils.get_log_level(arguments["--loglevel"], logging.INFO)
-        logging.basicConfig(level=loglevel,
+        logs.setup(handlers, loglevel,
                     format="[%(asctime)s] %(levelname)s - %(module)s[%(lineno)d] - %(message)s",
-                    datefmt="%m/%d/%Y %I:%M:%S %p",
-                    handlers=handlers) 
+                    datefmt="%m/%d/%Y %I:%M:%S %p")
         
         # if no handlers, full disable logging
         if len(handlers) == 0:
@@ -736,11 +2043,51 @@ Examples:
             res = create_infrastructure(deployment_file)
             return res
 
+        if arguments["validate"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = validate_infrastructure(deployment_file)
+            return res
+
+        if arguments["check"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = check_deployment(deployment_file)
+            return res
+
         if arguments["provision"]:
             deployment_file = arguments["DEPLOYMENT_FILE"]
             res = create_provision(deployment_file)
             return res
 
+        if arguments["bench-failover"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = bench_failover(deployment_file)
+            return res
+
+        if arguments["bench-cib"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = bench_cib(deployment_file)
+            return res
+
+        if arguments["collect"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = collect(deployment_file)
+            return res
+
+        if arguments["snapshot"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = snapshot(deployment_file, arguments["SNAPSHOT"] or "provisioned")
+            return res
+
+        if arguments["reset"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = reset(deployment_file, arguments["SNAPSHOT"] or "provisioned")
+            return res
+
+        if arguments["replace-node"]:
+            deployment_file = arguments["DEPLOYMENT_FILE"]
+            res = replace_node(deployment_file, arguments["NODE"])
+            return res
+
         if arguments["destroy"]:
             deployment_file = arguments["DEPLOYMENT_FILE"]
             res = destroy(deployment_file)
@@ -748,4 +2095,7 @@ Examples:
 
     from docopt import docopt
     arguments = docopt(main.__doc__, version='Pacemaker Deploy 0.1.0')
-    main(arguments)
+    try:
+        main(arguments)
+    finally:
+        logs.shutdown()
@@ -0,0 +1,96 @@
+import os
+import time
+import shutil
+import logging
+import concurrent.futures
+
+import tasks
+import ssh
+import logs
+import utils
+
+
+def collect_task(path, script, settings, name, host, username, password):
+    """
+    Builds a compressed diagnostic bundle in a given host running the collecting script, and streams it back
+    to a file under path, through the stdin and stdout of a single ssh session. Unreachable hosts are skipped.
+    """
+    if not host or not ssh.is_reachable(host, timeout=5):
+        logging.warning(f"Collect skipped, host unreachable [{name}={host}]")
+        return tasks.failure(f"Host unreachable [{name}={host}]")
+
+    max_bytes = int(settings["max_size"]) * 1024 * 1024
+    destiny = f"{path}/{name}.tar.gz"
+
+    res = ssh.stream_from_host(username, password, host, f"sudo bash -s {max_bytes} {settings['minutes']}", destiny, input=script, timeout=settings["timeout"])
+    logs.payload(f"{name}.collect.log", tasks.get_stderr(res))
+    if tasks.has_failed(res) or os.path.getsize(destiny) == 0:
+        logging.warning(f"Collect failed on [{name}={host}]")
+        os.remove(destiny)
+        return tasks.failure(f"Collect failed on [{name}={host}]: {tasks.get_stderr(res)}")
+
+    logging.info(f"Collected {os.path.getsize(destiny) / 1024:.0f} KiB -> [{name}={host}]")
+
+    return tasks.success()
+
+
+def collect_execute(name, settings):
+    """
+    Collects in parallel a diagnostic bundle of every host of a deployment, under a new folder in its diag folder.
+    Returns failure if no bundle could be collected.
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+    #
+    # Collect bundles
+    #
+    logging.info("[X] Collecting diagnostic bundles...")
+
+    try:
+        hosts = utils.get_hosts_from_env(env)
+    except:
+        hosts = []
+
+    if len(hosts) == 0:
+        res = tasks.failure("No hosts to collect from")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    with open(f"{utils.path_provision(env['provider'])}/collect.sh", "r") as f:
+        script = f.read()
+
+    path = f"{utils.path_deployment_diag(env['name'])}/{time.strftime('%Y%m%d-%H%M%S')}"
+    os.makedirs(path, exist_ok = True)
+
+    with concurrent.futures.ThreadPoolExecutor(len(hosts)) as executor:
+        futures = [ executor.submit(logs.hosted(host_name, collect_task), path, script, settings, host_name, host, username, password) for _, _, host_name, host, username, password in hosts ]
+        results = [ future.result() for future in futures ]
+
+    collected = len([ res for res in results if tasks.has_succeeded(res) ])
+    if collected == 0:
+        shutil.rmtree(path)
+        res = tasks.failure("No diagnostic bundle collected")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    logging.info(f"Collected {collected} of {len(hosts)} bundles in {path}")
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
+def collect_on_failure(env):
+    """
+    Collects diagnostic bundles after a failure, if enabled
+    """
+    if env["collect"]["on_failure"]:
+        collect_execute(env["name"], env["collect"])
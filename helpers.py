@@ -32,7 +32,7 @@ def provision_keys(name):
         for future in futures:
             results.append( future.result() )
 
-    if functools.reduce(lambda x, y: x or tasks.get_return_code(y) != 0, results, False):
+    if tasks.any_failed(results):
         for result in results:
             if tasks.get_return_code(result) != 0:
                 logging.error(tasks.get_stderr(result))
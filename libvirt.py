@@ -0,0 +1,179 @@
+import os
+import xml.etree.ElementTree as ElementTree
+
+import tasks
+
+
+def volume_complete(uri, pool, volume):
+    """
+    Check if a volume exists in a given storage pool and is complete, as libvirt refuses to read a volume
+    still being created, like a clone being copied.
+    """
+    return tasks.has_succeeded(tasks.run(f"virsh -c {uri} vol-download --pool {pool} {volume} /dev/null --offset 0 --length 1"))
+
+
+def volume_create(uri, pool, volume, size, format = "qcow2"):
+    """
+    Create an empty volume of a given size in bytes in a storage pool.
+    """
+    return tasks.run(f"virsh -c {uri} vol-create-as {pool} {volume} {size}b --format {format}")
+
+
+def volume_create_collided(result):
+    """
+    Check if a volume could not be created because a volume with its name exists already.
+    """
+    stderr = tasks.get_stderr(result)
+    return tasks.has_failed(result) and ("exists already" in stderr or "already in use" in stderr or "already exists" in stderr)
+
+
+def volume_upload(uri, pool, volume, path):
+    """
+    Upload a local file as the content of a volume.
+    """
+    return tasks.run(f"virsh -c {uri} vol-upload --pool {pool} {volume} {path}")
+
+
+def volume_clone(uri, pool, volume, clone):
+    """
+    Create a volume in a storage pool as a copy of another one of the pool.
+    """
+    return tasks.run(f"virsh -c {uri} vol-clone --pool {pool} {volume} {clone}")
+
+
+def volume_delete(uri, pool, volume):
+    """
+    Delete a volume from a storage pool.
+    """
+    return tasks.run(f"virsh -c {uri} vol-delete --pool {pool} {volume}")
+
+
+#
+# Host number of every role in the private network, as given to cidrhost in the infrastructure files.
+# Nodes are numbered from this one on
+#
+private_host_numbers = {
+    "iscsi": 4,
+    "qdevice": 6,
+    "examiner": 8,
+    "node": 10,
+}
+
+
+#
+# Domains and snapshots
+#
+def domain_name(uri, domain):
+    """
+    Returns the name of a domain given by uuid, empty if it does not exist
+    """
+    return tasks.get_stdout(tasks.run(f"virsh -c {uri} domname {domain}", timeout=30)).strip()
+
+
+def domain_address(uri, domain):
+    """
+    Returns the ipv4 address of the first interface of a domain, as libvirt knows it from the dhcp leases of
+    its network or, for bridges, from the guest agent. Empty if it is not known yet
+    """
+    # Interface  Type     Source   Model   MAC
+    # -------------------------------------------------------
+    # vnet0      network  default  virtio  52:54:00:6e:0c:1d
+    res = tasks.run(f"virsh -c {uri} domiflist {domain}", timeout=30)
+    interfaces = [ line.split() for line in tasks.get_stdout(res).splitlines()[2:] if line.strip() ]
+    if tasks.has_failed(res) or len(interfaces) == 0:
+        return ""
+    mac = interfaces[0][-1]
+
+    # Name   MAC address        Protocol  Address
+    # -------------------------------------------------------
+    # vnet0  52:54:00:6e:0c:1d  ipv4      192.168.122.83/24
+    for source in ["lease", "agent"]:
+        res = tasks.run(f"virsh -c {uri} domifaddr {domain} --source {source}", timeout=30)
+        for line in tasks.get_stdout(res).splitlines()[2:]:
+            fields = line.split()
+            if len(fields) == 4 and fields[1] == mac and fields[2] == "ipv4":
+                return fields[3].split("/")[0]
+
+    return ""
+
+
+def domain_state(uri, domain):
+    """
+    Returns the state of a domain, ie: running or shut off
+    """
+    return tasks.get_stdout(tasks.run(f"virsh -c {uri} domstate {domain}")).strip()
+
+
+def domain_start(uri, domain):
+    return tasks.run(f"virsh -c {uri} start {domain}")
+
+
+def domain_shutdown(uri, domain):
+    """
+    Asks the guest of a domain to shut down cleanly
+    """
+    return tasks.run(f"virsh -c {uri} shutdown {domain}")
+
+
+def domain_destroy(uri, domain):
+    """
+    Powers off a domain at once
+    """
+    return tasks.run(f"virsh -c {uri} destroy {domain}")
+
+
+def domain_disks(uri, domain):
+    """
+    Returns the disks of a domain, as a list of dictionaries with their target, source, format and whether they are
+    shareable
+    """
+    res = tasks.run(f"virsh -c {uri} dumpxml {domain}")
+    if tasks.has_failed(res):
+        return []
+
+    disks = []
+    for disk in ElementTree.fromstring(tasks.get_stdout(res)).findall("./devices/disk[@device='disk']"):
+        source = disk.find("source")
+        driver = disk.find("driver")
+        disks.append({
+            "target": disk.find("target").get("dev"),
+            "source": (source.get("file") or source.get("dev") or source.get("volume") or "") if source is not None else "",
+            "format": driver.get("type", "raw") if driver is not None else "raw",
+            "shareable": disk.find("shareable") is not None,
+        })
+
+    return disks
+
+
+def snapshot_create(uri, domain, name, path, excluded = []):
+    """
+    Creates an internal snapshot of a shut off domain, leaving out the disks given by target, ie: raw shared disks.
+    The snapshot description is written to path.
+    """
+    disks = "".join(f"<disk name='{target}' snapshot='no'/>" for target in excluded)
+    with open(path, "w") as f:
+        f.write(f"<domainsnapshot><name>{name}</name><disks>{disks}</disks></domainsnapshot>")
+
+    return tasks.run(f"virsh -c {uri} snapshot-create {domain} --xmlfile {path}")
+
+
+def snapshot_revert(uri, domain, name):
+    return tasks.run(f"virsh -c {uri} snapshot-revert {domain} {name}")
+
+
+def snapshot_delete(uri, domain, name):
+    return tasks.run(f"virsh -c {uri} snapshot-delete {domain} {name}")
+
+
+def volume_download(uri, volume, path, length):
+    """
+    Downloads the first length bytes of a volume, given by path, to a local file
+    """
+    return tasks.run(f"virsh -c {uri} vol-download {volume} {path} --offset 0 --length {length}")
+
+
+def volume_upload_region(uri, volume, path):
+    """
+    Uploads a local file over the start of a volume, given by path, leaving the rest of it as it is
+    """
+    return tasks.run(f"virsh -c {uri} vol-upload {volume} {path} --offset 0 --length {os.path.getsize(path)}")
@@ -0,0 +1,211 @@
+import os
+import json
+import queue
+import logging
+import logging.handlers
+import threading
+import functools
+import contextlib
+
+import utils
+
+
+#
+# Host every thread is working on, stamped on the records it logs
+#
+current = threading.local()
+
+#
+# Writer thread and the handler of per host files, set up by setup
+#
+listener = None
+hosts_handler = None
+
+
+class HostFilter(logging.Filter):
+    """
+    Stamps every record with the host the thread logging it is working on, empty if none
+    """
+    def filter(self, record):
+        record.host = getattr(current, "host", "")
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as json lines
+    """
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "module": record.module,
+            "line": record.lineno,
+            "host": getattr(record, "host", ""),
+            "message": record.getMessage(),
+        }
+        return json.dumps(entry)
+
+
+class HostFilesHandler(logging.Handler):
+    """
+    Writes the records of every host to a file of its own in the log directory of the deployment.
+    It only runs in the writer thread, so files are kept open without further locking
+    """
+    def __init__(self):
+        super().__init__()
+        self.path = None
+        self.files = {}
+
+    def emit(self, record):
+        # nothing is written before the deployment exists, nor after it is destroyed
+        if not getattr(record, "host", "") or self.path is None or not os.path.isdir(os.path.dirname(self.path)):
+            return
+
+        try:
+            if record.host not in self.files:
+                os.makedirs(self.path, exist_ok = True)
+                self.files[record.host] = open(f"{self.path}/{record.host}.log", "a")
+
+            f = self.files[record.host]
+            f.write(self.format(record) + "\n")
+            f.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        super().close()
+
+
+def setup(handlers, level, format, datefmt):
+    """
+    Configures the root logger to only enqueue records. A dedicated thread takes them from the queue, and formats
+    and writes them to the given handlers and to the per host files, so threads logging never wait for them
+    """
+    global listener
+    global hosts_handler
+
+    formatter = logging.Formatter(format, datefmt)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    hosts_handler = HostFilesHandler()
+    hosts_handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(HostFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [handler]
+
+    listener = logging.handlers.QueueListener(records, *handlers, hosts_handler)
+    listener.start()
+
+
+def shutdown():
+    """
+    Writes the records still in the queue and stops the writer thread
+    """
+    global listener
+
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+    if hosts_handler is not None:
+        hosts_handler.close()
+
+
+def deployment(name, json_lines = False):
+    """
+    Sends the records of every host to its own file in the log directory of a deployment, as json lines if set.
+    Files are only written once the deployment exists
+    """
+    if hosts_handler is None:
+        return
+
+    hosts_handler.path = utils.path_deployment_logs(name)
+    if json_lines:
+        hosts_handler.setFormatter(JsonFormatter(datefmt = hosts_handler.formatter.datefmt))
+
+
+@contextlib.contextmanager
+def host(name):
+    """
+    Stamps the records logged in the block with the name of a host
+    """
+    previous = getattr(current, "host", "")
+    current.host = name
+    try:
+        yield
+    finally:
+        current.host = previous
+
+
+def hosted(name, function):
+    """
+    Returns a function running a given one with its records stamped with the name of a host, to run it in another thread
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with host(name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def payload_path(name):
+    """
+    Returns the path of a payload file in the log directory of the deployment, or None if it does not exist yet
+    """
+    if hosts_handler is None or hosts_handler.path is None or not os.path.isdir(os.path.dirname(hosts_handler.path)):
+        return None
+
+    os.makedirs(hosts_handler.path, exist_ok = True)
+
+    return f"{hosts_handler.path}/{name}"
+
+
+def payload(name, text):
+    """
+    Writes a large payload, like command outputs or dumps, straight to a file in the log directory of the deployment
+    instead of through a log record, if debugging. Only its path is logged. Without log directory, it is logged as it is
+    """
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
+
+    path = payload_path(name)
+    if path is None:
+        logging.debug(text)
+        return
+
+    with open(path, "a") as f:
+        f.write(text)
+
+    logging.debug(f"{name} written to {path}")
+
+
+def payload_lines(name):
+    """
+    Returns a function writing every line it is given to a payload file as soon as it arrives, if debugging, for
+    outputs followed while they are produced. Only the path is logged, once. Without log directory, lines are logged
+    """
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return lambda line: None
+
+    path = payload_path(name)
+    if path is None:
+        return lambda line: logging.debug(line)
+
+    logging.debug(f"{name} streamed to {path}")
+
+    def write(line):
+        with open(path, "a") as f:
+            f.write(line + "\n")
+
+    return write
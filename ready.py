@@ -0,0 +1,60 @@
+import logging
+import concurrent.futures
+
+import tasks
+import ssh
+import logs
+
+
+def ready_task(function, skipped, role, index, name, host, username, password):
+    """
+    Collects the host keys of a host, checks it accepts logins and then runs a function on it.
+    If it cannot log in, skipped is called with the host entry instead, if given
+    """
+    res = ssh.scan_host_key(host)
+    if tasks.has_failed(res):
+        logging.warning(tasks.get_stderr(res))
+
+    res = ssh.wait_for_login(username, password, host)
+    if tasks.has_failed(res):
+        logging.critical(f"Cannot log in [{name}={host}]")
+        logging.critical(tasks.get_stderr(res))
+        if skipped is not None:
+            skipped(role, index, name, host, username, password)
+        return res
+
+    return function(role, index, name, host, username, password)
+
+
+def on_ready(env, hosts, function, skipped = None):
+    """
+    Waits for the hosts to be ready, probing all of them concurrently, and runs a function on every host
+    as soon as it is. The function receives the host entry from utils.get_hosts_from_env.
+    If skipped is given, it is called with the entry of every host the function is not run on, as soon as it is known.
+    Returns the results of all of them, a host not ready in time counting as a failure.
+    """
+    timeout = env.get("provision", {}).get("ready_timeout", 600)
+
+    entries = { host: (role, index, name, host, username, password) for role, index, name, host, username, password in hosts }
+
+    results = []
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(hosts))) as executor:
+        futures = []
+        for host, ready in ssh.wait_for_ports(entries.keys(), timeout=timeout):
+            _, _, name, _, _, _ = entries[host]
+            if not ready:
+                res = tasks.failure(f"Host not ready after {timeout} seconds [{name}={host}]")
+                logging.critical(tasks.get_stderr(res))
+                results.append(res)
+                if skipped is not None:
+                    skipped(*entries[host])
+                continue
+
+            logging.info(f"Host ready [{name}={host}]")
+            futures.append( executor.submit(logs.hosted(name, ready_task), function, skipped, *entries[host]) )
+
+        for future in futures:
+            results.append( future.result() )
+
+    return results
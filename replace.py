@@ -0,0 +1,168 @@
+import re
+import logging
+
+import tasks
+import terraform
+import ssh
+import logs
+import snapshots
+import utils
+
+
+def replace_node_remove(env, number, survivors):
+    """
+    Removes a node from the cluster membership from the first reachable survivor, and forgets its host key in
+    all of them, as the new machine comes with a key of its own. Returns the name of the survivor used.
+    """
+    name = env["node"][number]["name"]
+    private_ip = env["node"][number]["private_ip"]
+
+    member = None
+    for _, _, survivor, host, username, password in survivors:
+        if not ssh.is_reachable(host):
+            logging.warning(f"Survivor unreachable [{survivor}={host}]")
+            continue
+
+        if member is None:
+            res = ssh.run(username, password, host, f"sudo crm cluster remove -y -c {name}", timeout=300)
+            if tasks.has_failed(res):
+                logging.warning(f"Cannot remove {name} from cluster, deleting it from configuration [{survivor}={host}]")
+                logging.warning(tasks.get_stderr(res))
+                ssh.run(username, password, host, f"sudo crm node delete {name}", timeout=300)
+            else:
+                logging.info(f"Removed {name} from cluster [{survivor}={host}]")
+            member = survivor
+
+        ssh.run(username, password, host, f"'sudo ssh-keygen -R {name} -f /root/.ssh/known_hosts; sudo ssh-keygen -R {private_ip} -f /root/.ssh/known_hosts'", timeout=60)
+
+    return member
+
+
+def node_resource_pattern(number):
+    """
+    Returns the regular expression matching the Terraform addresses of the resources of a node, in both
+    rendering modes, ie: libvirt_domain.node02_domain, docker_container.node02, libvirt_domain.node_domain["02"]
+    """
+    key = f"{number:0>2}"
+    return re.compile(rf'^[a-z0-9_]+\.node({key}(_\w+)?|(_\w+)?\["{key}"\])$')
+
+
+def replace_node_resources(env, number):
+    """
+    Recreates the resources of a node, and only them, tainting them and applying Terraform on them only.
+    Resources are taken from the state, so both rendering modes (files and for_each) are covered.
+    """
+    path_infrastructure = utils.path_deployment_infrastructure(env["name"])
+
+    res = terraform.state_list(path_infrastructure)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    pattern = node_resource_pattern(number)
+    addresses = [ address for address in tasks.get_stdout(res).splitlines() if pattern.match(address) ]
+    if len(addresses) == 0:
+        res = tasks.failure(f"No resources of node {number:0>2} in Terraform state")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    for address in addresses:
+        res = terraform.taint(path_infrastructure, address)
+        if tasks.has_failed(res):
+            logging.critical(f"Cannot taint {address}")
+            logging.critical(tasks.get_stderr(res))
+            return res
+        logging.info(f"Tainted {address}")
+
+    res = terraform.apply_targets(path_infrastructure, addresses)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+    else:
+        logs.payload("terraform.log", tasks.get_stdout(res))
+
+    return tasks.success()
+
+
+def replace_node_execute(name, number, outputs, provision):
+    """
+    Replaces a node of a deployment with a new machine, without touching the rest: the node is removed from the
+    cluster, its resources are recreated, and the new machine gets its grains rendered and is provisioned from
+    scratch, joining the surviving members. The outputs of the infrastructure are added to the environment with
+    outputs(env), and provision(env, hosts) provisions the new machine, returning its results.
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    if number < 1 or number > int(env["node"]["count"]):
+        res = tasks.failure(f"Node {number} does not exist in deployment {env['name']}, it has {env['node']['count']} nodes")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+    node_name = env["node"][number]["name"]
+    survivors = [ host for host in utils.get_hosts_from_env(env) if host[0] == "node" and host[1] != number ]
+
+    #
+    # Remove node from cluster
+    #
+    logging.info(f"[X] Removing {node_name} from cluster...")
+
+    init_node = replace_node_remove(env, number, survivors)
+    if init_node is None:
+        logging.warning(f"No surviving member reachable, {node_name} initializes the cluster")
+        init_node = node_name
+
+    # snapshots of a domain cannot be kept across its recreation, and the rest are useless without it
+    if env.get("snapshots", {}):
+        logging.warning(f"Deleting snapshots, they cannot be reverted without {node_name}")
+        snapshots.snapshot_delete_all(env)
+        env["snapshots"] = {}
+        utils.environment_save(env["name"], **env)
+
+    logging.info("OK\n")
+
+    #
+    # Recreate node resources
+    #
+    logging.info(f"[X] Recreating {node_name}...")
+
+    res = replace_node_resources(env, number)
+    if tasks.has_failed(res):
+        return res
+
+    logging.info("OK\n")
+
+    res = outputs(env)
+    if tasks.has_failed(res):
+        return res
+
+    #
+    # Render grains, joining a surviving member
+    #
+    logging.info(f"[X] Rendering provision files of {node_name}...")
+
+    path_render = utils.path_deployment_provision(env["name"])
+    utils.template_render(utils.path_provision(env["provider"]), "grains.j2", path_render, f"{node_name}.grains", role="node", index=number, env=env, init_node=init_node, **env)
+    logging.info(f"Rendered {node_name}.grains, joining {init_node}")
+
+    logging.info("OK\n")
+
+    #
+    # Provision new machine
+    #
+    host = [ host for host in utils.get_hosts_from_env(env) if host[0] == "node" and host[1] == number ]
+    results = provision(env, host)
+
+    if tasks.any_failed(results):
+        return tasks.failure(f"Cannot provision {node_name}")
+
+    logging.info("OK\n")
+
+    return tasks.success()
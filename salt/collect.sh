@@ -0,0 +1,71 @@
+#!/bin/bash
+# Script to collect a diagnostic bundle of a host. It is fed through the stdin of a ssh session, so it does not
+# need anything uploaded, and it writes a compressed archive to its stdout, to be streamed back along the session.
+# Usage: collect.sh MAX_BYTES MINUTES
+#
+# Items are gathered in order of importance. Every file is cut to its last MAX_BYTES, and while the compressed
+# archive exceeds MAX_BYTES the least important items are dropped, so the bundle never grows over it.
+
+max_bytes=$1
+minutes=${2:-120}
+
+work=$(mktemp -d /tmp/diag.XXXXXX)
+trap "rm -rf $work" EXIT
+bundle=$work/$(hostname)
+mkdir -p $bundle
+
+items=()
+
+# keep_file NAME PATH
+keep_file () {
+    if [[ -f $2 ]]; then
+        tail -c $max_bytes $2 > $bundle/$1
+        items+=("$1")
+    fi
+}
+
+# keep_output NAME COMMAND...
+keep_output () {
+    name=$1
+    shift
+    "$@" > $bundle/$name 2>&1
+    truncate -s "<$max_bytes" $bundle/$name
+    items+=("$name")
+}
+
+keep_file provision.log /var/log/provision.log
+keep_file salt-minion.log /var/log/salt/minion
+keep_file grains /etc/salt/grains
+keep_file corosync.conf /etc/corosync/corosync.conf
+keep_file sbd /etc/sysconfig/sbd
+if command -v crm_mon > /dev/null 2>&1; then
+    keep_output crm_mon.txt crm_mon -1 -r -f -A
+    keep_output cib.xml cibadmin -Q
+fi
+keep_file pacemaker.log /var/log/pacemaker/pacemaker.log
+keep_file corosync.log /var/log/cluster/corosync.log
+keep_output journal.txt journalctl --no-pager --since "-${minutes}min"
+# an archive cannot be cut, so a crm_report over the size is left out
+if command -v crm_report > /dev/null 2>&1; then
+    crm_report -S -f "$(date -d "$minutes minutes ago" '+%Y-%m-%d %H:%M:%S')" --dest $work/crm_report > /dev/null 2>&1
+    if [[ -f $work/crm_report.tar.bz2 && $(stat -c %s $work/crm_report.tar.bz2) -le $max_bytes ]]; then
+        mv $work/crm_report.tar.bz2 $bundle/crm_report.tar.bz2
+        items+=("crm_report.tar.bz2")
+    fi
+fi
+
+# pack, dropping the least important items until it fits
+while true; do
+    tar -C $work -czf $work/bundle.tar.gz $(basename $bundle)
+    size=$(stat -c %s $work/bundle.tar.gz)
+    if [[ $size -le $max_bytes || ${#items[@]} -le 1 ]]; then
+        break
+    fi
+    last=${items[-1]}
+    echo "dropping $last, bundle of $size bytes over $max_bytes" >&2
+    rm -f $bundle/$last
+    unset 'items[-1]'
+done
+
+echo "bundle of $size bytes with ${items[*]}" >&2
+cat $work/bundle.tar.gz
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Runs several highstates, one per saltenv, inside a single masterless salt process, so the interpreter
+# and salt itself are only started once for all of them. All phases share a caller, and before every phase
+# but the first its grains, pillar and loader are refreshed, as the previous phase may have set grains, added
+# pillar files and installed packages, modules and formulas. It is launched by provision.sh with the interpreter
+# of salt-call. For every phase a line "phase <name> <return code> <seconds>" is appended to the given
+# results file, and execution stops at the first failed phase. The json given with -p is passed as pillar to every highstate.
+#
+# Usage: phases.py RESULTS_FILE [-p PILLAR] PHASE:SALTENV [PHASE:SALTENV ...]
+
+import sys
+import json
+import time
+
+import salt.config
+import salt.client
+import salt.loader
+import salt.output
+
+
+def has_succeeded(ret):
+    # rendering errors are returned as a list of strings instead of states
+    if not isinstance(ret, dict):
+        return False
+    return all(state.get("result") is not False for state in ret.values())
+
+
+def refresh(caller):
+    # grains are gathered again, and the pillar and the loader built from them, the file client and the
+    # rest of the session are kept
+    opts = caller.sminion.opts
+    opts["grains"] = salt.loader.grains(opts, force_refresh=True)
+    caller.sminion.gen_modules()
+
+
+def main(results_file, phases, pillar = None):
+    opts = salt.config.minion_config("/etc/salt/minion")
+    opts["file_client"] = "local"
+    opts["color"] = True
+
+    caller = salt.client.Caller(mopts=opts)
+
+    for number, phase in enumerate(phases):
+        name, _, saltenv = phase.partition(":")
+
+        start = time.time()
+        if number > 0:
+            refresh(caller)
+        if pillar:
+            ret = caller.cmd("state.highstate", saltenv=saltenv, pillar=pillar)
+        else:
+            ret = caller.cmd("state.highstate", saltenv=saltenv)
+        retcode = 0 if has_succeeded(ret) else 1
+
+        salt.output.display_output({"local": ret}, "highstate", opts)
+        sys.stdout.flush()
+
+        with open(results_file, "a") as f:
+            f.write(f"phase {name} {retcode} {int(time.time() - start)}\n")
+
+        if retcode != 0:
+            return retcode
+
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[2] == "-p":
+        sys.exit(main(sys.argv[1], sys.argv[4:], json.loads(sys.argv[3])))
+    sys.exit(main(sys.argv[1], sys.argv[2:]))
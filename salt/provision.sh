@@ -98,6 +98,20 @@ config () {
         state.highstate saltenv=config || exit 1
 }
 
+sbd_probe () {
+    # Measure the latency of the sbd device, reporting the sbd timeouts derived from it on fd 3, so the
+    # deployer gives the worst ones to every node. Skipped if disabled, or if the device is not available
+    margin=$(get_grain sbd_probe_margin /tmp/salt/grains || true)
+    [[ -n $margin && $margin != 0 ]] || return 0
+    device=$(salt-call --local --out=newline_values_only pillar.get cluster:sbd:device)
+    if [[ ! -b $device ]]; then
+        echo "sbd device $device not found, skipping sbd latency probe"
+        return 0
+    fi
+    salt_python=$(head -n 1 $(which salt-call) | sed 's/^#! *//')
+    $salt_python /tmp/salt/sbd_latency.py /dev/fd/3 $device $margin "$(get_grain timing /tmp/salt/grains)" || exit 1
+}
+
 start () {
     salt-call                  \
         --local                \
@@ -105,7 +119,48 @@ start () {
         --log-file-level=debug \
         --retcode-passthrough  \
         $(salt_output_colored) \
-        state.highstate saltenv=base || exit 1
+        state.highstate saltenv=base ${sbd_pillar:+"pillar=$sbd_pillar"} || exit 1
+}
+
+iscsi () {
+    salt-call                  \
+        --local                \
+        --log-level=debug      \
+        --log-file-level=debug \
+        --retcode-passthrough  \
+        $(salt_output_colored) \
+        state.sls on_start.iscsi_initiator saltenv=base || exit 1
+}
+
+config_start () {
+    # Run config and start highstates in a single salt process, with the same interpreter as salt-call
+    salt_python=$(head -n 1 $(which salt-call) | sed 's/^#! *//')
+    $salt_python /tmp/salt/phases.py /dev/fd/3 ${sbd_pillar:+-p "$sbd_pillar"} config:config start:base || exit 1
+}
+
+run_phase () {
+    # Run a phase, reporting its result as "phase <name> <return code> <seconds>" on fd 3
+    phase_start=$SECONDS
+    ( $1 )
+    retcode=$?
+    echo "phase $1 $retcode $((SECONDS - phase_start))" >&3
+    [[ $retcode == 0 ]] || exit $retcode
+}
+
+kill_tree () {
+    # Stop a process, so it starts nothing else, kill its descendants and then the process itself
+    kill -STOP $1 2> /dev/null
+    for child in $(pgrep -P $1); do
+        kill_tree $child
+    done
+    kill -KILL $1 2> /dev/null
+}
+
+kill_running () {
+    # Kill a running provisioning along with every process it started, ie: a hung zypper or salt-call
+    [[ -f $pid_file ]] || return 0
+    kill_tree $(cat $pid_file)
+    rm -f $pid_file
 }
 
 on_destroy() {
@@ -124,14 +179,23 @@ Supported Options (if no options are provided (excluding -l) all the steps will
   -i               Bootstrap salt installation and configuration. It will register to SCC channels if needed
   -c               Execute config operations (update hosts and hostnames, install support packages, etc)
   -s               Execute deployment operations (fire up corosync, pacemaker, etc)
+  -m               Execute config and deployment operations in a single salt process, if both are selected
+  -n               Execute iSCSI initiator operations (discovery and login to the iSCSI target)
+  -b               Measure the latency of the sbd device, reporting the sbd timeouts derived from it
+  -t [WATCHDOG:MSGWAIT]
+                   Give the provided sbd timeouts, in seconds, as pillar to the deployment operations
   -d               Execute on destroy operations (deregistering systems, etc)
+  -k               Kill a running provisioning, along with every process it started
   -l [LOG_FILE]    Append the log output to the provided file
+  -w               Mirror the log output on stderr, so a watcher of the run sees its progress
   -h               Show this help.
 EOF
 }
 
+pid_file=/tmp/salt/provision.pid
+
 argument_number=0
-while getopts ":hicsdl:" opt; do
+while getopts ":hicsmnbdkwl:t:" opt; do
     argument_number=$((argument_number + 1))
     case $opt in
         h)
@@ -147,12 +211,31 @@ while getopts ":hicsdl:" opt; do
         s)
             execute_start=1
             ;;
+        m)
+            single_session=1
+            ;;
+        n)
+            execute_iscsi=1
+            ;;
+        b)
+            execute_sbd=1
+            ;;
         d)
             execute_on_destroy=1
             ;;
+        k)
+            kill_running
+            exit 0
+            ;;
         l)
             log_to_file=$OPTARG
             ;;
+        w)
+            mirror_log=1
+            ;;
+        t)
+            sbd_timeouts=$OPTARG
+            ;;
         *)
             echo "Invalid option -$OPTARG" >&2
             print_help
@@ -161,19 +244,48 @@ while getopts ":hicsdl:" opt; do
     esac
 done
 
+# Running provisioning, so it can be killed with -k
+echo $$ > $pid_file
+trap 'rm -f $pid_file $fifo' EXIT
+
+# Phase results are reported on the original stdout
+exec 3>&1
+
+if [[ -n $mirror_log ]]; then
+    argument_number=$((argument_number - 1))
+fi
+
+if [[ -n $sbd_timeouts ]]; then
+    argument_number=$((argument_number - 1))
+    sbd_pillar="{\"cluster\": {\"sbd\": {\"watchdog_timeout\": ${sbd_timeouts%:*}, \"msgwait\": ${sbd_timeouts#*:}}}}"
+fi
+
 if [[ -n $log_to_file ]]; then
     argument_number=$((argument_number - 1))
-    exec 1>> $log_to_file
+    if [[ -n $mirror_log ]]; then
+        fifo=/tmp/salt/provision.fifo
+        rm -f $fifo && mkfifo $fifo
+        tee -a $log_to_file < $fifo >&2 &
+        exec 1> $fifo
+    else
+        exec 1>> $log_to_file
+    fi
 fi
 
 if [ $argument_number -eq 0 ]; then
-    install
-    config
-    start
+    run_phase install
+    run_phase config
+    run_phase start
 else
-    [[ -n $execute_install ]] && install
-    [[ -n $execute_config ]] && config
-    [[ -n $execute_start ]] && start
+    [[ -n $execute_install ]] && run_phase install
+    if [[ -n $single_session && -n $execute_config && -n $execute_start ]]; then
+        config_start
+    else
+        [[ -n $execute_config ]] && run_phase config
+        [[ -n $execute_start ]] && run_phase start
+    fi
+    [[ -n $execute_iscsi ]] && run_phase iscsi
+    [[ -n $execute_sbd ]] && run_phase sbd_probe
     [[ -n $execute_on_destroy ]] && on_destroy
 fi
 exit 0
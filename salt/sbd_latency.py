@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Measures the read and write latency of the sbd device with direct io, and derives the sbd watchdog and
+# msgwait timeouts from it. It is launched by provision.sh in the sbd_probe phase, whose results the deployer
+# gathers from every node, giving the worst timeouts to all of them as pillar before the cluster starts. The
+# derived timeouts are written to stdout as json, and a line "sbd <read p99 ms> <write p99 ms> <watchdog> <msgwait>"
+# is appended to the given results file.
+#
+# Reads are spread over the region used by sbd. Writes rewrite blocks with their own content in a region
+# sbd never uses, so they are safe even if sbd is already running on the device.
+#
+# Usage: sbd_latency.py RESULTS_FILE DEVICE MARGIN TIMING_JSON
+
+import os
+import sys
+import json
+import math
+import mmap
+import time
+import random
+
+
+BLOCK = 4096
+READS = 200
+WRITES = 50
+
+READ_REGION = (0, 4 * 1024 * 1024)
+WRITE_REGION = (8 * 1024 * 1024, 16 * 1024 * 1024)
+
+# sbd does not accept a watchdog timeout below this
+MINIMUM_WATCHDOG = 5
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+def measure(fd, region, count, write):
+    buffer = mmap.mmap(-1, BLOCK)
+    samples = []
+
+    for _ in range(count):
+        offset = random.randrange(region[0] // BLOCK, region[1] // BLOCK) * BLOCK
+
+        start = time.monotonic()
+        os.preadv(fd, [buffer], offset)
+        if write:
+            start = time.monotonic()
+            os.pwritev(fd, [buffer], offset)
+        samples.append((time.monotonic() - start) * 1000)
+
+    return samples
+
+
+def main(results_file, device, margin, timing):
+    fd = os.open(device, os.O_RDWR | os.O_DIRECT | os.O_DSYNC)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+        reads = measure(fd, (READ_REGION[0], min(READ_REGION[1], size)), READS, False)
+        writes = measure(fd, WRITE_REGION, WRITES, True) if size >= WRITE_REGION[1] else []
+    finally:
+        os.close(fd)
+
+    read_p99 = percentile(reads, 99)
+    write_p99 = percentile(writes, 99) if writes else read_p99
+
+    # the watchdog covers the slowest io with margin, but never fires before corosync notices a lost node
+    watchdog = max(
+        MINIMUM_WATCHDOG,
+        math.ceil(max(read_p99, write_p99) * margin / 1000),
+        math.ceil(timing["consensus"] / 1000) + 1,
+    )
+
+    result = {
+        "read_p50": round(percentile(reads, 50), 3),
+        "read_p99": round(read_p99, 3),
+        "write_p50": round(percentile(writes, 50), 3) if writes else None,
+        "write_p99": round(write_p99, 3),
+        "watchdog": watchdog,
+        "msgwait": watchdog * 2,
+    }
+
+    with open(results_file, "a") as f:
+        f.write(f"sbd {result['read_p99']} {result['write_p99']} {result['watchdog']} {result['msgwait']}\n")
+
+    print(json.dumps(result))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1], sys.argv[2], float(sys.argv[3]), json.loads(sys.argv[4])))
@@ -0,0 +1,75 @@
+import os
+import json
+import yaml
+
+import tasks
+
+
+def path_config(path, role):
+    """
+    Returns the salt-ssh configuration directory for a given role
+    """
+    return f"{path}/{role}"
+
+
+def path_roster(path):
+    """
+    Returns the roster file path
+    """
+    return f"{path}/roster"
+
+
+def roster_save(path, entries):
+    """
+    Write the roster with the given entries, indexed by host name
+    """
+    with open(path_roster(path), "w") as f:
+        yaml.dump(entries, f, indent = 4)
+
+
+def config_save(path, role, file_roots, pillar_roots, known_hosts):
+    """
+    Write the master configuration used to provision a given role. Every saltenv uses the same roots.
+    """
+    root_dir = os.path.abspath(path_config(path, role))
+    os.makedirs(root_dir, exist_ok = True)
+
+    config = {
+        "root_dir": root_dir,
+        "cachedir": f"{root_dir}/cache",
+        "pki_dir": f"{root_dir}/pki",
+        "log_file": f"{root_dir}/master.log",
+        "ssh_log_file": f"{root_dir}/ssh.log",
+        "known_hosts_file": os.path.abspath(known_hosts),
+        "file_roots": { saltenv: [ os.path.abspath(root) for root in file_roots ] for saltenv in ["base", "config"] },
+        "pillar_roots": { saltenv: [ os.path.abspath(root) for root in pillar_roots ] for saltenv in ["base", "config"] },
+    }
+
+    with open(f"{root_dir}/master", "w") as f:
+        yaml.dump(config, f, indent = 4)
+
+
+def run(path, role, target, function):
+    """
+    Execute a salt function through salt-ssh in the given target, with json output
+    """
+    return tasks.run(f"salt-ssh -c {path_config(path, role)} --roster-file {path_roster(path)} --out=json --static {target} {function}")
+
+
+def has_succeeded(result, target):
+    """
+    Check all states returned by a salt-ssh state run for the given target have succeeded
+    """
+    if tasks.has_failed(result):
+        return False
+
+    try:
+        ret = json.loads(tasks.get_stdout(result))[target]
+    except Exception:
+        return False
+
+    # rendering errors are returned as a list of strings, and connection errors as a dict with retcode and stderr
+    if not isinstance(ret, dict) or len(ret) == 0:
+        return False
+
+    return all(isinstance(state, dict) and state.get("result") is not False for state in ret.values())
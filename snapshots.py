@@ -0,0 +1,305 @@
+import os
+import time
+import logging
+import concurrent.futures
+
+import tasks
+import libvirt
+import ssh
+import logs
+import ready
+import utils
+
+
+def snapshot_wait(uri, domain, state, timeout):
+    """
+    Waits for a domain to reach a given state, up to timeout seconds
+    """
+    deadline = time.monotonic() + timeout
+    while libvirt.domain_state(uri, domain) != state:
+        if time.monotonic() > deadline:
+            return tasks.failure(f"Domain {domain} not {state} after {timeout} seconds")
+        time.sleep(2)
+
+    return tasks.success()
+
+
+def snapshot_raw_disks(uri, domain):
+    """
+    Returns the disks of a domain an internal snapshot cannot hold, all of those not in qcow2 format, ie: the shared sbd disk
+    """
+    return [ disk for disk in libvirt.domain_disks(uri, domain) if disk["format"] != "qcow2" ]
+
+
+def snapshot_region_path(path, snapshot, source):
+    """
+    Returns the path of the file keeping the start of a shared disk in a snapshot
+    """
+    return f"{path}/{snapshot}.{os.path.basename(source)}"
+
+
+def snapshot_quiesce_task(role, index, name, host, username, password):
+    """
+    Stops the cluster in a node and flushes the disks of any host, so its disks are consistent once it is shut down
+    """
+    command = "'sudo crm cluster stop && sudo sync'" if role == "node" else "sudo sync"
+    res = ssh.run(username, password, host, command, timeout=300)
+    if tasks.has_failed(res):
+        logging.critical(f"Cannot quiesce [{name}={host}]")
+        logging.critical(tasks.get_stderr(res))
+    else:
+        logging.info(f"Quiesced [{name}={host}]")
+
+    return res
+
+
+def snapshot_start_task(role, index, name, host, username, password):
+    """
+    Starts the cluster in a node, once its domain is started again
+    """
+    if role != "node":
+        return tasks.success()
+
+    res = ssh.run(username, password, host, "sudo crm cluster start", timeout=300)
+    if tasks.has_failed(res):
+        logging.critical(f"Cannot start cluster on [{name}={host}]")
+        logging.critical(tasks.get_stderr(res))
+    else:
+        logging.info(f"Cluster started on [{name}={host}]")
+
+    return res
+
+
+def snapshot_resume(env, uri, hosts):
+    """
+    Starts the domains of all hosts and, as soon as every node is ready, the cluster on it
+    """
+    for _, _, name, _, _, _ in hosts:
+        if libvirt.domain_state(uri, name) != "running":
+            res = libvirt.domain_start(uri, name)
+            if tasks.has_failed(res):
+                logging.critical(f"Cannot start domain {name}")
+                logging.critical(tasks.get_stderr(res))
+                return res
+
+    results = ready.on_ready(env, hosts, snapshot_start_task)
+    if tasks.any_failed(results):
+        return tasks.failure("Cannot start the cluster on all nodes")
+
+    return tasks.success()
+
+
+def snapshot_execute(name, snapshot):
+    """
+    Takes a consistent snapshot of every machine of a libvirt deployment. The cluster is stopped and every machine
+    shut down cleanly first, so all of them are snapshotted at the same point, which costs a shutdown and a boot of
+    every machine; only reset is fast. qcow2 disks are kept as internal snapshots of their domains. Disks in any other
+    format are left out of them: the start of the shareable ones, holding the sbd metadata, is kept in the deployment
+    folder, and the rest are not reverted. Machines and cluster are started again afterwards.
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    if env["provider"] != "libvirt":
+        res = tasks.failure("Snapshots are only available with libvirt provider")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+    uri = env["common"]["qemu_uri"]
+    settings = env["snapshot"]
+    hosts = utils.get_hosts_from_env(env)
+    domains = [ host_name for _, _, host_name, _, _, _ in hosts ]
+
+    #
+    # Quiesce cluster and shut down machines
+    #
+    logging.info(f"[X] Quiescing cluster...")
+
+    with concurrent.futures.ThreadPoolExecutor(len(hosts)) as executor:
+        futures = [ executor.submit(logs.hosted(host[2], snapshot_quiesce_task), *host) for host in hosts ]
+        results = [ future.result() for future in futures ]
+
+    if tasks.any_failed(results):
+        res = tasks.failure("Cannot quiesce all hosts")
+        logging.critical(tasks.get_stderr(res))
+        snapshot_resume(env, uri, hosts)
+        return res
+
+    start = time.monotonic()
+    for domain in domains:
+        libvirt.domain_shutdown(uri, domain)
+
+    for domain in domains:
+        res = snapshot_wait(uri, domain, "shut off", settings["timeout"])
+        if tasks.has_failed(res):
+            logging.critical(tasks.get_stderr(res))
+            snapshot_resume(env, uri, hosts)
+            return res
+
+    logging.info(f"Machines shut down in {int(time.monotonic() - start)} seconds")
+
+    logging.info("OK\n")
+
+    #
+    # Take snapshots
+    #
+    logging.info(f"[X] Taking snapshot {snapshot}...")
+
+    path = utils.path_deployment_snapshots(env["name"])
+    os.makedirs(path, exist_ok = True)
+
+    snapshots = env.get("snapshots", {})
+    shared = set()
+
+    def snapshot_task(domain):
+        # a previous snapshot with the same name is replaced
+        if snapshot in snapshots:
+            libvirt.snapshot_delete(uri, domain, snapshot)
+
+        raw = snapshot_raw_disks(uri, domain)
+        for disk in raw:
+            if not disk["shareable"]:
+                logging.warning(f"Disk {disk['source']} of {domain} is {disk['format']}, it is left out of snapshot {snapshot}")
+
+        res = libvirt.snapshot_create(uri, domain, snapshot, f"{path}/{domain}.{snapshot}.xml", [ disk["target"] for disk in raw ])
+        if tasks.has_failed(res):
+            logging.critical(f"Cannot take snapshot {snapshot} of {domain}")
+            logging.critical(tasks.get_stderr(res))
+        else:
+            logging.info(f"Snapshot {snapshot} of {domain}")
+
+        return (res, raw)
+
+    with concurrent.futures.ThreadPoolExecutor(len(domains)) as executor:
+        futures = [ executor.submit(snapshot_task, domain) for domain in domains ]
+        for future in futures:
+            res, raw = future.result()
+            if tasks.has_failed(res):
+                snapshot_resume(env, uri, hosts)
+                return res
+            shared.update(disk["source"] for disk in raw if disk["shareable"])
+
+    # shared disks are attached to several domains, their start is kept once
+    for source in sorted(shared):
+        res = libvirt.volume_download(uri, source, snapshot_region_path(path, snapshot, source), settings["sbd_size"] * 1024 * 1024)
+        if tasks.has_failed(res):
+            logging.critical(f"Cannot keep shared disk {source}")
+            logging.critical(tasks.get_stderr(res))
+            snapshot_resume(env, uri, hosts)
+            return res
+
+    snapshots[snapshot] = { "domains": domains, "shared": sorted(shared), "created": time.strftime("%Y-%m-%d %H:%M:%S") }
+    env["snapshots"] = snapshots
+    utils.environment_save(env["name"], **env)
+
+    logging.info("OK\n")
+
+    #
+    # Start machines again
+    #
+    logging.info(f"[X] Starting cluster...")
+
+    res = snapshot_resume(env, uri, hosts)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
+def reset_execute(name, snapshot):
+    """
+    Reverts every machine of a libvirt deployment to a snapshot taken with snapshot_execute, all of them together,
+    and starts them and the cluster again. Snapshots hold disks only, taken with the machines shut down, so
+    this is a cold boot of the whole cluster, not a resume of running machines
+    """
+    #
+    # Check deployment does exist
+    #
+    res, env = utils.deployment_verify(name)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    if snapshot not in env.get("snapshots", {}):
+        res = tasks.failure(f"Snapshot {snapshot} does not exist in deployment {env['name']}")
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    ssh.use_known_hosts(utils.path_deployment_known_hosts(env["name"]))
+
+    uri = env["common"]["qemu_uri"]
+    hosts = utils.get_hosts_from_env(env)
+    taken = env["snapshots"][snapshot]
+
+    #
+    # Revert machines, powered off at once as their state is thrown away
+    #
+    logging.info(f"[X] Reverting to snapshot {snapshot} taken {taken['created']}, machines boot cold from it...")
+
+    def revert_task(domain):
+        if libvirt.domain_state(uri, domain) != "shut off":
+            libvirt.domain_destroy(uri, domain)
+
+        res = libvirt.snapshot_revert(uri, domain, snapshot)
+        if tasks.has_failed(res):
+            logging.critical(f"Cannot revert {domain} to snapshot {snapshot}")
+            logging.critical(tasks.get_stderr(res))
+        else:
+            logging.info(f"Reverted {domain}")
+
+        return res
+
+    with concurrent.futures.ThreadPoolExecutor(len(taken["domains"])) as executor:
+        futures = [ executor.submit(revert_task, domain) for domain in taken["domains"] ]
+        results = [ future.result() for future in futures ]
+
+    if tasks.any_failed(results):
+        return tasks.failure(f"Cannot revert all machines to snapshot {snapshot}")
+
+    for source in taken["shared"]:
+        res = libvirt.volume_upload_region(uri, source, snapshot_region_path(utils.path_deployment_snapshots(env["name"]), snapshot, source))
+        if tasks.has_failed(res):
+            logging.critical(f"Cannot revert shared disk {source}")
+            logging.critical(tasks.get_stderr(res))
+            return res
+
+    logging.info("OK\n")
+
+    #
+    # Start machines again
+    #
+    logging.info(f"[X] Starting cluster...")
+
+    res = snapshot_resume(env, uri, hosts)
+    if tasks.has_failed(res):
+        logging.critical(tasks.get_stderr(res))
+        return res
+
+    logging.info("OK\n")
+
+    return tasks.success()
+
+
+def snapshot_delete_all(env):
+    """
+    Deletes every snapshot of a deployment, as domains with snapshots cannot be destroyed
+    """
+    uri = env["common"]["qemu_uri"]
+    for snapshot, taken in env.get("snapshots", {}).items():
+        for domain in taken["domains"]:
+            res = libvirt.snapshot_delete(uri, domain, snapshot)
+            if tasks.has_failed(res):
+                logging.warning(f"Cannot delete snapshot {snapshot} of {domain}")
+                logging.warning(tasks.get_stderr(res))
+            else:
+                logging.info(f"Deleted snapshot {snapshot} of {domain}")
@@ -1,21 +1,99 @@
+import os
 import time
+import errno
+import random
+import socket
+import selectors
+import threading
 
 import tasks
 
 
-def run(user, password, host, command):
+#
+# Known hosts
+#
+known_hosts = None
+known_hosts_mutex = threading.Lock()
+
+def use_known_hosts(path):
+    """
+    Verify host keys against a given known_hosts file, instead of the user's one. Unknown hosts are added to it
+    """
+    global known_hosts
+    known_hosts = path
+
+
+def options():
+    """
+    Returns the options of ssh commands for host keys checking
+    """
+    if known_hosts:
+        return f"-o UserKnownHostsFile={known_hosts} -o StrictHostKeyChecking=accept-new"
+    return "-o StrictHostKeyChecking=no"
+
+
+def scan_host_key(host, timeout = 5):
+    """
+    Collects the keys of a remote host and adds them to the known_hosts file in use, replacing previous ones
+    """
+    if not known_hosts:
+        return tasks.failure("No known_hosts file in use")
+
+    res = tasks.run(f"ssh-keyscan -T {timeout} {host}")
+    keys = [ line for line in tasks.get_stdout(res).splitlines() if line and not line.startswith("#") ]
+    if len(keys) == 0:
+        return tasks.failure(f"Cannot get host keys of {host}: {tasks.get_stderr(res)}")
+
+    with known_hosts_mutex:
+        lines = []
+        if os.path.exists(known_hosts):
+            with open(known_hosts, "r") as f:
+                lines = [ line.rstrip("\n") for line in f if not line.startswith(f"{host} ") ]
+
+        with open(known_hosts, "w") as f:
+            f.writelines(f"{line}\n" for line in lines + keys)
+
+    return tasks.success()
+
+
+#
+# Remote execution
+#
+
+
+def is_reachable(host, port = 22, timeout = 5):
+    """
+    Check if a TCP connection can be opened to a remote host in a given time
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def run(user, password, host, command, timeout = None):
     """
-    Execute a command in a remote host
+    Execute a command in a remote host. If a timeout is given, the command is killed after that many seconds
     """
-    remote_command = f"sshpass -p {password} ssh -o StrictHostKeyChecking=no {user}@{host} {command}"
-    return tasks.run(remote_command)
+    connect = f"-o ConnectTimeout={min(timeout, 30)}" if timeout else ""
+    remote_command = f"sshpass -p {password} ssh {options()} {connect} {user}@{host} {command}"
+    return tasks.run(remote_command, timeout=timeout)
+
+
+def run_watched(user, password, host, command, idle, interval = 10):
+    """
+    Execute a command in a remote host, killing the session if it makes no progress for idle seconds
+    """
+    remote_command = f"sshpass -p {password} ssh {options()} -o ConnectTimeout=30 {user}@{host} {command}"
+    return tasks.run_watched(remote_command, idle, interval=interval)
 
 
 def copy_to_host(user, password, host, origin, destination):
     """
     Copy a local directory to a remote host
     """
-    command = f"sshpass -p {password} scp -o StrictHostKeyChecking=no -r {origin} {user}@{host}:{destination}"
+    command = f"sshpass -p {password} scp {options()} -r {origin} {user}@{host}:{destination}"
     return tasks.run(command)
 
 
@@ -23,20 +101,100 @@ def copy_from_host(user, password, host, origin, destination):
     """
     Copy to a local directory from a remote host
     """
-    command = f"sshpass -p {password} scp -o StrictHostKeyChecking=no -r {user}@{host}:{origin} {destination}"
+    command = f"sshpass -p {password} scp {options()} -r {user}@{host}:{origin} {destination}"
     return tasks.run(command)
 
 
-def safe_copy_to_host(user, password, host, origin, destination):
+def stream_from_host(user, password, host, command, destination, input = "", timeout = None):
+    """
+    Execute a command in a remote host, writing its output to a local file as it is streamed back
+    """
+    connect = f"-o ConnectTimeout={min(timeout, 30)}" if timeout else ""
+    remote_command = f"sshpass -p {password} ssh {options()} {connect} {user}@{host} {command}"
+    return tasks.run_to_file(remote_command, destination, input=input, timeout=timeout)
+
+
+def backoff(delay, maximum = 5):
+    """
+    Returns the next delay of an exponential backoff and the time to wait for it, with full jitter
+    """
+    return (min(delay * 2, maximum), random.uniform(0, delay))
+
+
+def wait_for_ports(hosts, port = 22, timeout = 600, connect_timeout = 5):
+    """
+    Probes a port in all the given hosts concurrently, using non-blocking sockets and retrying every host
+    with exponential backoff. Yields (host, True) as soon as each host accepts connections, and (host, False)
+    for the ones which did not before timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    pending = { host: (time.monotonic(), 0.5) for host in hosts }
+    selector = selectors.DefaultSelector()
+
+    def retry(host, delay):
+        delay, wait = backoff(delay)
+        pending[host] = (time.monotonic() + wait, delay)
+
+    while (pending or selector.get_map()) and time.monotonic() < deadline:
+        now = time.monotonic()
+
+        # launch due probes
+        for host, (at, delay) in list(pending.items()):
+            if at > now:
+                continue
+            del pending[host]
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            if sock.connect_ex((host, port)) in [0, errno.EINPROGRESS, errno.EAGAIN]:
+                selector.register(sock, selectors.EVENT_WRITE, (host, delay, now + connect_timeout))
+            else:
+                sock.close()
+                retry(host, delay)
+
+        # wait for the next probe completion or scheduled attempt
+        wakeups = [ at for at, _ in pending.values() ] + [ key.data[2] for key in selector.get_map().values() ]
+        wait = max(0, min(wakeups + [deadline]) - time.monotonic())
+
+        for key, _ in selector.select(timeout=wait):
+            sock = key.fileobj
+            host, delay, _ = key.data
+            selector.unregister(sock)
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            sock.close()
+            if error == 0:
+                yield (host, True)
+            else:
+                retry(host, delay)
+
+        # expire connections that took too long
+        for key in list(selector.get_map().values()):
+            host, delay, expires = key.data
+            if expires <= time.monotonic():
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                retry(host, delay)
+
+    for key in list(selector.get_map().values()):
+        selector.unregister(key.fileobj)
+        key.fileobj.close()
+        pending[key.data[0]] = None
+    selector.close()
+
+    for host in pending:
+        yield (host, False)
+
+
+def wait_for_login(user, password, host, trys = 5):
     """
-    Copy a local directory to a remote host. Trys 30 times, 30 seconds
+    Checks a remote host accepts logins, as sshd may accept connections before users can log in
     """
-    trys = 30
+    delay = 1
     while True:
-        res = copy_to_host(user, password, host, origin, destination)
+        res = run(user, password, host, "true", timeout=30)
 
-        if tasks.get_return_code(res) == 0 or trys == 0:
+        if tasks.has_succeeded(res) or trys == 0:
             return res
 
         trys = trys - 1
-        time.sleep(1)
+        delay, wait = backoff(delay)
+        time.sleep(wait)
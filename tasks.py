@@ -1,20 +1,114 @@
+import os
+import time
+import signal
+import threading
 import subprocess
 
 
-def run(command, input = ""):
+def run(command, input = "", timeout = None):
     """
     Executes a given command. Return a tuple with (return_code, stdout, stderr)
+    If a timeout in seconds is given and expires, the command is killed and 124 is returned as return code
     """
-    if input != "":
-        pipes = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        stdout, stderr = pipes.communicate(input=input.encode('utf-8'))
-    else:
-        pipes = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    stdin = subprocess.PIPE if input != "" else None
+    pipes = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, start_new_session=timeout is not None)
+
+    try:
+        stdout, stderr = pipes.communicate(input=input.encode('utf-8') if input != "" else None, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(pipes.pid, signal.SIGKILL)
         stdout, stderr = pipes.communicate()
+        return (124, stdout.decode("utf-8"), stderr.decode("utf-8") + f"Timeout after {timeout} seconds running: {command}")
     
     return (pipes.returncode, stdout.decode("utf-8"), stderr.decode("utf-8"))
 
 
+def run_streamed(command, on_line):
+    """
+    Executes a given command, calling on_line with every line of its stdout as soon as it is written.
+    Return a tuple with (return_code, stdout, stderr)
+    """
+    pipes = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
+
+    # stderr is drained aside, so the command never blocks on it
+    stderr = []
+    drain = threading.Thread(target=lambda: stderr.append(pipes.stderr.read()))
+    drain.start()
+
+    stdout = []
+    for line in pipes.stdout:
+        stdout.append(line)
+        on_line(line.rstrip("\n"))
+
+    drain.join()
+    pipes.wait()
+
+    return (pipes.returncode, "".join(stdout), "".join(stderr))
+
+
+def run_watched(command, idle, interval = 10):
+    """
+    Executes a given command, killing it if it makes no progress for idle seconds, checked every interval seconds.
+    Any output of the command is progress. Return a tuple with (return_code, stdout, stderr). If the command stalls, 125 is returned as return code
+    """
+    pipes = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, start_new_session=True)
+
+    output = { "stdout": [], "stderr": [], "last": time.monotonic() }
+
+    def drain(stream, chunks):
+        for chunk in iter(stream.readline, b""):
+            chunks.append(chunk)
+            output["last"] = time.monotonic()
+
+    drains = [ threading.Thread(target=drain, args=(pipes.stdout, output["stdout"])), threading.Thread(target=drain, args=(pipes.stderr, output["stderr"])) ]
+    for drain_thread in drains:
+        drain_thread.start()
+
+    stalled = False
+    while True:
+        try:
+            pipes.wait(timeout=interval)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+
+        if time.monotonic() - output["last"] > idle:
+            os.killpg(pipes.pid, signal.SIGKILL)
+            pipes.wait()
+            stalled = True
+            break
+
+    for drain_thread in drains:
+        drain_thread.join()
+
+    stdout = b"".join(output["stdout"]).decode("utf-8")
+    stderr = b"".join(output["stderr"]).decode("utf-8")
+
+    if stalled:
+        return (125, stdout, stderr + f"No progress after {idle} seconds running: {command}")
+
+    return (pipes.returncode, stdout, stderr)
+
+
+def run_to_file(command, destination, input = "", timeout = None):
+    """
+    Executes a given command, writing its stdout as it is to a given file. Return a tuple with (return_code, "", stderr)
+    If a timeout in seconds is given and expires, the command is killed and 124 is returned as return code
+    """
+    stdin = subprocess.PIPE if input != "" else None
+    with open(destination, "wb") as f:
+        pipes = subprocess.Popen(command, stdin=stdin, stdout=f, stderr=subprocess.PIPE, shell=True, start_new_session=timeout is not None)
+
+        try:
+            _, stderr = pipes.communicate(input=input.encode('utf-8') if input != "" else None, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(pipes.pid, signal.SIGKILL)
+            _, stderr = pipes.communicate()
+            return (124, "", stderr.decode("utf-8") + f"Timeout after {timeout} seconds running: {command}")
+
+    return (pipes.returncode, "", stderr.decode("utf-8"))
+
+
 #
 # Constructors
 #
@@ -60,3 +154,7 @@ def has_succeeded(result):
 def has_failed(result):
     return not has_succeeded(result)
 
+
+def any_failed(results):
+    return any(has_failed(result) for result in results)
+
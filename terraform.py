@@ -26,6 +26,13 @@ def workspace(path, workspace):
     return tasks.run(f"cd {path} && terraform workspace new {workspace} -no-color")
 
 
+def validate(path):
+    """
+    Validate the Terraform files in a given path.
+    """
+    return tasks.run(f"cd {path} && terraform validate -no-color")
+
+
 def apply(path):
     """
     Launch Terraform and apply the changes.
@@ -33,6 +40,35 @@ def apply(path):
     return tasks.run(f"cd {path} && terraform apply -auto-approve -no-color")
 
 
+def apply_streamed(path, on_line):
+    """
+    Launch Terraform and apply the changes, calling on_line with every line of its output as it progresses.
+    """
+    return tasks.run_streamed(f"cd {path} && terraform apply -auto-approve -no-color", on_line)
+
+
+def state_list(path):
+    """
+    List the addresses of the resources in the Terraform state of a given path.
+    """
+    return tasks.run(f"cd {path} && terraform state list")
+
+
+def taint(path, address):
+    """
+    Mark a resource to be replaced on the next apply.
+    """
+    return tasks.run(f"cd {path} && terraform taint -no-color '{address}'")
+
+
+def apply_targets(path, addresses):
+    """
+    Launch Terraform and apply the changes to the given resources only, and to what they depend on.
+    """
+    targets = " ".join(f"-target='{address}'" for address in addresses)
+    return tasks.run(f"cd {path} && terraform apply -auto-approve -no-color {targets}")
+
+
 def refresh(path):
     """
     Launch Terraform and refresh output.
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+import yaml
+
+# modules of the deployer are imported from the root of the repository, as deploy.py does
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import utils
+
+
+@pytest.fixture
+def example_env():
+    """
+    Returns a function building the environment of the example deployment of a provider, merged with its defaults
+    and sunk as deploy.py does, with the names and addresses the infrastructure would give
+    """
+    def build(provider, **common):
+        with open(f"{root}/deployment.{provider}.yaml.example", "r") as f:
+            user_data = yaml.load(f, Loader=yaml.FullLoader)
+        with open(f"{root}/config/defaults.{provider}.yaml", "r") as f:
+            defaults = yaml.load(f, Loader=yaml.FullLoader)
+
+        env = utils.merge(defaults, user_data)
+        env["common"].update(common)
+        env = utils.sink(env)
+
+        for number, role in enumerate(["iscsi", "qdevice", "examiner"]):
+            if role in env:
+                env[role].update(name = role, public_ip = f"10.0.0.{100 + number}", private_ip = f"192.168.0.{100 + number}")
+        for index in range(1, env["node"]["count"] + 1):
+            env["node"][index].update(name = f"node{index:0>2}", public_ip = f"10.0.0.{index}", private_ip = f"192.168.0.{index}")
+
+        return env
+
+    return build
@@ -0,0 +1,88 @@
+import os
+import json
+import importlib.util
+import xml.etree.ElementTree as ET
+
+import bench
+
+
+def script(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(__file__), "..", bench.path_script(name)))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_percentile():
+    values = [ 5, 1, 4, 2, 3 ]
+    assert bench.percentile(values, 0) == 1
+    assert bench.percentile(values, 50) == 3
+    assert bench.percentile(values, 90) == 5
+    assert bench.percentile(values, 100) == 5
+    assert bench.percentile([ 7 ], 99) == 7
+
+
+def test_summarize():
+    assert bench.summarize([]) == { "count": 0 }
+
+    summary = bench.summarize([ i / 3 for i in range(1, 101) ])
+    assert summary["count"] == 100
+    assert summary["min"] == 0.333
+    assert summary["p50"] == 16.667
+    assert summary["p90"] == 30.0
+    assert summary["p99"] == 33.0
+    assert summary["max"] == 33.333
+
+
+def test_report_save(tmp_path):
+    path = bench.report_save(str(tmp_path / "bench"), "failover", { "summary": {} })
+
+    assert os.path.basename(path).startswith("failover-")
+    with open(path) as f:
+        assert json.load(f) == { "summary": {} }
+
+
+def test_failover_status(monkeypatch):
+    module = script("failover")
+    out = f"""<pacemaker-result>
+  <nodes>
+    <node name="node01" online="true"/>
+    <node name="node02" online="false" unclean="true"/>
+    <node name="node03" online="false" unclean="false"/>
+  </nodes>
+  <resources>
+    <resource id="{module.RESOURCE}" role="Started"><node name="node01" id="1"/></resource>
+  </resources>
+</pacemaker-result>"""
+    monkeypatch.setattr(module, "run", lambda node, command, timeout = 30: (0, out))
+
+    nodes, location = module.status("node01")
+    assert nodes == { "node01": "online", "node02": "unclean", "node03": "offline" }
+    assert location == "node01"
+
+
+def test_failover_status_unreachable(monkeypatch):
+    module = script("failover")
+
+    monkeypatch.setattr(module, "run", lambda node, command, timeout = 30: (255, ""))
+    assert module.status("node01") == (None, None)
+
+    monkeypatch.setattr(module, "run", lambda node, command, timeout = 30: (0, "<truncated"))
+    assert module.status("node01") == (None, None)
+
+
+def test_cib_resources():
+    module = script("cib")
+
+    resources = ET.fromstring(module.resources_xml(10, 25, 10))
+    groups = resources.findall("group")
+    assert [ group.get("id") for group in groups ] == [ "bench-cib-group-10", "bench-cib-group-20" ]
+    assert [ len(group.findall("primitive")) for group in groups ] == [ 10, 5 ]
+    assert groups[1].find("primitive").get("id") == "bench-cib-20"
+    assert groups[1].find("primitive/operations/op").get("id") == "bench-cib-20-monitor"
+
+    constraints = ET.fromstring(module.constraints_xml(10, 25, 10, "node01"))
+    assert [ (location.get("rsc"), location.get("node")) for location in constraints.findall("rsc_location") ] == [
+        ("bench-cib-group-10", "node01"),
+        ("bench-cib-group-20", "node01"),
+    ]
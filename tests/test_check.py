@@ -0,0 +1,145 @@
+import pytest
+
+import check
+import deploy
+import tasks
+
+
+def azure_env(example_env, tmp_path):
+    env = example_env("azure")
+    key = tmp_path / "id_rsa.pub"
+    key.write_text("ssh-rsa AAAA")
+    for _, entry in check.machines(env):
+        entry["public_key_file"] = str(key)
+    return env
+
+
+def test_examples_are_valid(example_env, tmp_path):
+    assert check.schema_problems(example_env("libvirt")) == []
+    assert check.schema_problems(example_env("container")) == []
+    assert check.schema_problems(azure_env(example_env, tmp_path)) == []
+
+
+def test_unknown_provider(example_env):
+    env = example_env("libvirt")
+    env["provider"] = "gcp"
+    problems = check.schema_problems(env)
+    assert len(problems) == 1
+    assert problems[0].startswith("provider is 'gcp'")
+
+
+def test_missing_and_invalid_keys(example_env):
+    env = example_env("libvirt")
+    del env["common"]["reg_code"]
+    env["node"]["count"] = True
+    env["provision"]["ready_timeout"] = "600"
+    problems = check.schema_problems(env)
+    assert "common.reg_code is missing" in problems
+    assert "node.count has an invalid value True" in problems
+    assert "provision.ready_timeout has an invalid value '600'" in problems
+
+
+def test_storage_of_provider(example_env):
+    env = example_env("container")
+    env["common"]["shared_storage_type"] = "iscsi"
+    problems = check.schema_problems(env)
+    assert problems == ["common.shared_storage_type is 'iscsi', must be one of: none"]
+
+
+def test_name(example_env):
+    env = example_env("libvirt")
+    env["name"] = "my cluster"
+    assert check.schema_problems(env) == ["name 'my cluster' must be letters, digits, - and _"]
+
+
+def test_machines(example_env):
+    env = example_env("libvirt")
+    env["node"][2]["source_image"] = ""
+    env["node"][2]["volume_name"] = ""
+    env["node"][3]["cpus"] = 0
+    env["node"][3]["memory"] = 1.5
+    problems = check.schema_problems(env)
+    assert "node02: source_image or volume_name must be given" in problems
+    assert "node03: cpus must be positive" in problems
+    assert "node03: memory has an invalid value 1.5" in problems
+
+
+def test_azure_public_key_file(example_env, tmp_path):
+    env = azure_env(example_env, tmp_path)
+    env["node"][1]["public_key_file"] = str(tmp_path / "missing.pub")
+    assert check.schema_problems(env) == [f"node01: public_key_file {tmp_path}/missing.pub does not exist"]
+
+
+def test_addresses(example_env):
+    env = example_env("libvirt")
+    assert check.addresses(env, "common.private_ip_range") == []
+
+    env["common"]["private_ip_range"] = "192.168.145.0/29"
+    problems = check.addresses(env, "common.private_ip_range")
+    assert len(problems) == 1
+    assert problems[0].startswith("common.private_ip_range 192.168.145.0/29 has 6 usable addresses")
+
+    env["common"]["private_ip_range"] = "192.168.145.300/24"
+    problems = check.addresses(env, "common.private_ip_range")
+    assert len(problems) == 1
+    assert problems[0].startswith("common.private_ip_range is not a valid network")
+
+
+def test_addresses_subnet(example_env, tmp_path):
+    env = azure_env(example_env, tmp_path)
+    assert check.addresses(env, "common.private_ip_range", subnet = 8) == []
+
+    env["common"]["private_ip_range"] = "10.74.0.0/26"
+    assert check.addresses(env, "common.private_ip_range", subnet = 8) == ["common.private_ip_range is too small to hold a /34 subnet"]
+
+
+def test_timing(example_env):
+    env = example_env("libvirt")
+    env["timing"]["preset"] = "slow"
+    env["timing"]["override"] = { "token": 5000, "tokens": 5000 }
+    problems = check.schema_problems(env)
+    assert len(problems) == 1
+    assert problems[0].startswith("timing.preset is 'slow', must be one of: , default")
+
+    env["timing"]["preset"] = ""
+    assert check.schema_problems(env) == ["timing.override has an unknown key tokens"]
+
+
+def test_probe_capacity(example_env, monkeypatch):
+    env = example_env("libvirt")
+    for _, entry in check.machines(env):
+        entry.update(cpus = 2, memory = 2048)
+    count = len(check.machines(env))
+    nodeinfo = "CPU model:           x86_64\nCPU(s):              2\nMemory size:         {} KiB\n"
+
+    monkeypatch.setattr(tasks, "run", lambda command, timeout = None: tasks.success(nodeinfo.format(count * 2048 * 1024)))
+    assert check.probe_capacity("qemu:///system", env, 5) == []
+
+    env["node"][1]["cpus"] = 4
+    monkeypatch.setattr(tasks, "run", lambda command, timeout = None: tasks.success(nodeinfo.format(2048 * 1024)))
+    assert check.probe_capacity("qemu:///system", env, 5) == [
+        "node01: 4 cpus, but qemu:///system has 2",
+        f"Machines need {count * 2048} MiB of memory, but qemu:///system has 2048 MiB",
+    ]
+
+
+def test_check_environment(example_env, monkeypatch, caplog):
+    env = example_env("libvirt")
+    monkeypatch.setattr(check, "probes", lambda env, timeout: [
+        ("terraform", lambda: []),
+        ("pool", lambda: ["Storage pool default does not exist"]),
+        ("image", lambda: ["Image image.qcow2 does not exist"]),
+    ])
+
+    res = deploy.check_environment(env)
+    assert tasks.get_stderr(res) == f"2 problems found in deployment {env['name']}"
+    assert "Storage pool default does not exist" in caplog.text
+    assert "Image image.qcow2 does not exist" in caplog.text
+
+
+def test_check_environment_schema_first(example_env, monkeypatch):
+    env = example_env("libvirt")
+    env["name"] = "my cluster"
+    monkeypatch.setattr(check, "probes", lambda env, timeout: pytest.fail("probed an invalid environment"))
+
+    assert tasks.has_failed(deploy.check_environment(env))
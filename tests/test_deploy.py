@@ -0,0 +1,698 @@
+import os
+import json
+import tarfile
+import time
+import shutil
+import threading
+
+import pytest
+
+import deploy
+import tasks
+import terraform
+import saltssh
+import libvirt
+import ready
+import ssh
+import utils
+
+
+def host_env(count):
+    """
+    Returns the environment of a deployment of count nodes, with addresses already given
+    """
+    env = { "name": "test", "common": {}, "node": { "count": count } }
+    for index in range(1, count + 1):
+        env["node"][index] = { "name": f"node{index:0>2}", "public_ip": f"10.0.0.{index}", "username": "root", "password": "linux" }
+    return env
+
+
+@pytest.fixture
+def destroyed(monkeypatch):
+    """
+    Stubs the deployment and terraform out of destroy. Returns the ssh commands run, as (host, command, timeout)
+    """
+    commands = []
+
+    def setup(env, unreachable = (), hanging = ()):
+        monkeypatch.setattr(deploy, "read_deployment_file", lambda filename: env)
+        monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+        monkeypatch.setattr(terraform, "is_initialized", lambda path: True)
+        monkeypatch.setattr(terraform, "destroy", lambda path: tasks.success())
+        monkeypatch.setattr(shutil, "rmtree", lambda path: None)
+        monkeypatch.setattr(ssh, "use_known_hosts", lambda path: None)
+        monkeypatch.setattr(ssh, "is_reachable", lambda host, port = 22, timeout = 5: host not in unreachable)
+
+        def run(user, password, host, command, timeout = None):
+            commands.append( (host, command, timeout) )
+            if host in hanging:
+                time.sleep(timeout)
+                return (124, "", "Timeout")
+            return tasks.success()
+        monkeypatch.setattr(ssh, "run", run)
+
+        return commands
+
+    return setup
+
+
+def test_destroy_without_reg_code(destroyed):
+    env = host_env(2)
+    commands = destroyed(env)
+    assert tasks.has_succeeded(deploy.destroy("deployment.yaml"))
+    assert commands == []
+
+
+def test_destroy_deadlines(destroyed):
+    env = host_env(4)
+    env["common"]["reg_code"] = "code"
+    env["destroy"] = { "timeout": 1 }
+    commands = destroyed(env, unreachable = ["10.0.0.2"], hanging = ["10.0.0.3", "10.0.0.4"])
+
+    start = time.time()
+    assert tasks.has_succeeded(deploy.destroy("deployment.yaml"))
+    # hanging hosts are given their deadline at the same time, the unreachable one is skipped
+    assert time.time() - start < 1.9
+    assert sorted(host for host, _, _ in commands) == ["10.0.0.1", "10.0.0.3", "10.0.0.4"]
+    assert all(timeout == 1 for _, _, timeout in commands)
+
+
+@pytest.fixture
+def imported(monkeypatch, tmp_path):
+    """
+    Stubs libvirt out of image_cache_task with a pool holding the given complete volumes. Returns the commands run
+    """
+    image = tmp_path / "image.qcow2"
+    image.write_bytes(b"image")
+    monkeypatch.setattr(utils, "image_cache_name", lambda source: "base-1234")
+    monkeypatch.setattr(utils, "image_fetch", lambda source, destination: str(image))
+    monkeypatch.setattr(utils, "image_format", lambda path: "qcow2")
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+    def setup(complete, upload = tasks.success(), clone = tasks.success()):
+        commands = []
+
+        def volume_complete(uri, pool, volume):
+            commands.append( ("complete", volume) )
+            return volume in complete
+        monkeypatch.setattr(libvirt, "volume_complete", volume_complete)
+        monkeypatch.setattr(libvirt, "volume_create", lambda uri, pool, volume, size, format: commands.append( ("create", volume) ) or tasks.success())
+        monkeypatch.setattr(libvirt, "volume_upload", lambda uri, pool, volume, path: commands.append( ("upload", volume) ) or upload)
+        monkeypatch.setattr(libvirt, "volume_clone", lambda uri, pool, volume, clone_name: commands.append( ("clone", volume, clone_name) ) or clone)
+        monkeypatch.setattr(libvirt, "volume_delete", lambda uri, pool, volume: commands.append( ("delete", volume) ) or tasks.success())
+        return commands
+
+    return setup
+
+
+def test_image_cache_task(imported):
+    commands = imported([])
+
+    res, volume = deploy.image_cache_task("test", "qemu:///system", "default", "image.qcow2")
+    assert tasks.has_succeeded(res)
+    assert volume == "base-1234"
+    # uploaded under a name of its own, and cloned once complete
+    partial = commands[1][1]
+    assert partial.startswith("base-1234.") and partial.endswith(".part")
+    assert commands[1:] == [("create", partial), ("upload", partial), ("clone", partial, "base-1234"), ("delete", partial)]
+
+
+def test_image_cache_task_reused(imported):
+    commands = imported(["base-1234"])
+
+    res, volume = deploy.image_cache_task("test", "qemu:///system", "default", "image.qcow2")
+    assert tasks.has_succeeded(res)
+    assert commands == [("complete", "base-1234")]
+
+
+def test_image_cache_task_imported_meanwhile(imported, monkeypatch):
+    commands = imported([], clone = tasks.failure("error: storage volume 'base-1234' exists already"))
+    complete = []
+    monkeypatch.setattr(libvirt, "volume_complete", lambda uri, pool, volume: complete.append(volume) or len(complete) > 2)
+
+    # the clone of the other deployment is waited for
+    res, volume = deploy.image_cache_task("test", "qemu:///system", "default", "image.qcow2")
+    assert tasks.has_succeeded(res)
+    assert len(complete) == 3
+    assert commands[-1][0] == "delete"
+
+
+def test_image_cache_task_upload_failure(imported):
+    commands = imported([], upload = tasks.failure("upload failed"))
+
+    res, volume = deploy.image_cache_task("test", "qemu:///system", "default", "image.qcow2")
+    assert tasks.get_stderr(res) == "upload failed"
+    assert [ command[0] for command in commands ] == ["complete", "create", "upload", "delete"]
+
+
+def test_infrastructure_plan(example_env, monkeypatch):
+    env = example_env("libvirt")
+    env["common"]["network"]["ring1"] = True
+    for index in range(1, int(env["node"]["count"]) + 1):
+        for key in ["name", "private_ip", "ring1_ip", "public_ip"]:
+            env["node"][index].pop(key, None)
+    monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+    monkeypatch.setattr(utils, "environment_save", lambda deployment_name, **env: None)
+
+    assert tasks.has_succeeded(deploy.infrastructure_plan("test"))
+    private = env["common"]["private_ip_range"].rsplit(".", 1)[0]
+    assert env["node"][1]["name"] == "test-node01"
+    assert env["node"][1]["private_ip"] == f"{private}.{libvirt.private_host_numbers['node'] + 1}"
+    assert env["node"][1]["ring1_ip"].endswith(f".{libvirt.private_host_numbers['node'] + 1}")
+    assert env["node"][1]["public_ip"] == ""
+    if "iscsi" in env:
+        assert env["iscsi"]["private_ip"] == f"{private}.{libvirt.private_host_numbers['iscsi']}"
+
+
+def test_infrastructure_execute_pipelined(monkeypatch):
+    env = host_env(2)
+    env["common"]["qemu_uri"] = "qemu:///system"
+    for index in [1, 2]:
+        env["node"][index]["public_ip"] = ""
+    monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+    monkeypatch.setattr(utils, "path_deployment_infrastructure", lambda name: "terraform")
+    monkeypatch.setattr(terraform, "init", lambda path: tasks.success())
+
+    dispatched = []
+    provisioning = threading.Event()
+
+    def apply_streamed(path, on_line):
+        on_line("libvirt_volume.node01_main_disk: Creation complete after 1s [id=/var/lib/libvirt/images/node01]")
+        on_line("libvirt_domain.node01_domain: Creation complete after 31s [id=uuid-1]")
+        # a domain seen again is not provisioned twice
+        on_line("libvirt_domain.node01_domain: Creation complete after 31s [id=uuid-1]")
+        # nor one libvirt knows no address of yet
+        on_line("libvirt_domain.node02_domain: Creation complete after 32s [id=uuid-2]")
+        # node01 is provisioned while the rest are still being created
+        assert provisioning.wait(5)
+        assert [ host[2:4] for host in dispatched ] == [("node01", "10.0.0.101")]
+        return tasks.success()
+    monkeypatch.setattr(terraform, "apply_streamed", apply_streamed)
+    monkeypatch.setattr(libvirt, "domain_name", lambda uri, domain: { "uuid-1": "node01", "uuid-2": "node02" }[domain])
+    monkeypatch.setattr(libvirt, "domain_address", lambda uri, domain: { "uuid-1": "10.0.0.101", "uuid-2": "" }[domain])
+
+    def outputs(env):
+        env["node"][1]["public_ip"] = "10.0.0.101"
+        env["node"][2]["public_ip"] = "10.0.0.102"
+        return tasks.success()
+    monkeypatch.setattr(deploy, "infrastructure_outputs", outputs)
+
+    def on_ready(env, hosts, function, skipped):
+        dispatched.extend(hosts)
+        provisioning.set()
+        return [ function(*host) for host in hosts ]
+    monkeypatch.setattr(ready, "on_ready", on_ready)
+
+    results = deploy.infrastructure_execute_pipelined("test", lambda *host: tasks.success(host[2]))
+    assert [ host[2:4] for host in dispatched ] == [("node01", "10.0.0.101"), ("node02", "10.0.0.102")]
+    assert sorted(tasks.get_stdout(res) for res in results) == ["node01", "node02"]
+
+
+def test_infrastructure_execute_pipelined_failure(monkeypatch):
+    env = host_env(1)
+    env["common"]["qemu_uri"] = "qemu:///system"
+    env["node"][1]["public_ip"] = ""
+    monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+    monkeypatch.setattr(utils, "path_deployment_infrastructure", lambda name: "terraform")
+    monkeypatch.setattr(terraform, "init", lambda path: tasks.success())
+    monkeypatch.setattr(terraform, "apply_streamed", lambda path, on_line: tasks.failure("apply failed"))
+    monkeypatch.setattr(ready, "on_ready", lambda env, hosts, function, skipped: pytest.fail("provisioned a machine not created"))
+
+    skipped = []
+    results = deploy.infrastructure_execute_pipelined("test", lambda *host: tasks.success(), lambda *host: skipped.append(host[2]))
+    assert [ tasks.get_stderr(res) for res in results ] == ["apply failed"]
+    assert skipped == ["node01"]
+
+
+def test_upload_payload(monkeypatch, tmp_path):
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(deploy.__file__)))
+    monkeypatch.setattr(utils, "path_deployment_provision", lambda name: str(tmp_path))
+    for key in ["id_rsa", "id_rsa.pub"]:
+        (tmp_path / key).write_text(key)
+
+    payload = deploy.upload_payload({ "name": "test", "provider": "libvirt" }, "192.168.0.1 ssh-ed25519 AAAA\n")
+    with tarfile.open(payload) as tar:
+        names = tar.getnames()
+        assert tar.extractfile("./key/known_hosts").read() == b"192.168.0.1 ssh-ed25519 AAAA\n"
+    assert "./provision.sh" in names
+    assert "./node/pillar_roots/cluster.sls" in names
+    assert "./key/id_rsa" in names and "./key/id_rsa.pub" in names
+    assert not [ name for name in names if name.endswith(".j2") or "__pycache__" in name ]
+
+
+@pytest.fixture
+def relayed(monkeypatch):
+    """
+    Stubs ssh out of relay_host. Returns the hosts every host relayed to, as (from, to)
+    """
+    relays = []
+
+    def setup(env, failing = ()):
+        monkeypatch.setattr(utils, "path_deployment_provision", lambda name: "salt")
+        monkeypatch.setattr(deploy, "upload_task", lambda name, host, username, password, origin, destiny: tasks.success())
+
+        def run(user, password, host, command, timeout = None):
+            if "scp" not in command:
+                return tasks.success()
+            assert "-o StrictHostKeyChecking=yes" in command
+            private_ip = command.split("@")[1].split(":")[0]
+            if private_ip in failing:
+                return tasks.failure("relay failed")
+            relays.append( (host, private_ip) )
+            return tasks.success()
+        monkeypatch.setattr(ssh, "run", run)
+
+        return relays
+
+    return setup
+
+
+def relay_env(count):
+    env = host_env(count)
+    for index in range(1, count + 1):
+        env["node"][index]["private_ip"] = f"192.168.0.{index}"
+    return env
+
+
+def test_relay_authorize_host(monkeypatch, tmp_path):
+    env = relay_env(1)
+    (tmp_path / "id_rsa.pub").write_text("ssh-rsa CLUSTER root@deployer\n")
+    monkeypatch.setattr(utils, "path_deployment_provision", lambda name: str(tmp_path))
+    keys = "ssh-ed25519 AAAA root@node01\nssh-rsa BBBB root@node01\n"
+    commands = []
+    monkeypatch.setattr(ssh, "run", lambda user, password, host, command, timeout = None: commands.append(command) or tasks.success(keys))
+
+    res = deploy.relay_authorize_host(env, "node", 1, "node01", "10.0.0.1", "root", "linux")
+    assert tasks.get_stdout(res) == "192.168.0.1 ssh-ed25519 AAAA\n192.168.0.1 ssh-rsa BBBB\n"
+    assert 'echo "ssh-rsa CLUSTER root@deployer" >> ~/.ssh/authorized_keys' in commands[0]
+
+    monkeypatch.setattr(ssh, "run", lambda user, password, host, command, timeout = None: tasks.success(""))
+    res = deploy.relay_authorize_host(env, "node", 1, "node01", "10.0.0.1", "root", "linux")
+    assert tasks.get_stderr(res) == "No host keys found on [node01=10.0.0.1]"
+
+
+def test_relay_host(relayed):
+    env = relay_env(6)
+    relays = relayed(env)
+
+    results = deploy.relay_host(env, utils.get_hosts_from_env(env), 2, 0)
+    assert len(results) == 6 and all(tasks.has_succeeded(res) for res in results)
+    assert sorted(relays) == [
+        ("10.0.0.1", "192.168.0.2"), ("10.0.0.1", "192.168.0.3"),
+        ("10.0.0.2", "192.168.0.4"), ("10.0.0.2", "192.168.0.5"),
+        ("10.0.0.3", "192.168.0.6"),
+    ]
+
+
+def test_relay_host_failure(relayed):
+    env = relay_env(6)
+    relays = relayed(env, failing = ["192.168.0.2"])
+
+    # the subtree of a host not reached is not reached either
+    results = deploy.relay_host(env, utils.get_hosts_from_env(env), 2, 0)
+    assert [ tasks.get_stderr(res) for res in results if tasks.has_failed(res) ] == ["relay failed"]
+    assert sorted(relays) == [("10.0.0.1", "192.168.0.3"), ("10.0.0.3", "192.168.0.6")]
+
+
+def test_provision_output_phases():
+    stdout = "phase install 0 12\nphase config 0 30\nphase start 1 4\n"
+    phase_lines, sbd_lines = deploy.provision_output(stdout)
+    assert phase_lines == [("install", "0", "12"), ("config", "0", "30"), ("start", "1", "4")]
+    assert sbd_lines == []
+
+
+def test_provision_output_sbd():
+    stdout = "phase iscsi 0 8\nsbd 1.250 3.500 10 20\n"
+    phase_lines, sbd_lines = deploy.provision_output(stdout)
+    assert phase_lines == [("iscsi", "0", "8")]
+    assert sbd_lines == [("1.250", "3.500", "10", "20")]
+
+
+def test_provision_output_ignores_other_lines():
+    stdout = "\n".join([
+        "phase",
+        "phase install 0",
+        "phase install 0 12 extra",
+        "sbd 1.250 3.500 10",
+        "phased install 0 12",
+        "local: salt output",
+        "",
+        "phase config 125 600",
+    ])
+    phase_lines, sbd_lines = deploy.provision_output(stdout)
+    assert phase_lines == [("config", "125", "600")]
+    assert sbd_lines == []
+
+
+def test_provision_output_empty():
+    assert deploy.provision_output("") == ([], [])
+
+
+@pytest.fixture
+def provisioned(monkeypatch):
+    """
+    Stubs ssh out of provision_task, answering every run with the next of the given outputs.
+    Returns the commands run
+    """
+    commands = []
+
+    def setup(*outputs):
+        outputs = list(outputs)
+
+        def run(user, password, host, command, timeout = None):
+            commands.append(command)
+            return outputs.pop(0)
+        monkeypatch.setattr(ssh, "run", run)
+        monkeypatch.setattr(ssh, "copy_from_host", lambda user, password, host, origin, destination: tasks.failure())
+
+        def run_watched(user, password, host, command, idle, interval = 10):
+            commands.append(command)
+            return outputs.pop(0)
+        monkeypatch.setattr(ssh, "run_watched", run_watched)
+
+        return commands
+
+    return setup
+
+
+def test_provision_task(provisioned):
+    commands = provisioned( (0, "phase install 0 12\nlocal: salt output\nphase config 0 30\nphase start 0 4\n", "") )
+
+    res = deploy.provision_task({}, "node01", "10.0.0.1", "root", "linux", ["install", "config", "start"])
+    assert commands == ["sudo sh /tmp/salt/provision.sh -i -c -s -l /var/log/provision.log"]
+    assert res == (0, "node01 install 0 12\nnode01 config 0 30\nnode01 start 0 4", "")
+
+
+def test_provision_task_single_session(provisioned):
+    commands = provisioned( (0, "phase config 0 30\nphase start 0 4\n", "") )
+
+    res = deploy.provision_task({ "single_session": True }, "node01", "10.0.0.1", "root", "linux", ["config", "start"])
+    assert commands == ["sudo sh /tmp/salt/provision.sh -c -s -m -l /var/log/provision.log"]
+    assert tasks.has_succeeded(res)
+
+
+def test_provision_task_failure(provisioned):
+    provisioned( (1, "phase config 1 7\n", "salt failed") )
+
+    res = deploy.provision_task({}, "node01", "10.0.0.1", "root", "linux", ["config", "start"])
+    assert res == (1, "node01 config 1 7", "salt failed")
+
+
+def test_provision_task_sbd_probe(provisioned, caplog):
+    caplog.set_level("INFO")
+    commands = provisioned( (0, "phase config 0 30\nsbd 1.5 3.25 6 12\nphase sbd_probe 0 3\n", "") )
+
+    res = deploy.provision_task({}, "node01", "10.0.0.1", "root", "linux", ["config", "sbd_probe"])
+    assert commands == ["sudo sh /tmp/salt/provision.sh -c -b -l /var/log/provision.log"]
+    assert res == (0, "node01 config 0 30\nnode01 sbd_probe 0 3\nnode01 sbd 1.5 3.25 6 12", "")
+    assert "read 1.5 ms, write 3.25 ms -> watchdog 6s, msgwait 12s -> [node01=10.0.0.1]" in caplog.text
+
+
+def test_provision_task_sbd_timing(provisioned):
+    commands = provisioned( (0, "phase start 0 4\n", ""), (0, "phase config 0 30\n", "") )
+
+    # the measured timeouts are given to the start phase only
+    deploy.provision_task({}, "node01", "10.0.0.1", "root", "linux", ["start"], { "watchdog": 8, "msgwait": 16 })
+    deploy.provision_task({}, "node01", "10.0.0.1", "root", "linux", ["config"], { "watchdog": 8, "msgwait": 16 })
+    assert commands == ["sudo sh /tmp/salt/provision.sh -s -t 8:16 -l /var/log/provision.log", "sudo sh /tmp/salt/provision.sh -c -l /var/log/provision.log"]
+
+
+def test_provision_sbd_timing():
+    results = [
+        tasks.success("node01 config 0 30\nnode01 sbd 1.5 3.25 6 12\nnode01 sbd_probe 0 3"),
+        tasks.success("node02 config 0 30\nnode02 sbd 1.5 900.0 9 18\nnode02 sbd_probe 0 3"),
+        tasks.success("iscsi start 0 10"),
+    ]
+    assert deploy.provision_sbd_timing(results) == { "watchdog": 9, "msgwait": 18 }
+    assert deploy.provision_sbd_timing(results[2:]) == {}
+
+
+def test_provision_task_stall(provisioned):
+    settings = { "stall_timeout": 600, "stall_retries": 1, "stall_backoff": 0 }
+    commands = provisioned(
+        (125, "phase install 0 12\n", "No progress after 600 seconds"),
+        (0, "", ""),
+        (0, "phase config 0 30\nphase start 0 4\n", ""),
+    )
+
+    # only the phases not completed are retried
+    res = deploy.provision_task(settings, "node01", "10.0.0.1", "root", "linux", ["install", "config", "start"])
+    assert commands == [
+        "sudo sh /tmp/salt/provision.sh -i -c -s -l /var/log/provision.log -w",
+        "sudo sh /tmp/salt/provision.sh -k",
+        "sudo sh /tmp/salt/provision.sh -c -s -l /var/log/provision.log -w",
+    ]
+    assert res == (0, "node01 install 0 12\nnode01 config 125 600\nnode01 config 0 30\nnode01 start 0 4", "")
+
+
+def test_provision_task_stall_no_retries_left(provisioned):
+    settings = { "stall_timeout": 600, "stall_retries": 1, "stall_backoff": 0 }
+    commands = provisioned(
+        (125, "", "No progress after 600 seconds"),
+        (0, "", ""),
+        (125, "phase config 0 30\n", "No progress after 600 seconds"),
+        (0, "", ""),
+    )
+
+    res = deploy.provision_task(settings, "node01", "10.0.0.1", "root", "linux", ["config", "start"])
+    assert len(commands) == 4
+    assert commands[2] == "sudo sh /tmp/salt/provision.sh -c -s -l /var/log/provision.log -w"
+    assert commands[3] == "sudo sh /tmp/salt/provision.sh -k"
+    assert res == (125, "node01 config 125 600\nnode01 config 0 30\nnode01 start 125 600", "No progress after 600 seconds")
+
+
+def test_provision_task_failure_not_retried(provisioned):
+    settings = { "stall_timeout": 600, "stall_retries": 3, "stall_backoff": 0 }
+    commands = provisioned( (1, "phase config 1 7\n", "salt failed") )
+
+    res = deploy.provision_task(settings, "node01", "10.0.0.1", "root", "linux", ["config", "start"])
+    assert len(commands) == 1
+    assert res == (1, "node01 config 1 7", "salt failed")
+
+
+def test_provision_report(caplog):
+    caplog.set_level("INFO")
+    deploy.provision_report([ (0, "node01 install 0 12\nnode01 config 0 30", ""), (1, "node02 install 1 3", "") ])
+    assert "node01: install=OK (12s), config=OK (30s)" in caplog.text
+    assert "node02: install=FAILED (3s)" in caplog.text
+
+
+def test_provision_ssh_task(monkeypatch, tmp_path):
+    env = { "name": "test" }
+    monkeypatch.setattr(utils, "path_deployment_saltssh", lambda name: str(tmp_path))
+    monkeypatch.setattr(utils, "path_deployment_provision", lambda name: str(tmp_path))
+    (tmp_path / "node01.grains").write_text("shared_storage_type: shared-disk\nsbd_disk_device: /dev/vdb\n")
+    functions = []
+
+    def run(path, role, target, function):
+        functions.append(function)
+        result = False if function.endswith("saltenv=base") else True
+        return tasks.success(json.dumps({ target: { "state": { "result": result } } }))
+    monkeypatch.setattr(saltssh, "run", run)
+
+    res = deploy.provision_ssh_task(env, "node", "node01", "10.0.0.1", "root", "linux", ["config", "start"])
+    assert tasks.has_failed(res)
+    assert functions == ["state.highstate saltenv=config", "state.highstate saltenv=base"]
+    assert [ line.split()[:3] for line in tasks.get_stdout(res).splitlines() ] == [["node01", "config", "0"], ["node01", "start", "1"]]
+    assert (tmp_path / "node01.log").exists()
+
+
+def test_provision_ssh_task_sbd_device(monkeypatch, tmp_path):
+    env = { "name": "test" }
+    monkeypatch.setattr(utils, "path_deployment_saltssh", lambda name: str(tmp_path))
+    monkeypatch.setattr(utils, "path_deployment_provision", lambda name: str(tmp_path))
+    (tmp_path / "node01.grains").write_text("shared_storage_type: iscsi\nsbd_disk_device: ''\niscsi_multipath: true\nsbd_disk_index: 2\n")
+    lsscsi = ("[2:0:0:0]  disk  LIO-ORG  data  4.0  /dev/sda  36001405aaaa\n"
+              "[2:0:0:1]  disk  LIO-ORG  sbd   4.0  /dev/sdb  36001405bbbb\n"
+              "[3:0:0:0]  disk  QEMU     disk  2.5  /dev/vda  -\n")
+    commands = []
+    monkeypatch.setattr(ssh, "run", lambda user, password, host, command, timeout = None: commands.append(command) or tasks.success(lsscsi))
+    functions = []
+
+    def run(path, role, target, function):
+        functions.append(function)
+        return tasks.success(json.dumps({ target: { "state": { "result": True } } }))
+    monkeypatch.setattr(saltssh, "run", run)
+
+    # the device is looked up on the node, not where pillars are rendered
+    res = deploy.provision_ssh_task(env, "node", "node01", "10.0.0.1", "root", "linux", ["config", "start"])
+    assert tasks.has_succeeded(res)
+    assert commands == ["lsscsi -i"]
+    assert functions[0] == "state.highstate saltenv=config"
+    assert functions[1] == "state.highstate saltenv=base pillar='{\"cluster\": {\"sbd\": {\"device\": \"/dev/mapper/36001405bbbb\"}}}'"
+
+
+def iscsi_target():
+    return { "event": threading.Event(), "exported": None }
+
+
+def test_iscsi_target_task():
+    target = iscsi_target()
+    res = deploy.iscsi_target_task(lambda *args: tasks.success(), target, "iscsi", "10.0.0.5", "root", "linux", ["start"])
+    assert tasks.has_succeeded(res)
+    assert target["event"].is_set()
+    assert target["exported"] is not None
+
+    target = iscsi_target()
+    res = deploy.iscsi_target_task(lambda *args: tasks.failure("failed"), target, "iscsi", "10.0.0.5", "root", "linux", ["start"])
+    assert tasks.has_failed(res)
+    assert target["event"].is_set()
+    assert target["exported"] is None
+
+
+def test_iscsi_target_task_exception():
+    def function(*args):
+        raise RuntimeError("lost")
+
+    target = iscsi_target()
+    with pytest.raises(RuntimeError):
+        deploy.iscsi_target_task(function, target, "iscsi", "10.0.0.5", "root", "linux", ["start"])
+    assert target["event"].is_set()
+    assert target["exported"] is None
+
+
+def test_iscsi_initiator_task():
+    target = iscsi_target()
+    phases = []
+
+    def function(name, host, username, password, run):
+        phases.append( (time.time(), run) )
+        return tasks.success(f"{name} {run[-1]} 0 1")
+
+    def export():
+        time.sleep(0.3)
+        target["exported"] = time.time()
+        target["event"].set()
+    threading.Thread(target=export).start()
+
+    res = deploy.iscsi_initiator_task(function, target, 10, "node01", "10.0.0.1", "root", "linux", ["install", "config"])
+    assert tasks.has_succeeded(res)
+    assert [ run for _, run in phases ] == [["install", "config"], ["iscsi"]]
+    # logged in once exported, not before
+    assert phases[1][0] >= target["exported"]
+    lines = tasks.get_stdout(res).splitlines()
+    assert lines[:2] == ["node01 config 0 1", "node01 iscsi 0 1"]
+    assert lines[2].startswith("node01 iscsi_latency 0 ")
+
+
+def test_iscsi_initiator_task_not_exported():
+    target = iscsi_target()
+    target["event"].set()
+    phases = []
+
+    def function(name, host, username, password, run):
+        phases.append(run)
+        return tasks.success(f"{name} config 0 1")
+
+    start = time.time()
+    res = deploy.iscsi_initiator_task(function, target, 10, "node01", "10.0.0.1", "root", "linux", ["config"])
+    assert time.time() - start < 1
+    assert tasks.has_failed(res)
+    assert tasks.get_stderr(res) == "iSCSI target not exported"
+    assert phases == [["config"]]
+
+
+def test_iscsi_initiator_task_timeout():
+    start = time.time()
+    res = deploy.iscsi_initiator_task(lambda *args: tasks.success(), iscsi_target(), 0.2, "node01", "10.0.0.1", "root", "linux", ["config"])
+    assert tasks.has_failed(res)
+    assert time.time() - start < 1
+
+
+def test_iscsi_initiator_task_sbd_probe():
+    target = iscsi_target()
+    target["exported"] = time.time()
+    target["event"].set()
+    phases = []
+
+    def function(name, host, username, password, run):
+        phases.append(run)
+        return tasks.success(f"{name} {run[-1]} 0 1")
+
+    # the sbd device is only there once logged in
+    res = deploy.iscsi_initiator_task(function, target, 10, "node01", "10.0.0.1", "root", "linux", ["install", "config", "sbd_probe"])
+    assert tasks.has_succeeded(res)
+    assert phases == [["install", "config"], ["iscsi"], ["sbd_probe"]]
+    assert tasks.get_stdout(res).splitlines()[-1] == "node01 sbd_probe 0 1"
+
+
+def test_iscsi_initiator_task_failure():
+    # a node failing its own phases does not wait for the target
+    res = deploy.iscsi_initiator_task(lambda *args: tasks.failure("failed"), iscsi_target(), 10, "node01", "10.0.0.1", "root", "linux", ["config"])
+    assert tasks.get_stderr(res) == "failed"
+
+
+def test_provision_execute_iscsi_upload_failure(monkeypatch):
+    env = host_env(2)
+    env["iscsi"] = { "name": "iscsi", "public_ip": "10.0.0.5", "username": "root", "password": "linux" }
+    env["common"]["shared_storage_type"] = "iscsi"
+    env["provision"] = { "iscsi_timeout": 30 }
+    env["debug"] = { "serialized_join": False }
+    env["timing"] = { "sbd_probe": False }
+    monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+    monkeypatch.setattr(ssh, "use_known_hosts", lambda path: None)
+    monkeypatch.setattr(ssh, "wait_for_ports", lambda hosts, timeout: iter([ (host, True) for host in hosts ]))
+    monkeypatch.setattr(ssh, "scan_host_key", lambda host: tasks.success())
+    monkeypatch.setattr(ssh, "wait_for_login", lambda username, password, host: tasks.success())
+
+    def upload_host(env, role, index, name, host, username, password):
+        return tasks.failure("upload failed") if role == "iscsi" else tasks.success()
+    monkeypatch.setattr(deploy, "upload_host", upload_host)
+    monkeypatch.setattr(deploy, "provision_task", lambda settings, name, host, username, password, phases, sbd_timing = None: tasks.success())
+
+    # nodes waiting for the target are released as soon as the upload to the iscsi server fails
+    start = time.time()
+    res = deploy.provision_execute("test", upload=True)
+    assert tasks.has_failed(res)
+    assert time.time() - start < 5
+
+
+def test_provision_execute_sbd_probe(monkeypatch):
+    env = host_env(3)
+    env["common"]["shared_storage_type"] = "shared-disk"
+    env["provision"] = {}
+    env["debug"] = { "serialized_join": False }
+    env["timing"] = { "sbd_probe": True }
+    monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+    monkeypatch.setattr(ssh, "use_known_hosts", lambda path: None)
+    monkeypatch.setattr(ssh, "wait_for_ports", lambda hosts, timeout: iter([ (host, True) for host in hosts ]))
+    monkeypatch.setattr(ssh, "scan_host_key", lambda host: tasks.success())
+    monkeypatch.setattr(ssh, "wait_for_login", lambda username, password, host: tasks.success())
+    monkeypatch.setattr(deploy, "upload_host", lambda env, role, index, name, host, username, password: tasks.success())
+
+    started = {}
+    watchdogs = { "node01": 6, "node02": 9, "node03": 7 }
+
+    def provision_task(settings, name, host, username, password, phases, sbd_timing = None):
+        if "start" in phases:
+            started[name] = dict(sbd_timing)
+        if "sbd_probe" in phases:
+            return tasks.success(f"{name} sbd 1.0 2.0 {watchdogs[name]} {2 * watchdogs[name]}\n{name} sbd_probe 0 1")
+        return tasks.success()
+    monkeypatch.setattr(deploy, "provision_task", provision_task)
+
+    # every node is given the timeouts of the worst latency measured before the cluster starts
+    assert tasks.has_succeeded(deploy.provision_execute("test", upload=True))
+    assert started == { name: { "watchdog": 9, "msgwait": 18 } for name in ["node01", "node02", "node03"] }
+
+
+def test_provision_timing(monkeypatch):
+    env = host_env(3)
+    env["provider"] = "libvirt"
+    env["timing"] = { "preset": "default", "override": {}, "probe": True }
+    for index in [1, 2, 3]:
+        env["node"][index]["private_ip"] = f"192.168.0.{index}"
+    probed = []
+
+    def latency_probe(username, password, host, targets):
+        probed.append( (host, targets) )
+        return tasks.success(), { "average": 100.0, "maximum": 200.0 }
+    monkeypatch.setattr(deploy.timing, "latency_probe", latency_probe)
+    monkeypatch.setattr(ssh, "use_known_hosts", lambda path: None)
+    monkeypatch.setattr(ssh, "wait_for_login", lambda username, password, host: tasks.success())
+    monkeypatch.setattr(utils, "environment_save", lambda deployment_name, **env: None)
+
+    assert tasks.has_succeeded(deploy.provision_timing(env))
+    assert probed == [("10.0.0.1", ["192.168.0.2", "192.168.0.3"])]
+    profile = env["timing"]["profile"]
+    assert profile["token"] + profile["token_coefficient"] == 200 * deploy.timing.latency_round_trips
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import diag
+import tasks
+import ssh
+import utils
+
+
+def host_env(count):
+    """
+    Returns the environment of a deployment of count nodes, with addresses already given
+    """
+    env = { "name": "test", "common": {}, "node": { "count": count } }
+    for index in range(1, count + 1):
+        env["node"][index] = { "name": f"node{index:0>2}", "public_ip": f"10.0.0.{index}", "username": "root", "password": "linux" }
+    return env
+
+
+@pytest.fixture
+def collected(monkeypatch, tmp_path):
+    """
+    Stubs ssh out of collect, streaming the given bundle of every host. Returns the path of the diag folder
+    """
+    def setup(env, bundles, unreachable = ()):
+        monkeypatch.chdir(os.path.dirname(os.path.abspath(diag.__file__)))
+        monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+        monkeypatch.setattr(utils, "path_deployment_diag", lambda name: str(tmp_path / "diag"))
+        monkeypatch.setattr(ssh, "use_known_hosts", lambda path: None)
+        monkeypatch.setattr(ssh, "is_reachable", lambda host, port = 22, timeout = 5: host not in unreachable)
+
+        def stream_from_host(user, password, host, command, destination, input = "", timeout = None):
+            assert input.startswith("#!/bin/bash")
+            assert command == "sudo bash -s 1048576 30"
+            with open(destination, "wb") as f:
+                f.write(bundles[host])
+            return tasks.success() if bundles[host] else tasks.failure("collect failed")
+        monkeypatch.setattr(ssh, "stream_from_host", stream_from_host)
+
+        return tmp_path / "diag"
+
+    return setup
+
+
+def test_collect_execute(collected):
+    env = host_env(3)
+    env["provider"] = "libvirt"
+    path = collected(env, { "10.0.0.1": b"bundle", "10.0.0.2": b"" }, unreachable = ["10.0.0.3"])
+
+    res = diag.collect_execute("test", { "max_size": 1, "minutes": 30, "timeout": 60 })
+    assert tasks.has_succeeded(res)
+    bundles = list(path.iterdir())
+    assert len(bundles) == 1
+    assert [ entry.name for entry in bundles[0].iterdir() ] == ["node01.tar.gz"]
+    assert (bundles[0] / "node01.tar.gz").read_bytes() == b"bundle"
+
+
+def test_collect_execute_nothing_collected(collected):
+    env = host_env(2)
+    env["provider"] = "libvirt"
+    path = collected(env, { "10.0.0.1": b"" }, unreachable = ["10.0.0.2"])
+
+    res = diag.collect_execute("test", { "max_size": 1, "minutes": 30, "timeout": 60 })
+    assert tasks.get_stderr(res) == "No diagnostic bundle collected"
+    assert list(path.iterdir()) == []
@@ -0,0 +1,86 @@
+import os
+
+import yaml
+
+import timing
+import utils
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def grains(env, name, tmp_path):
+    """
+    Renders the grains of a host as deploy.py does, and returns them
+    """
+    if "timing" in env and "profile" not in env["timing"]:
+        _, env["timing"]["profile"] = timing.compute(env)
+
+    for role, index, host_name, _, _, _ in utils.get_hosts_from_env(env):
+        if host_name == name:
+            utils.template_render(f"{root}/salt", "grains.j2", str(tmp_path), f"{name}.grains", role=role, index=index, env=env, **env)
+            with open(tmp_path / f"{name}.grains") as f:
+                return yaml.safe_load(f)
+    raise KeyError(name)
+
+
+def test_iscsi_default_layout(example_env, tmp_path):
+    env = example_env("libvirt", shared_storage_type = "iscsi")
+
+    iscsi = grains(env, "iscsi", tmp_path)
+    assert iscsi["iscsi_luns"] == [
+        { "device": "/dev/vdb", "lun": 0, "partition": 1, "start": 1, "end": "33%" },
+        { "device": "/dev/vdb", "lun": 1, "partition": 2, "start": "33%", "end": "67%" },
+        { "device": "/dev/vdb", "lun": 2, "partition": 3, "start": "67%", "end": "100%" },
+    ]
+
+    node = grains(env, "node01", tmp_path)
+    assert node["iscsi_enabled"] is True
+    assert node["iscsi_portals"] == [3260]
+    assert node["iscsi_multipath"] is False
+    assert node["sbd_disk_device"] == "/dev/sdb"
+
+
+def test_iscsi_layout(example_env, tmp_path):
+    env = example_env("libvirt", shared_storage_type = "iscsi")
+    env["iscsi"]["storage"].update(backing_disks = 2, luns = 3, lun_sizes = [2, 1, 1], portals = 2)
+
+    iscsi = grains(env, "iscsi", tmp_path)
+    assert iscsi["iscsi_luns"] == [
+        { "device": "/dev/vdb", "lun": 0, "partition": 1, "start": 1, "end": "67%" },
+        { "device": "/dev/vdb", "lun": 2, "partition": 2, "start": "67%", "end": "100%" },
+        { "device": "/dev/vdc", "lun": 1, "partition": 1, "start": 1, "end": "100%" },
+    ]
+
+    node = grains(env, "node01", tmp_path)
+    assert node["iscsi_portals"] == [3260, 3261]
+    assert node["iscsi_multipath"] is True
+    # looked up among the multipath devices
+    assert node["sbd_disk_device"] == ""
+
+
+def test_shared_disk(example_env, tmp_path):
+    node = grains(example_env("libvirt"), "node01", tmp_path)
+    assert node["iscsi_enabled"] is False
+    assert node["sbd_disk_device"] == "/dev/vdb"
+
+
+def test_interconnect(example_env, tmp_path):
+    node = grains(example_env("libvirt"), "node01", tmp_path)
+    assert node["cluster_interface"] == "eth1"
+    assert node["cluster_prefix"] == 24
+    assert "cluster_ring1_interface" not in node
+    assert node["cluster_mtu"] == 1500
+    assert "host_ring1_ip" not in node
+
+    env = example_env("libvirt")
+    env["common"]["network"].update(ring1 = True, mtu = 9000, ring1_ip_range = "192.168.12.0/22")
+    for index in range(1, env["node"]["count"] + 1):
+        env["node"][index]["ring1_ip"] = f"192.168.12.{10 + index}"
+    node = grains(env, "node01", tmp_path)
+    assert node["cluster_interface"] == "eth1"
+    assert node["cluster_ring1_interface"] == "eth2"
+    assert node["cluster_ring1_prefix"] == 22
+    assert node["cluster_mtu"] == 9000
+    assert node["host_ring1_ip"] == "192.168.12.11"
+    assert node["ring1_nodes"] == { env["node"][i]["name"]: f"192.168.12.{10 + i}" for i in range(1, env["node"]["count"] + 1) }
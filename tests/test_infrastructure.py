@@ -0,0 +1,178 @@
+import os
+import xml.etree.ElementTree as ElementTree
+
+import deploy
+import tasks
+import utils
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+XSL = "{http://www.w3.org/1999/XSL/Transform}"
+
+
+def domain_xsl(env, performance, tmp_path):
+    """
+    Renders the transform of a libvirt domain as deploy.py does, and returns its templates by the path they match
+    """
+    utils.template_render(f"{root}/terraform/libvirt", "domain.xsl.j2", str(tmp_path), "domain.xsl", performance = performance, **env)
+    stylesheet = ElementTree.parse(tmp_path / "domain.xsl").getroot()
+    return { template.get("match"): template for template in stylesheet.iter(f"{XSL}template") }
+
+
+def attributes(template):
+    """
+    Returns the attributes a template adds, with the value or expression they take
+    """
+    return { attribute.get("name"): attribute.find(f"{XSL}value-of").get("select") for attribute in template.iter(f"{XSL}attribute") }
+
+
+def test_domain_performance(example_env, tmp_path):
+    env = example_env("libvirt")
+    performance = dict(env["node"][1]["performance"], iothreads = 2, disk_cache = "none", disk_io = "native", disk_queues = 0, cpu_pinning = [2, 3], hugepages = True)
+    templates = domain_xsl(env, performance, tmp_path)
+
+    domain = templates["/domain"].find(f"{XSL}copy")
+    assert domain.find("iothreads").text == "2"
+    assert [ pin.get("cpuset") for pin in domain.find("cputune") ] == ["2", "3"]
+    assert domain.find("memoryBacking/hugepages") is not None
+
+    driver = attributes(templates["/domain/devices/disk/driver"])
+    assert driver["cache"] == "'none'"
+    assert driver["io"] == "'native'"
+    assert driver["queues"] == "/domain/vcpu"
+    assert driver["iothread"] == "count(../preceding-sibling::disk) mod 2 + 1"
+    assert "/domain/devices" not in templates
+
+
+def test_domain_defaults(example_env, tmp_path):
+    # the default profile leaves domains as they were before profiles existed
+    env = example_env("libvirt")
+    templates = domain_xsl(env, env["node"][1]["performance"], tmp_path)
+
+    domain = templates["/domain"].find(f"{XSL}copy")
+    assert domain.find("iothreads") is None
+    assert domain.find("cputune") is None
+    assert domain.find("memoryBacking") is None
+    assert attributes(templates["/domain/devices/disk/driver"]) == {}
+    # private interfaces are single queue, as libvirt creates them
+    assert not any(match.startswith("/domain/devices/interface") for match in templates)
+
+
+def test_domain_scsi(example_env, tmp_path):
+    env = example_env("libvirt")
+    performance = dict(env["node"][1]["performance"], iothreads = 1, disk_bus = "scsi", disk_queues = 4)
+    templates = domain_xsl(env, performance, tmp_path)
+
+    controller = templates["/domain/devices"].find(f"{XSL}copy/controller")
+    assert controller.get("model") == "virtio-scsi"
+    assert attributes(controller) == { "queues": "'4'", "iothread": "'1'" }
+    assert attributes(templates["/domain/devices/disk/target"])["bus"] == "'scsi'"
+    assert "queues" not in attributes(templates["/domain/devices/disk/driver"])
+
+
+def test_domain_tmpfs_pool(example_env, tmp_path):
+    env = example_env("libvirt", tmpfs_pool = True)
+    performance = dict(env["node"][1]["performance"], disk_cache = "none", disk_io = "native")
+
+    driver = attributes(domain_xsl(env, performance, tmp_path)["/domain/devices/disk/driver"])
+    assert driver["cache"] == "'unsafe'"
+    assert "io" not in driver
+
+
+def test_domain_interconnect(example_env, tmp_path):
+    env = example_env("libvirt")
+    env["common"]["network"].update(queues = 2, vhost_pinning = "0-1")
+    templates = domain_xsl(env, env["node"][1]["performance"], tmp_path)
+
+    match = f"/domain/devices/interface[source/@network = '{env['name']}-private' or source/@network = '{env['name']}-ring1']"
+    driver = templates[match].find(f"{XSL}copy/driver")
+    assert driver.get("name") == "vhost"
+    assert attributes(driver) == { "queues": "'2'" }
+    assert templates["/domain"].find(f"{XSL}copy/cputune/emulatorpin").get("cpuset") == "0-1"
+
+    # one queue per vcpu
+    env["common"]["network"].update(queues = 0)
+    driver = domain_xsl(env, env["node"][1]["performance"], tmp_path)[match].find(f"{XSL}copy/driver")
+    assert attributes(driver) == { "queues": "/domain/vcpu" }
+
+
+def infrastructure_render(monkeypatch, tmp_path, env):
+    """
+    Renders the infrastructure files of an environment as deploy.py does. Returns the result and the path they are in
+    """
+    path = tmp_path / "terraform"
+    monkeypatch.chdir(root)
+    monkeypatch.setattr(utils, "deployment_verify", lambda name: (tasks.success(), env))
+    monkeypatch.setattr(utils, "path_deployment_infrastructure", lambda name: str(path))
+    return deploy.infrastructure_render(env["name"]), path
+
+
+def test_azure_placement(example_env, monkeypatch, tmp_path):
+    env = example_env("azure")
+    env["common"].update(proximity_placement_group = True, availability_set = True, accelerated_networking = True)
+
+    res, path = infrastructure_render(monkeypatch, tmp_path, env)
+    assert tasks.has_succeeded(res)
+    main = (path / "main.tf").read_text()
+    assert 'resource "azurerm_proximity_placement_group" "ppg"' in main
+    assert "proximity_placement_group_id = azurerm_proximity_placement_group.ppg.id" in main
+    node = (path / "node01.tf").read_text()
+    assert "availability_set_id              = azurerm_availability_set.avset.id" in node
+    assert "enable_accelerated_networking = true" in node
+    assert "zones" not in node
+
+
+def test_azure_zones(example_env, monkeypatch, tmp_path):
+    env = example_env("azure")
+    env["common"]["zones"] = ["1", "2"]
+
+    res, path = infrastructure_render(monkeypatch, tmp_path, env)
+    assert tasks.has_succeeded(res)
+    assert [ line.split("=")[1].strip() for number in [1, 2, 3] for line in (path / f"node0{number}.tf").read_text().splitlines() if line.strip().startswith("zones") ] == ['["1"]', '["2"]', '["1"]']
+
+
+def test_azure_placement_conflicts(example_env, monkeypatch, tmp_path):
+    env = example_env("azure")
+    env["common"].update(availability_set = True, zones = ["1"])
+    res, path = infrastructure_render(monkeypatch, tmp_path, env)
+    assert tasks.get_stderr(res) == "An availability set cannot be used along with zones"
+    assert not path.exists()
+
+    env["common"].update(availability_set = False, proximity_placement_group = True, zones = ["1", "2"])
+    res, path = infrastructure_render(monkeypatch, tmp_path, env)
+    assert tasks.get_stderr(res) == "Machines in a proximity placement group cannot be spread across zones"
+
+
+def test_for_each_render(example_env, monkeypatch, tmp_path):
+    for provider in ["libvirt", "azure"]:
+        env = example_env(provider)
+        env["common"]["terraform_render"] = "for_each"
+
+        (tmp_path / provider).mkdir()
+        res, path = infrastructure_render(monkeypatch, tmp_path / provider, env)
+        assert tasks.has_succeeded(res)
+        assert not (path / "node01.tf").exists()
+        nodes = (path / "nodes.tf").read_text()
+        assert "for_each" in nodes
+        assert 'output "node"' in nodes
+        for index in range(1, int(env["node"]["count"]) + 1):
+            assert f'"{index:0>2}"' in nodes
+
+
+def test_container_render(example_env, monkeypatch, tmp_path):
+    env = example_env("container")
+
+    res, path = infrastructure_render(monkeypatch, tmp_path, env)
+    assert tasks.has_succeeded(res)
+    assert (path / "Dockerfile").exists()
+    assert not (path / "iscsi.tf").exists()
+
+
+def test_container_shared_storage(example_env, monkeypatch, tmp_path):
+    env = example_env("container")
+    env["common"]["shared_storage_type"] = "shared-disk"
+
+    res, path = infrastructure_render(monkeypatch, tmp_path, env)
+    assert tasks.get_stderr(res) == "Containers cannot share storage, shared_storage_type must be none"
+    assert not path.exists()
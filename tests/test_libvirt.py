@@ -0,0 +1,132 @@
+import xml.etree.ElementTree as ET
+
+import libvirt
+import tasks
+
+
+def virsh(monkeypatch, outputs):
+    """
+    Answers every virsh command with the output given for its subcommand and options
+    """
+    commands = []
+
+    def run(command, timeout = None):
+        commands.append(command)
+        for key, output in outputs.items():
+            if f" {key}" in command:
+                return output
+        return tasks.failure("unknown command")
+    monkeypatch.setattr(tasks, "run", run)
+
+    return commands
+
+
+iflist = """ Interface   Type      Source         Model    MAC
+-----------------------------------------------------------------------
+ vnet0       network   test-public    virtio   52:54:00:aa:00:01
+ vnet1       network   test-private   virtio   52:54:00:aa:00:02
+"""
+
+def ifaddr(*entries):
+    return tasks.success(" Name       MAC address          Protocol     Address\n-------------------------------------------------------------------------------\n" +
+                         "".join(f" {name}      {mac}    {protocol}         {address}\n" for name, mac, protocol, address in entries))
+
+
+def test_domain_address(monkeypatch):
+    virsh(monkeypatch, {
+        "domiflist": tasks.success(iflist),
+        "domifaddr test-node01 --source lease": ifaddr(("vnet1", "52:54:00:aa:00:02", "ipv4", "192.168.0.11/24"), ("vnet0", "52:54:00:aa:00:01", "ipv4", "10.0.0.11/24")),
+    })
+    assert libvirt.domain_address("qemu:///system", "test-node01") == "10.0.0.11"
+
+
+def test_domain_address_agent(monkeypatch):
+    # bridged interfaces get no lease from libvirt
+    commands = virsh(monkeypatch, {
+        "domiflist": tasks.success(iflist),
+        "--source lease": ifaddr(),
+        "--source agent": ifaddr(("eth0", "52:54:00:aa:00:01", "ipv6", "fe80::1/64"), ("eth0", "52:54:00:aa:00:01", "ipv4", "10.0.0.11/24")),
+    })
+    assert libvirt.domain_address("qemu:///system", "test-node01") == "10.0.0.11"
+    assert commands[-1] == "virsh -c qemu:///system domifaddr test-node01 --source agent"
+
+
+def test_domain_address_unknown(monkeypatch):
+    virsh(monkeypatch, { "domiflist": tasks.success(iflist), "domifaddr": ifaddr() })
+    assert libvirt.domain_address("qemu:///system", "test-node01") == ""
+
+    virsh(monkeypatch, { "domiflist": tasks.failure("error: failed to get domain 'test-node01'") })
+    assert libvirt.domain_address("qemu:///system", "test-node01") == ""
+
+
+def test_domain_disks(monkeypatch):
+    dumpxml = """<domain type='kvm'>
+  <name>test-node01</name>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='/var/lib/libvirt/images/test-node01-main-disk'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='raw'/>
+      <source file='/var/lib/libvirt/images/test-sbd.raw'/>
+      <target dev='vdb' bus='virtio'/>
+      <shareable/>
+    </disk>
+    <disk type='file' device='cdrom'>
+      <source file='/var/lib/libvirt/images/cloudinit.iso'/>
+      <target dev='hdd' bus='ide'/>
+    </disk>
+  </devices>
+</domain>"""
+    commands = []
+    monkeypatch.setattr(tasks, "run", lambda command, timeout = None: commands.append(command) or tasks.success(dumpxml))
+
+    assert libvirt.domain_disks("qemu:///system", "test-node01") == [
+        { "target": "vda", "source": "/var/lib/libvirt/images/test-node01-main-disk", "format": "qcow2", "shareable": False },
+        { "target": "vdb", "source": "/var/lib/libvirt/images/test-sbd.raw", "format": "raw", "shareable": True },
+    ]
+    assert commands == ["virsh -c qemu:///system dumpxml test-node01"]
+
+    monkeypatch.setattr(tasks, "run", lambda command, timeout = None: tasks.failure("error: failed to get domain"))
+    assert libvirt.domain_disks("qemu:///system", "test-node01") == []
+
+
+def test_snapshot_create(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(tasks, "run", lambda command, timeout = None: commands.append(command) or tasks.success())
+    path = tmp_path / "snapshot.xml"
+
+    libvirt.snapshot_create("qemu:///system", "test-node01", "clean", str(path), excluded = ["vdb"])
+    snapshot = ET.parse(path).getroot()
+    assert snapshot.find("name").text == "clean"
+    assert [ (disk.get("name"), disk.get("snapshot")) for disk in snapshot.iter("disk") ] == [("vdb", "no")]
+    assert commands == [f"virsh -c qemu:///system snapshot-create test-node01 --xmlfile {path}"]
+
+
+def test_volume_upload_region(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(tasks, "run", lambda command, timeout = None: commands.append(command) or tasks.success())
+    path = tmp_path / "sbd"
+    path.write_bytes(b"\0" * 1024)
+
+    libvirt.volume_upload_region("qemu:///system", "/var/lib/libvirt/images/test-sbd.raw", str(path))
+    assert commands == [f"virsh -c qemu:///system vol-upload /var/lib/libvirt/images/test-sbd.raw {path} --offset 0 --length 1024"]
+
+
+def test_volume_complete(monkeypatch):
+    commands = virsh(monkeypatch, { "vol-download": tasks.success() })
+    assert libvirt.volume_complete("qemu:///system", "default", "base-1234")
+    assert commands == ["virsh -c qemu:///system vol-download --pool default base-1234 /dev/null --offset 0 --length 1"]
+
+    # a volume still being created cannot be read
+    virsh(monkeypatch, { "vol-download": tasks.failure("error: volume 'base-1234' is still being allocated.") })
+    assert not libvirt.volume_complete("qemu:///system", "default", "base-1234")
+
+
+def test_volume_create_collided():
+    assert libvirt.volume_create_collided(tasks.failure("error: storage volume 'base' exists already"))
+    assert libvirt.volume_create_collided(tasks.failure("error: operation failed: storage vol 'base' already exists"))
+    assert not libvirt.volume_create_collided(tasks.failure("error: pool 'default' not found"))
+    assert not libvirt.volume_create_collided(tasks.success())
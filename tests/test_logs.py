@@ -0,0 +1,109 @@
+import io
+import json
+import logging
+import threading
+
+import pytest
+
+import logs
+import utils
+
+
+@pytest.fixture
+def logged(monkeypatch, tmp_path):
+    """
+    Sets the queued logging up for a deployment in a temporary directory, restoring the root logger afterwards.
+    Returns the stream of the console and the path of the log directory
+    """
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    monkeypatch.setattr(logs, "listener", None)
+    monkeypatch.setattr(logs, "hosts_handler", None)
+    monkeypatch.setattr(utils, "path_deployment_logs", lambda name: str(tmp_path / name / "logs"))
+
+    def setup(json_lines = False, deployed = True):
+        stream = io.StringIO()
+        logs.setup([logging.StreamHandler(stream)], logging.DEBUG, "%(levelname)s %(message)s", None)
+        if deployed:
+            (tmp_path / "test").mkdir()
+        logs.deployment("test", json_lines)
+        return stream, tmp_path / "test" / "logs"
+
+    yield setup
+
+    logs.shutdown()
+    root.handlers, root.level = handlers, level
+
+
+def test_host_files(logged):
+    stream, path = logged()
+
+    logging.info("creating")
+    with logs.host("node01"):
+        logging.info("provisioning")
+    thread = threading.Thread(target = logs.hosted("node02", lambda: logging.warning("late")))
+    thread.start()
+    thread.join()
+    logs.shutdown()
+
+    assert stream.getvalue() == "INFO creating\nINFO provisioning\nWARNING late\n"
+    assert (path / "node01.log").read_text() == "INFO provisioning\n"
+    assert (path / "node02.log").read_text() == "WARNING late\n"
+    assert sorted(entry.name for entry in path.iterdir()) == ["node01.log", "node02.log"]
+
+
+def test_host_files_json(logged):
+    _, path = logged(json_lines = True)
+
+    with logs.host("node01"):
+        logging.info("provisioning")
+    logs.shutdown()
+
+    entry = json.loads((path / "node01.log").read_text())
+    assert (entry["level"], entry["host"], entry["message"]) == ("INFO", "node01", "provisioning")
+
+
+def test_host_files_without_deployment(logged):
+    stream, path = logged(deployed = False)
+
+    with logs.host("node01"):
+        logging.info("provisioning")
+        logs.payload("terraform.log", "output")
+    logs.shutdown()
+
+    assert stream.getvalue() == "INFO provisioning\nDEBUG output\n"
+    assert not path.exists()
+
+
+def test_payload(logged):
+    stream, path = logged()
+
+    logs.payload("terraform.log", "first\n")
+    logs.payload("terraform.log", "second\n")
+    logs.shutdown()
+
+    assert (path / "terraform.log").read_text() == "first\nsecond\n"
+    assert stream.getvalue() == f"DEBUG terraform.log written to {path}/terraform.log\n" * 2
+
+
+def test_payload_lines(logged):
+    stream, path = logged()
+
+    write = logs.payload_lines("terraform.log")
+    write("first")
+    # lines are there as soon as they are written
+    assert (path / "terraform.log").read_text() == "first\n"
+    write("second")
+    logs.shutdown()
+
+    assert (path / "terraform.log").read_text() == "first\nsecond\n"
+    assert stream.getvalue() == f"DEBUG terraform.log streamed to {path}/terraform.log\n"
+
+
+def test_payload_lines_without_deployment(logged):
+    stream, path = logged(deployed = False)
+
+    logs.payload_lines("terraform.log")("first")
+    logs.shutdown()
+
+    assert stream.getvalue() == "DEBUG first\n"
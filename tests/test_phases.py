@@ -0,0 +1,83 @@
+import os
+import sys
+import types
+import importlib.util
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def phases(monkeypatch, returns):
+    """
+    Loads salt/phases.py on a stub of salt, whose highstates return the given results in turn.
+    Returns the module and the callers created, with the functions every one ran, refreshes included
+    """
+    callers = []
+
+    class Caller:
+        def __init__(self, mopts):
+            self.opts = mopts
+            self.functions = []
+            self.sminion = types.SimpleNamespace(opts = mopts, gen_modules = lambda: self.functions.append( ("gen_modules", {}) ))
+            callers.append(self)
+
+        def cmd(self, function, **kwargs):
+            self.functions.append( (function, kwargs) )
+            return returns.pop(0) if function == "state.highstate" else True
+
+    def grains(opts, force_refresh = False):
+        callers[-1].functions.append( ("grains", { "force_refresh": force_refresh }) )
+        return { "id": opts["id"] }
+
+    salt = types.ModuleType("salt")
+    salt.config = types.SimpleNamespace(minion_config = lambda path: { "id": "node01" })
+    salt.client = types.SimpleNamespace(Caller = Caller)
+    salt.loader = types.SimpleNamespace(grains = grains)
+    salt.output = types.SimpleNamespace(display_output = lambda data, out, opts: None)
+    for name, module in [("salt", salt), ("salt.config", salt.config), ("salt.client", salt.client), ("salt.loader", salt.loader), ("salt.output", salt.output)]:
+        monkeypatch.setitem(sys.modules, name, module)
+
+    spec = importlib.util.spec_from_file_location("phases", f"{root}/salt/phases.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module, callers
+
+
+def test_has_succeeded(monkeypatch):
+    module, _ = phases(monkeypatch, [])
+    assert module.has_succeeded({ "a": { "result": True }, "b": { "result": None } })
+    assert not module.has_succeeded({ "a": { "result": True }, "b": { "result": False } })
+    assert not module.has_succeeded(["Rendering SLS 'base:cluster' failed"])
+
+
+def test_phases(monkeypatch, tmp_path):
+    module, callers = phases(monkeypatch, [ { "a": { "result": True } }, { "b": { "result": True } } ])
+    results = tmp_path / "results"
+
+    assert module.main(str(results), ["config:config", "start:base"]) == 0
+    assert [ line.split()[:3] for line in results.read_text().splitlines() ] == [["phase", "config", "0"], ["phase", "start", "0"]]
+    # a single caller, refreshed so every phase sees the grains, pillar and modules of the former ones
+    assert len(callers) == 1
+    assert callers[0].opts["file_client"] == "local"
+    assert callers[0].functions == [
+        ("state.highstate", { "saltenv": "config" }),
+        ("grains", { "force_refresh": True }), ("gen_modules", {}),
+        ("state.highstate", { "saltenv": "base" }),
+    ]
+
+
+def test_phases_pillar(monkeypatch, tmp_path):
+    module, callers = phases(monkeypatch, [ { "a": { "result": True } } ])
+    pillar = { "cluster": { "sbd": { "watchdog_timeout": 8, "msgwait": 16 } } }
+
+    assert module.main(str(tmp_path / "results"), ["start:base"], pillar) == 0
+    assert callers[0].functions[-1] == ("state.highstate", { "saltenv": "base", "pillar": pillar })
+
+
+def test_phases_failure(monkeypatch, tmp_path):
+    module, callers = phases(monkeypatch, [ ["Rendering SLS 'config:cluster' failed"] ])
+    results = tmp_path / "results"
+
+    assert module.main(str(results), ["config:config", "start:base"]) == 1
+    assert [ line.split()[:3] for line in results.read_text().splitlines() ] == [["phase", "config", "1"]]
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+import ready
+import tasks
+import ssh
+import utils
+
+
+def host_env(count):
+    """
+    Returns the environment of a deployment of count nodes, with addresses already given
+    """
+    env = { "name": "test", "common": {}, "node": { "count": count } }
+    for index in range(1, count + 1):
+        env["node"][index] = { "name": f"node{index:0>2}", "public_ip": f"10.0.0.{index}", "username": "root", "password": "linux" }
+    return env
+
+
+def test_on_ready(monkeypatch):
+    env = host_env(3)
+    hosts = utils.get_hosts_from_env(env)
+    started = {}
+
+    # node02 gets ready long after node01, and node03 never does
+    def wait_for_ports(hosts, timeout):
+        yield ("10.0.0.1", True)
+        time.sleep(0.5)
+        yield ("10.0.0.2", True)
+        yield ("10.0.0.3", False)
+    monkeypatch.setattr(ssh, "wait_for_ports", wait_for_ports)
+    monkeypatch.setattr(ssh, "scan_host_key", lambda host: tasks.success())
+    monkeypatch.setattr(ssh, "wait_for_login", lambda username, password, host: tasks.success())
+
+    def function(role, index, name, host, username, password):
+        started[name] = time.time()
+        return tasks.success(name)
+
+    start = time.time()
+    results = ready.on_ready(env, hosts, function)
+    assert sorted(tasks.get_stdout(res) for res in results if tasks.has_succeeded(res)) == ["node01", "node02"]
+    assert len([ res for res in results if tasks.has_failed(res) ]) == 1
+    assert started["node01"] - start < 0.4
+    assert started["node02"] - start >= 0.5
+
+
+def test_on_ready_login_failure(monkeypatch):
+    env = host_env(1)
+    monkeypatch.setattr(ssh, "wait_for_ports", lambda hosts, timeout: iter([("10.0.0.1", True)]))
+    monkeypatch.setattr(ssh, "scan_host_key", lambda host: tasks.success())
+    monkeypatch.setattr(ssh, "wait_for_login", lambda username, password, host: tasks.failure("Permission denied"))
+
+    skipped = []
+    results = ready.on_ready(env, utils.get_hosts_from_env(env), lambda *host: pytest.fail("ran on a host not logged in"), lambda *host: skipped.append(host[2]))
+    assert [ tasks.get_stderr(res) for res in results ] == ["Permission denied"]
+    assert skipped == ["node01"]
+
+
+def test_on_ready_skipped(monkeypatch):
+    env = host_env(2)
+    monkeypatch.setattr(ssh, "wait_for_ports", lambda hosts, timeout: iter([("10.0.0.1", True), ("10.0.0.2", False)]))
+    monkeypatch.setattr(ssh, "scan_host_key", lambda host: tasks.success())
+    monkeypatch.setattr(ssh, "wait_for_login", lambda username, password, host: tasks.success())
+
+    skipped = []
+    results = ready.on_ready(env, utils.get_hosts_from_env(env), lambda *host: tasks.success(), lambda *host: skipped.append(host[2]))
+    assert len([ res for res in results if tasks.has_failed(res) ]) == 1
+    assert skipped == ["node02"]
@@ -0,0 +1,116 @@
+import pytest
+
+import replace
+import tasks
+import terraform
+import ssh
+import utils
+
+
+def relay_env(count):
+    """
+    Returns the environment of a deployment of count nodes, with public and private addresses already given
+    """
+    env = { "name": "test", "common": {}, "node": { "count": count } }
+    for index in range(1, count + 1):
+        env["node"][index] = { "name": f"node{index:0>2}", "public_ip": f"10.0.0.{index}", "private_ip": f"192.168.0.{index}", "username": "root", "password": "linux" }
+    return env
+
+
+def test_node_resource_pattern_files():
+    pattern = replace.node_resource_pattern(2)
+    for address in ["libvirt_domain.node02", "libvirt_domain.node02_domain", "libvirt_volume.node02_main_disk", "docker_container.node02", "azurerm_network_interface.node02_nic"]:
+        assert pattern.match(address), address
+
+
+def test_node_resource_pattern_for_each():
+    pattern = replace.node_resource_pattern(2)
+    for address in ['libvirt_domain.node["02"]', 'libvirt_domain.node_domain["02"]', 'libvirt_volume.node_main_disk["02"]']:
+        assert pattern.match(address), address
+
+
+def test_node_resource_pattern_other_nodes():
+    pattern = replace.node_resource_pattern(2)
+    for address in [
+        "libvirt_domain.node12_domain",
+        "libvirt_domain.node20",
+        "libvirt_domain.node002",
+        'libvirt_domain.node_domain["12"]',
+        'libvirt_domain.node_domain["2"]',
+        "libvirt_domain.iscsi_domain",
+        "libvirt_volume.sbd",
+        "module.nodes.libvirt_domain.node02_domain",
+        'libvirt_domain.node_domain["02"].extra',
+    ]:
+        assert not pattern.match(address), address
+
+
+def test_node_resource_pattern_numbers():
+    assert replace.node_resource_pattern(12).match("libvirt_domain.node12_domain")
+    assert replace.node_resource_pattern(12).match('libvirt_domain.node_domain["12"]')
+    assert not replace.node_resource_pattern(1).match("libvirt_domain.node12_domain")
+    assert replace.node_resource_pattern("3").match("docker_container.node03")
+
+
+@pytest.fixture
+def replaced(monkeypatch):
+    """
+    Stubs terraform out of replace_node_resources, listing the given state. Returns the tainted and applied addresses
+    """
+    calls = { "tainted": [], "applied": [] }
+
+    def setup(addresses):
+        monkeypatch.setattr(utils, "path_deployment_infrastructure", lambda name: "terraform")
+        monkeypatch.setattr(terraform, "state_list", lambda path: tasks.success("\n".join(addresses) + "\n"))
+        monkeypatch.setattr(terraform, "taint", lambda path, address: calls["tainted"].append(address) or tasks.success())
+        monkeypatch.setattr(terraform, "apply_targets", lambda path, addresses: calls["applied"].extend(addresses) or tasks.success())
+        return calls
+
+    return setup
+
+
+def test_replace_node_resources(replaced):
+    calls = replaced([
+        "libvirt_domain.iscsi_domain",
+        "libvirt_domain.node02_domain",
+        "libvirt_domain.node12_domain",
+        "libvirt_volume.node02_main_disk",
+        "libvirt_volume.sbd",
+    ])
+
+    assert tasks.has_succeeded(replace.replace_node_resources({ "name": "test" }, 2))
+    assert calls["tainted"] == ["libvirt_domain.node02_domain", "libvirt_volume.node02_main_disk"]
+    assert calls["applied"] == calls["tainted"]
+
+
+def test_replace_node_resources_for_each(replaced):
+    calls = replaced([
+        'libvirt_domain.node_domain["02"]',
+        'libvirt_domain.node_domain["12"]',
+        'libvirt_volume.node_main_disk["02"]',
+        'docker_container.node["02"]',
+    ])
+
+    assert tasks.has_succeeded(replace.replace_node_resources({ "name": "test" }, 2))
+    assert calls["applied"] == ['libvirt_domain.node_domain["02"]', 'libvirt_volume.node_main_disk["02"]', 'docker_container.node["02"]']
+
+
+def test_replace_node_resources_missing(replaced):
+    calls = replaced(["libvirt_domain.node01_domain"])
+
+    res = replace.replace_node_resources({ "name": "test" }, 2)
+    assert tasks.get_stderr(res) == "No resources of node 02 in Terraform state"
+    assert calls["tainted"] == []
+
+
+def test_replace_node_remove(monkeypatch):
+    env = relay_env(3)
+    commands = []
+    monkeypatch.setattr(ssh, "is_reachable", lambda host, port = 22, timeout = 5: host != "10.0.0.1")
+    monkeypatch.setattr(ssh, "run", lambda user, password, host, command, timeout = None: commands.append( (host, command) ) or tasks.success())
+
+    survivors = [ host for host in utils.get_hosts_from_env(env) if host[1] != 3 ]
+    assert replace.replace_node_remove(env, 3, survivors) == "node02"
+    assert commands[0] == ("10.0.0.2", "sudo crm cluster remove -y -c node03")
+    assert [ host for host, command in commands[1:] ] == ["10.0.0.2"]
+    assert "ssh-keygen -R 192.168.0.3" in commands[1][1]
@@ -0,0 +1,183 @@
+import os
+import json
+import importlib.util
+import warnings
+
+import jinja2
+import pytest
+import yaml
+
+import timing
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def render_sls(path, grains, salt = None, pillar = None):
+    """
+    Renders a salt state or pillar file with jinja, as salt does, with the given grains, execution functions and
+    pillar. Returns the data it declares
+    """
+    with open(f"{root}/salt/{path}", "r") as f:
+        # the escaped $ of the awk programs in shell commands are taken for python escapes by jinja
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            template = jinja2.Template(f.read())
+    return yaml.safe_load(template.render(grains = grains, salt = salt or {}, pillar = pillar or {}))
+
+
+def test_ip_workaround():
+    states = render_sls("common/ip_workaround.sls", { "host_ip": "192.168.0.1" })
+    assert states["enable_eth1"]["cmd.run"][0]["name"] == "/sbin/ip a add 192.168.0.1/24 dev eth1 & /sbin/ip link set eth1 mtu 1500 up"
+    assert "MTU" not in states["/etc/sysconfig/network/ifcfg-eth1"]["file.managed"][0]["contents"]
+    assert "enable_eth2" not in states
+
+
+def test_ip_workaround_ring1():
+    grains = { "host_ip": "192.168.0.1", "host_ring1_ip": "172.16.1.1", "cluster_mtu": 9000,
+               "cluster_interface": "eth1", "cluster_prefix": 25, "cluster_ring1_interface": "eth2", "cluster_ring1_prefix": 16 }
+    states = render_sls("common/ip_workaround.sls", grains)
+    for interface, address in [("eth1", "192.168.0.1/25"), ("eth2", "172.16.1.1/16")]:
+        assert states[f"enable_{interface}"]["cmd.run"][0]["name"] == f"/sbin/ip a add {address} dev {interface} & /sbin/ip link set {interface} mtu 9000 up"
+        contents = states[f"/etc/sysconfig/network/ifcfg-{interface}"]["file.managed"][0]["contents"].splitlines()
+        assert f"IPADDR={address}" in contents
+        assert "MTU=9000" in contents
+
+
+def cluster_grains(**grains):
+    _, profile = timing.compute({ "provider": grains.get("provider", "libvirt"), "node": { "count": 2 } })
+    return dict({ "cluster_name": "hacluster", "init_node": "node01", "provider": "libvirt", "sbd_disk_device": "/dev/vdb", "sbd_disk_index": 1, "timing": profile }, **grains)
+
+
+def test_cluster_interfaces():
+    assert render_sls("node/pillar_roots/cluster.sls", cluster_grains())["cluster"]["interface"] == "eth1"
+    # the ring1 link is added after the cluster is formed, crmsh only gets the first interface
+    pillar = render_sls("node/pillar_roots/cluster.sls", cluster_grains(cluster_interface = "eth1", cluster_ring1_interface = "eth2"))
+    assert pillar["cluster"]["interface"] == "eth1"
+
+    pillar = render_sls("node/pillar_roots/cluster.sls", cluster_grains(provider = "azure"))
+    assert pillar["cluster"]["interface"] == "eth0"
+    assert pillar["cluster"]["unicast"] is True
+
+
+def test_ring1():
+    grains = cluster_grains(host = "node01", nodes = { "node01": "192.168.10.10", "node02": "192.168.10.11" },
+                            ring1_nodes = { "node01": "192.168.11.10", "node02": "192.168.11.11" })
+    states = render_sls("node/file_roots/on_start/ring1.sls", grains)
+    assert "2" in states["ring1_members"]["cmd.run"][0]["name"]
+    replace = states["ring1_node02"]["file.replace"]
+    assert replace[1]["pattern"] == r"^(\s*)ring0_addr: 192.168.10.11$"
+    assert replace[2]["repl"] == r"\g<0>\n\g<1>ring1_addr: 192.168.11.11"
+    assert states["ring1_reload"]["cmd.run"][1]["onchanges"] == [{ "file": "ring1_node01" }, { "file": "ring1_node02" }]
+
+    # the rest of the nodes get it from the init node
+    assert render_sls("node/file_roots/on_start/ring1.sls", dict(grains, host = "node02")) is None
+
+
+def test_cluster_totem():
+    grains = cluster_grains(provider = "azure")
+    totem = render_sls("node/pillar_roots/cluster.sls", grains)["cluster"]["corosync"]["totem"]
+    assert totem == { key: grains["timing"][key] for key in ["token", "token_coefficient", "token_retransmits_before_loss_const", "join", "consensus", "max_messages"] }
+    assert totem["token"] == 30000
+
+
+def test_timing_profiles():
+    grains = cluster_grains()
+    contents = render_sls("node/file_roots/on_start/timing.sls", grains)["/etc/crm/profiles.yml"]["file.managed"][1]["contents"]
+    profiles = yaml.safe_load(contents)
+    assert sorted(profiles) == ["amazon-web-services", "default", "google-cloud-platform", "microsoft-azure"]
+    assert profiles["default"]["corosync.totem.token"] == grains["timing"]["token"]
+    assert profiles["default"]["corosync.totem.token_coefficient"] == grains["timing"]["token_coefficient"]
+    assert profiles["default"]["sbd.msgwait"] == grains["timing"]["sbd_msgwait"]
+
+
+def test_sbd_timing():
+    grains = cluster_grains()
+    pillar = render_sls("node/pillar_roots/cluster.sls", grains)
+    assert "watchdog_timeout" not in pillar["cluster"]["sbd"]
+
+    # measured timeouts are given as pillar by provision.sh
+    pillar = { "cluster": { "sbd": { "device": "/dev/vdb", "watchdog_timeout": 7, "msgwait": 14 } } }
+    contents = render_sls("node/file_roots/on_start/timing.sls", grains, pillar = pillar)["/etc/crm/profiles.yml"]["file.managed"][1]["contents"]
+    for profile in yaml.safe_load(contents).values():
+        assert profile["sbd.watchdog_timeout"] == 7
+        assert profile["sbd.msgwait"] == 14
+
+
+def sbd_latency(monkeypatch, reads, writes, size):
+    """
+    Loads salt/sbd_latency.py with the device io stubbed out, measuring the given latencies in milliseconds
+    """
+    spec = importlib.util.spec_from_file_location("sbd_latency", f"{root}/salt/sbd_latency.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    monkeypatch.setattr(module.os, "open", lambda device, flags: 42)
+    monkeypatch.setattr(module.os, "lseek", lambda fd, offset, whence: size)
+    monkeypatch.setattr(module.os, "close", lambda fd: None)
+    monkeypatch.setattr(module, "measure", lambda fd, region, count, write: list(writes if write else reads))
+    return module
+
+
+def test_sbd_latency(monkeypatch, tmp_path, capsys):
+    module = sbd_latency(monkeypatch, [ 1.0 ] * 98 + [ 800.0 ] * 2, [ 2.0 ] * 49 + [ 1500.0 ], 64 * 1024 * 1024)
+
+    assert module.main(str(tmp_path / "results"), "/dev/sdb", 5, { "consensus": 3600 }) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result["read_p99"] == 800.0
+    assert result["write_p99"] == 1500.0
+    # 1.5 s times the margin of 5
+    assert (result["watchdog"], result["msgwait"]) == (8, 16)
+    assert (tmp_path / "results").read_text() == "sbd 800.0 1500.0 8 16\n"
+
+
+def test_sbd_latency_minimums(monkeypatch, tmp_path, capsys):
+    # a small device has no room for the write region, only reads are measured
+    module = sbd_latency(monkeypatch, [ 1.0 ] * 100, [ 5000.0 ], 4 * 1024 * 1024)
+    module.main(str(tmp_path / "results"), "/dev/sdb", 5, { "consensus": 3600 })
+    result = json.loads(capsys.readouterr().out)
+    assert result["write_p50"] is None
+    assert (result["watchdog"], result["msgwait"]) == (5, 10)
+
+    # never before corosync consensus
+    module.main(str(tmp_path / "results"), "/dev/sdb", 5, { "consensus": 7200 })
+    assert json.loads(capsys.readouterr().out)["watchdog"] == 9
+
+
+def test_cluster_without_shared_storage():
+    pillar = render_sls("node/pillar_roots/cluster.sls", cluster_grains(provider = "container", shared_storage_type = "none", sbd_disk_device = ""))
+    assert "sbd" not in pillar["cluster"]
+    assert "watchdog" not in pillar["cluster"]
+    assert "ntp" not in pillar["cluster"]
+    assert pillar["cluster"]["sshkeys"] == { "password": "linux" }
+
+
+def test_ssh_fencing():
+    grains = { "host": "node01", "init_node": "node01", "nodes": ["node01", "node02"] }
+    states = render_sls("node/file_roots/on_start/fencing.sls", grains)
+    assert 'hostlist="node01 node02"' in states["ssh_fencing"]["cmd.run"][0]["name"]
+
+    assert render_sls("node/file_roots/on_start/fencing.sls", dict(grains, host = "node02")) is None
+
+
+def test_totem_untuned():
+    grains = cluster_grains(timing_totem = False)
+    cluster = render_sls("node/pillar_roots/cluster.sls", grains)["cluster"]
+    assert "totem" not in cluster.get("corosync", {})
+    assert cluster["join_timeout"] == grains["timing"]["join_timeout"]
+
+    # crmsh keeps its profiles unless measured sbd timings must reach them
+    assert render_sls("node/file_roots/on_start/timing.sls", grains) is None
+
+    pillar = { "cluster": { "sbd": { "device": "/dev/vdb", "watchdog_timeout": 7, "msgwait": 14 } } }
+    contents = render_sls("node/file_roots/on_start/timing.sls", grains, pillar = pillar)["/etc/crm/profiles.yml"]["file.managed"][1]["contents"]
+    profile = yaml.safe_load(contents)["default"]
+    assert profile["sbd.watchdog_timeout"] == 7
+    assert "corosync.totem.token" not in profile
+
+
+def test_cluster_sbd_device_salt_ssh():
+    grains = cluster_grains(sbd_disk_device = "", iscsi_multipath = True, provision_backend = "salt-ssh")
+    salt = { "cmd.run": lambda *args, **kwargs: pytest.fail("looked the device up where the pillar is rendered") }
+    pillar = render_sls("node/pillar_roots/cluster.sls", grains, salt = salt)
+    assert pillar["cluster"]["sbd"]["device"] is None
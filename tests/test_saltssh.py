@@ -0,0 +1,33 @@
+import json
+
+import yaml
+
+import saltssh
+import tasks
+
+
+def states(*results):
+    return { f"state_{index}": { "result": result, "comment": "" } for index, result in enumerate(results) }
+
+
+def test_has_succeeded():
+    assert saltssh.has_succeeded(tasks.success(json.dumps({ "node01": states(True, None) })), "node01")
+    assert not saltssh.has_succeeded(tasks.success(json.dumps({ "node01": states(True, False) })), "node01")
+    # rendering errors, connection errors and output of other targets
+    assert not saltssh.has_succeeded(tasks.success(json.dumps({ "node01": ["Rendering SLS failed"] })), "node01")
+    assert not saltssh.has_succeeded(tasks.success(json.dumps({ "node01": { "retcode": 255, "stderr": "Permission denied" } })), "node01")
+    assert not saltssh.has_succeeded(tasks.success(json.dumps({ "node01": {} })), "node01")
+    assert not saltssh.has_succeeded(tasks.success(json.dumps({ "node02": states(True) })), "node01")
+    assert not saltssh.has_succeeded(tasks.success("not json"), "node01")
+    assert not saltssh.has_succeeded((1, json.dumps({ "node01": states(True) }), ""), "node01")
+
+
+def test_config_save(tmp_path):
+    saltssh.config_save(str(tmp_path), "node", ["salt/node/file_roots"], ["salt/node/pillar_roots"], "known_hosts")
+
+    with open(tmp_path / "node" / "master") as f:
+        config = yaml.safe_load(f)
+    assert config["root_dir"] == str(tmp_path / "node")
+    assert config["file_roots"]["base"] == config["file_roots"]["config"]
+    assert all(root.endswith("salt/node/file_roots") and root.startswith("/") for root in config["file_roots"]["base"])
+    assert config["known_hosts_file"].endswith("/known_hosts")
@@ -0,0 +1,27 @@
+import snapshots
+import tasks
+import libvirt
+
+
+def test_snapshot_raw_disks(monkeypatch):
+    disks = [
+        { "target": "vda", "source": "/images/test-node01-main-disk", "format": "qcow2", "shareable": False },
+        { "target": "vdb", "source": "/images/test-sbd.raw", "format": "raw", "shareable": True },
+        { "target": "vdc", "source": "/images/data.img", "format": "raw", "shareable": False },
+    ]
+    monkeypatch.setattr(libvirt, "domain_disks", lambda uri, domain: disks)
+    assert [ disk["target"] for disk in snapshots.snapshot_raw_disks("qemu:///system", "test-node01") ] == ["vdb", "vdc"]
+    assert snapshots.snapshot_region_path("snapshots", "clean", "/images/test-sbd.raw") == "snapshots/clean.test-sbd.raw"
+
+
+def test_snapshot_delete_all(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(libvirt, "snapshot_delete", lambda uri, domain, name: deleted.append( (domain, name) ) or tasks.failure())
+    env = { "common": { "qemu_uri": "qemu:///system" }, "snapshots": {
+        "clean": { "domains": ["test-node01", "test-node02"] },
+        "configured": { "domains": ["test-node01"] },
+    } }
+
+    # failures do not stop the deletion of the rest
+    snapshots.snapshot_delete_all(env)
+    assert deleted == [("test-node01", "clean"), ("test-node02", "clean"), ("test-node01", "configured")]
@@ -0,0 +1,87 @@
+import time
+import socket
+import threading
+
+import ssh
+import tasks
+
+
+# listening sockets, kept open until the tests end
+listeners = []
+
+
+def listen(host, delay = 0):
+    """
+    Listens on a free port of host, after delay seconds if given. Returns the port
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    if delay:
+        sock.close()
+        def later():
+            time.sleep(delay)
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen()
+            time.sleep(5)
+            server.close()
+        threading.Thread(target=later, daemon=True).start()
+    else:
+        sock.listen()
+        listeners.append(sock)
+    return port
+
+
+def test_backoff():
+    for delay in [0.5, 1, 4, 5]:
+        following, wait = ssh.backoff(delay)
+        assert following == min(delay * 2, 5)
+        assert 0 <= wait <= delay
+
+
+def test_wait_for_ports():
+    port = listen("127.0.0.1")
+
+    start = time.time()
+    ready = list(ssh.wait_for_ports(["127.0.0.1", "127.0.0.2"], port=port, timeout=1))
+    assert ready == [("127.0.0.1", True), ("127.0.0.2", False)]
+    assert time.time() - start < 3
+
+
+def test_wait_for_ports_retries():
+    port = listen("127.0.0.3", delay=0.5)
+
+    ready = list(ssh.wait_for_ports(["127.0.0.3"], port=port, timeout=10))
+    assert ready == [("127.0.0.3", True)]
+
+
+def test_options(monkeypatch, tmp_path):
+    monkeypatch.setattr(ssh, "known_hosts", None)
+    assert ssh.options() == "-o StrictHostKeyChecking=no"
+
+    ssh.use_known_hosts(str(tmp_path / "known_hosts"))
+    assert ssh.options() == f"-o UserKnownHostsFile={tmp_path}/known_hosts -o StrictHostKeyChecking=accept-new"
+
+
+def test_scan_host_key(monkeypatch, tmp_path):
+    path = tmp_path / "known_hosts"
+    path.write_text("10.0.0.1 ssh-ed25519 OLD\n10.0.0.2 ssh-ed25519 OTHER\n")
+    monkeypatch.setattr(ssh, "known_hosts", str(path))
+    monkeypatch.setattr(tasks, "run", lambda command: tasks.success("# 10.0.0.1:22 SSH-2.0-OpenSSH\n10.0.0.1 ssh-ed25519 NEW\n10.0.0.1 ssh-rsa NEW\n"))
+
+    assert tasks.has_succeeded(ssh.scan_host_key("10.0.0.1"))
+    assert path.read_text() == "10.0.0.2 ssh-ed25519 OTHER\n10.0.0.1 ssh-ed25519 NEW\n10.0.0.1 ssh-rsa NEW\n"
+
+
+def test_scan_host_key_failure(monkeypatch, tmp_path):
+    path = tmp_path / "known_hosts"
+    monkeypatch.setattr(ssh, "known_hosts", str(path))
+    monkeypatch.setattr(tasks, "run", lambda command: (1, "", "timeout"))
+
+    assert tasks.has_failed(ssh.scan_host_key("10.0.0.1"))
+    assert not path.exists()
+
+    monkeypatch.setattr(ssh, "known_hosts", None)
+    assert tasks.has_failed(ssh.scan_host_key("10.0.0.1"))
@@ -0,0 +1,66 @@
+import time
+
+import tasks
+
+
+def test_run():
+    assert tasks.run("echo out; echo err >&2; exit 3") == (3, "out\n", "err\n")
+    assert tasks.run("cat", input="in") == (0, "in", "")
+
+
+def test_run_timeout():
+    start = time.time()
+    res = tasks.run("echo started; sleep 10", timeout=0.5)
+    assert time.time() - start < 5
+    assert tasks.get_return_code(res) == 124
+    assert tasks.get_stdout(res) == "started\n"
+    assert "Timeout after 0.5 seconds" in tasks.get_stderr(res)
+
+
+def test_run_timeout_kills_every_process():
+    # the background sleep keeps the pipes open, unless it is killed along with the shell
+    start = time.time()
+    res = tasks.run("sleep 10 & sleep 10", timeout=0.5)
+    assert time.time() - start < 5
+    assert tasks.get_return_code(res) == 124
+
+
+def test_run_streamed():
+    lines = []
+    res = tasks.run_streamed("echo one; echo error >&2; echo two; exit 3", lines.append)
+    assert res == (3, "one\ntwo\n", "error\n")
+    assert lines == ["one", "two"]
+
+
+def test_run_to_file(tmp_path):
+    destination = tmp_path / "out"
+    res = tasks.run_to_file("cat; printf '\\000\\377'; echo err >&2", str(destination), input="in")
+    assert res == (0, "", "err\n")
+    assert destination.read_bytes() == b"in\x00\xff"
+
+
+def test_run_to_file_timeout(tmp_path):
+    start = time.time()
+    res = tasks.run_to_file("echo started; sleep 10 & sleep 10", str(tmp_path / "out"), timeout=0.5)
+    assert time.time() - start < 5
+    assert tasks.get_return_code(res) == 124
+    assert (tmp_path / "out").read_text() == "started\n"
+
+
+def test_run_watched_stall():
+    start = time.time()
+    res = tasks.run_watched("echo started; sleep 10 & sleep 10", 0.5, interval = 0.1)
+    assert time.time() - start < 5
+    assert tasks.get_return_code(res) == 125
+    assert tasks.get_stdout(res) == "started\n"
+    assert "No progress after 0.5 seconds" in tasks.get_stderr(res)
+
+
+def test_run_watched_output_is_progress():
+    res = tasks.run_watched("for i in 1 2 3 4 5 6; do echo $i; sleep 0.2; done; exit 2", 0.6, interval = 0.1)
+    assert res == (2, "1\n2\n3\n4\n5\n6\n", "")
+
+
+def test_run_watched_stderr_is_progress():
+    res = tasks.run_watched("for i in 1 2 3 4 5 6; do echo $i >&2; sleep 0.2; done", 0.6, interval = 0.1)
+    assert res == (0, "", "1\n2\n3\n4\n5\n6\n")
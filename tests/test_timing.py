@@ -0,0 +1,126 @@
+import tasks
+import timing
+
+
+def timing_env(provider, preset = "", nodes = 2, **kwargs):
+    return { "provider": provider, "node": { "count": nodes }, "timing": dict(preset = preset, override = {}, **kwargs) }
+
+
+def test_compute_default():
+    res, profile = timing.compute(timing_env("libvirt"))
+    assert tasks.has_succeeded(res)
+    assert profile["token"] == 3000
+    assert profile["token_coefficient"] == 650
+    assert profile["consensus"] == 3600
+    assert profile["join"] == 50
+    assert profile["token_retransmits_before_loss_const"] == 4
+    assert profile["sbd_watchdog"] == 15
+    assert profile["sbd_msgwait"] == 30
+    assert profile["join_timeout"] == 180
+
+
+def test_compute_grows_with_nodes():
+    res, profile = timing.compute(timing_env("libvirt", nodes = 4))
+    assert tasks.has_succeeded(res)
+    # corosync grows the token itself, derived timings follow the grown one
+    assert profile["token"] == 3000
+    assert profile["token_coefficient"] == 650
+    assert profile["consensus"] == int((3000 + 2 * 650) * 1.2)
+    assert profile["join_timeout"] == 180
+
+    res, profile = timing.compute(timing_env("libvirt", "wan-tolerant", nodes = 32))
+    assert profile["token"] == 10000
+    assert profile["consensus"] == int((10000 + 30 * 1000) * 1.2)
+    assert profile["join_timeout"] == 60 + 32 * 96
+
+
+def test_compute_azure_minimums():
+    for preset in ["", "default", "wan-tolerant"]:
+        res, profile = timing.compute(timing_env("azure", preset))
+        assert tasks.has_succeeded(res)
+        assert profile["token"] >= 30000
+        assert profile["token_retransmits_before_loss_const"] >= 10
+        assert profile["join"] >= 60
+        assert profile["sbd_watchdog"] >= 60
+        assert profile["sbd_msgwait"] >= 2 * profile["sbd_watchdog"]
+
+    res, profile = timing.compute(timing_env("azure"))
+    assert profile["token"] == 30000
+    assert profile["consensus"] == 36000
+    assert profile["sbd_watchdog"] == 60
+    assert profile["sbd_msgwait"] == 120
+
+
+def test_compute_azure_fast_failover_skips_minimums():
+    res, profile = timing.compute(timing_env("azure", "fast-failover"))
+    assert tasks.has_succeeded(res)
+    assert profile["token"] == 1000
+    assert profile["join"] == 50
+    assert profile["sbd_watchdog"] == 5
+    assert profile["sbd_msgwait"] == 10
+
+
+def test_compute_watchdog_above_consensus():
+    res, profile = timing.compute(timing_env("libvirt", "wan-tolerant", nodes = 32))
+    assert tasks.has_succeeded(res)
+    assert profile["sbd_watchdog"] * 1000 > profile["consensus"]
+    assert profile["sbd_msgwait"] >= 2 * profile["sbd_watchdog"]
+
+
+def test_compute_latency():
+    res, profile = timing.compute(timing_env("libvirt"), { "average": 100.0, "maximum": 200.0 })
+    assert tasks.has_succeeded(res)
+    assert profile["token"] == 200 * timing.latency_round_trips
+    assert profile["join"] == 800
+
+    # the grown token is the one covering it
+    res, profile = timing.compute(timing_env("libvirt", nodes = 4), { "average": 100.0, "maximum": 200.0 })
+    assert profile["token"] + 2 * profile["token_coefficient"] == 200 * timing.latency_round_trips
+
+
+def test_compute_override():
+    env = timing_env("azure")
+    env["timing"]["override"] = { "token": 5000, "sbd_watchdog": 10 }
+    res, profile = timing.compute(env)
+    assert tasks.has_succeeded(res)
+    assert profile["token"] == 5000
+    assert profile["sbd_watchdog"] == 10
+    # derived values are computed before the override
+    assert profile["consensus"] == 36000
+
+
+def test_compute_unknown_preset():
+    res, profile = timing.compute(timing_env("libvirt", "slow"))
+    assert tasks.has_failed(res)
+    assert profile is None
+
+
+def test_tunes_totem():
+    assert not timing.tunes_totem(timing_env("libvirt"))
+    assert not timing.tunes_totem(timing_env("container"))
+    assert timing.tunes_totem(timing_env("azure"))
+    assert timing.tunes_totem(timing_env("libvirt", "default"))
+    assert timing.tunes_totem(timing_env("libvirt", probe = True))
+
+    env = timing_env("libvirt")
+    env["timing"]["override"] = { "token": 5000 }
+    assert timing.tunes_totem(env)
+
+
+def test_latency_probe(monkeypatch):
+    outputs = {
+        "192.168.0.2": "rtt min/avg/max/mdev = 0.210/0.305/0.512/0.070 ms\n",
+        "192.168.0.3": "rtt min/avg/max/mdev = 0.110/0.405/0.450/0.070 ms\n",
+    }
+    monkeypatch.setattr(timing.ssh, "run", lambda user, password, host, command, timeout: tasks.success(outputs[command.split()[-1].strip("'")]))
+
+    res, latency = timing.latency_probe("root", "linux", "10.0.0.1", ["192.168.0.2", "192.168.0.3"])
+    assert tasks.has_succeeded(res)
+    assert latency == { "average": 0.405, "maximum": 0.512 }
+
+
+def test_latency_probe_failure(monkeypatch):
+    monkeypatch.setattr(timing.ssh, "run", lambda user, password, host, command, timeout: tasks.success("100% packet loss\n"))
+    res, latency = timing.latency_probe("root", "linux", "10.0.0.1", ["192.168.0.2"])
+    assert tasks.has_failed(res)
+    assert latency is None
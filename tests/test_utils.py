@@ -0,0 +1,205 @@
+import urllib.request
+
+import utils
+
+
+class Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def serve(monkeypatch, headers):
+    """
+    Answers the HEAD requests of image_cache_name with the given headers, or fails them if None
+    """
+    def urlopen(request, timeout = None):
+        assert request.get_method() == "HEAD"
+        if headers is None:
+            raise OSError("connection refused")
+        return Response(headers)
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+
+
+def test_image_cache_name_local_by_content(tmp_path):
+    first = tmp_path / "first.qcow2"
+    second = tmp_path / "second.qcow2"
+    other = tmp_path / "other.qcow2"
+    first.write_bytes(b"image")
+    second.write_bytes(b"image")
+    other.write_bytes(b"other image")
+
+    name = utils.image_cache_name(str(first))
+    assert name.startswith("pacemaker-deploy-base-")
+    assert name == utils.image_cache_name(str(second))
+    assert name != utils.image_cache_name(str(other))
+    assert name == utils.image_cache_name(f"file://{first}")
+
+
+def test_image_cache_name_remote_by_validators(monkeypatch):
+    url = "http://example.com/image.qcow2"
+
+    serve(monkeypatch, { "ETag": '"abc"', "Content-Length": "10" })
+    name = utils.image_cache_name(url)
+    assert name.startswith("pacemaker-deploy-base-")
+    assert name == utils.image_cache_name(url)
+
+    serve(monkeypatch, { "ETag": '"def"', "Content-Length": "10" })
+    assert name != utils.image_cache_name(url)
+
+    serve(monkeypatch, { "Last-Modified": "Mon, 19 Oct 2026 10:00:00 GMT" })
+    assert name != utils.image_cache_name(url)
+
+
+def test_image_cache_name_remote_without_validators(monkeypatch):
+    # the length alone does not tell two images apart, they are named after their content once downloaded
+    serve(monkeypatch, { "Content-Length": "10" })
+    assert utils.image_cache_name("http://example.com/image.qcow2") is None
+
+
+def test_image_cache_name_remote_unreachable(monkeypatch):
+    serve(monkeypatch, None)
+    assert utils.image_cache_name("http://example.com/image.qcow2") is None
+
+
+def test_image_content_name(tmp_path):
+    image = tmp_path / "image.qcow2"
+    image.write_bytes(b"image")
+    assert utils.image_content_name(str(image)) == utils.image_cache_name(str(image))
+
+
+def test_image_format(tmp_path):
+    qcow2 = tmp_path / "image.qcow2"
+    raw = tmp_path / "image.raw"
+    qcow2.write_bytes(b"QFI\xfb\x00\x00\x00\x03")
+    raw.write_bytes(b"\x00" * 512)
+    assert utils.image_format(str(qcow2)) == "qcow2"
+    assert utils.image_format(str(raw)) == "raw"
+
+
+def test_get_images_from_env():
+    env = {
+        "iscsi": { "source_image": "http://example.com/iscsi.qcow2" },
+        "node": { "count": 3, 1: { "source_image": "http://example.com/node.qcow2" }, 2: { "source_image": "http://example.com/node.qcow2" }, 3: { "source_image": "", "volume_name": "node03" } },
+    }
+    images = utils.get_images_from_env(env)
+    assert sorted(images) == ["http://example.com/iscsi.qcow2", "http://example.com/node.qcow2"]
+    assert images["http://example.com/node.qcow2"] == [env["node"][1], env["node"][2]]
+
+
+def test_sink_performance():
+    env = {
+        "provider": "libvirt",
+        "common": { "shared_storage_type": "shared-disk", "source_image": "image.qcow2", "volume_name": "", "cpus": 2, "memory": 1024, "disk_size": 1,
+                    "username": "root", "password": "linux", "additional_repos": {}, "additional_pkgs": [],
+                    "performance": { "iothreads": 1, "disk_cache": "none", "hugepages": False } },
+        "iscsi": { "performance": { "hugepages": True } },
+        "node": { "count": 2, "performance": { "iothreads": 2 }, 2: { "performance": { "disk_cache": "" } } },
+        "sbd": {},
+        "qdevice": { "enabled": False },
+        "examiner": { "enabled": False },
+    }
+    sunk = utils.sink(env)
+    assert sunk["node"][1]["performance"] == { "iothreads": 2, "disk_cache": "none", "hugepages": False }
+    assert sunk["node"][2]["performance"] == { "iothreads": 2, "disk_cache": "", "hugepages": False }
+    assert "performance" not in sunk["node"]
+def test_outputs_translate_flat():
+    env = { "node": { "count": 2, 1: {}, 2: {} }, "iscsi": {} }
+    outputs = {
+        "node01_public_ip": { "value": "10.0.0.11" },
+        "node02_public_ip": { "value": "10.0.0.12" },
+        "node02_name": { "value": "" },
+        "iscsi_public_ip": { "value": "10.0.0.5" },
+        "iscsi_name": { "value": None },
+    }
+    env = utils.outputs_translate(env, outputs)
+    assert env["node"][1] == { "public_ip": "10.0.0.11" }
+    assert env["node"][2] == { "public_ip": "10.0.0.12" }
+    assert env["iscsi"] == { "public_ip": "10.0.0.5" }
+
+
+def test_outputs_translate_structured():
+    env = { "node": { "count": 2, 1: { "name": "node01" }, 2: {} } }
+    outputs = {
+        "node": { "value": {
+            "01": { "public_ip": "10.0.0.11", "private_ip": "" },
+            "02": { "public_ip": "10.0.0.12", "private_ip": "192.168.0.12" },
+        } },
+    }
+    env = utils.outputs_translate(env, outputs)
+    assert env["node"][1] == { "name": "node01", "public_ip": "10.0.0.11" }
+    assert env["node"][2] == { "public_ip": "10.0.0.12", "private_ip": "192.168.0.12" }
+
+
+def test_outputs_translate_structured_empty():
+    env = { "node": { "count": 1, 1: {} } }
+    env = utils.outputs_translate(env, { "node": { "value": {} } })
+    assert env["node"][1] == {}
+
+
+def sink_env(provider, storage):
+    env = {
+        "provider": provider,
+        "common": {
+            "shared_storage_type": storage,
+            "username": "root",
+            "password": "linux",
+            "additional_repos": {},
+            "additional_pkgs": [],
+            "base_image": "opensuse/tumbleweed",
+            "cpus": 1,
+            "memory": 1024,
+        },
+        "node": { "count": 2, 2: { "memory": 2048 } },
+        "qdevice": { "enabled": False },
+        "examiner": { "enabled": True },
+    }
+    return env
+
+
+def test_sink_without_sbd_nor_iscsi():
+    env = sink_env("container", "none")
+    env["sbd"] = {}
+    env["iscsi"] = {}
+
+    sunk = utils.sink(env)
+    assert "sbd" not in sunk
+    assert "iscsi" not in sunk
+    assert "qdevice" not in sunk
+    assert sunk["examiner"]["memory"] == 1024
+    assert sunk["node"][1]["memory"] == 1024
+    assert sunk["node"][2]["memory"] == 2048
+    assert sunk["node"][1]["username"] == "root"
+    assert "memory" not in sunk["common"]
+    assert "memory" not in sunk["node"]
+    # the environment given is left as it is
+    assert "sbd" in env and 1 not in env["node"]
+
+
+def test_sink_with_sbd_or_iscsi_missing():
+    sunk = utils.sink(sink_env("container", "shared-disk"))
+    assert "sbd" not in sunk and "iscsi" not in sunk
+
+    sunk = utils.sink(sink_env("container", "iscsi"))
+    assert "sbd" not in sunk and "iscsi" not in sunk
+
+
+def test_sink_keeps_the_storage_in_use():
+    env = sink_env("container", "iscsi")
+    env["sbd"] = {}
+    env["iscsi"] = {}
+    sunk = utils.sink(env)
+    assert "sbd" not in sunk
+    assert sunk["iscsi"]["cpus"] == 1
+
+    env = sink_env("container", "shared-disk")
+    env["sbd"] = {}
+    env["iscsi"] = {}
+    sunk = utils.sink(env)
+    assert "iscsi" not in sunk
+    assert sunk["sbd"]["cpus"] == 1
@@ -0,0 +1,141 @@
+import re
+import math
+
+import ssh
+import tasks
+
+
+#
+# Presets, times in milliseconds but join_timeout, sbd_watchdog and sbd_msgwait, which are in seconds
+#
+presets = {
+    # corosync and sbd defaults
+    "default": {
+        "token": 3000,
+        "token_coefficient": 650,
+        "token_retransmits_before_loss_const": 4,
+        "join": 50,
+        "max_messages": 20,
+        "sbd_watchdog": 15,
+    },
+    # detect failures as soon as the network allows it, for low latency networks
+    "fast-failover": {
+        "token": 1000,
+        "token_coefficient": 250,
+        "token_retransmits_before_loss_const": 4,
+        "join": 50,
+        "max_messages": 20,
+        "sbd_watchdog": 5,
+    },
+    # survive latency spikes and short network outages
+    "wan-tolerant": {
+        "token": 10000,
+        "token_coefficient": 1000,
+        "token_retransmits_before_loss_const": 10,
+        "join": 200,
+        "max_messages": 10,
+        "sbd_watchdog": 30,
+    },
+}
+
+#
+# Platform minimums. Azure host maintenance can freeze a machine for up to 30 seconds
+#
+platforms = {
+    "azure": {
+        "token": 30000,
+        "token_retransmits_before_loss_const": 10,
+        "join": 60,
+        "sbd_watchdog": 60,
+    },
+}
+
+#
+# Token is kept above this many round trips, so a ring rotation fits in it with margin
+#
+latency_round_trips = 50
+
+
+def latency_probe(user, password, host, targets, count = 20):
+    """
+    Measures the round trip time from a host to every target with ping.
+    Returns the worst average and maximum round trip times seen, in milliseconds
+    """
+    average = 0.0
+    maximum = 0.0
+
+    for target in targets:
+        res = ssh.run(user, password, host, f"'ping -q -n -c {count} -i 0.2 {target}'", timeout = count + 30)
+        if tasks.has_failed(res):
+            return tasks.failure(f"Cannot probe latency from {host} to {target}: {tasks.get_stderr(res)}"), None
+
+        # rtt min/avg/max/mdev = 0.210/0.305/0.512/0.070 ms
+        match = re.search(r"= [\d.]+/([\d.]+)/([\d.]+)/", tasks.get_stdout(res))
+        if match is None:
+            return tasks.failure(f"Cannot parse latency from {host} to {target}"), None
+
+        average = max(average, float(match.group(1)))
+        maximum = max(maximum, float(match.group(2)))
+
+    return tasks.success(), { "average": average, "maximum": maximum }
+
+
+def tunes_totem(env):
+    """
+    Returns whether the totem timings of corosync are set for a deployment, which is only done if they are asked
+    for with a preset, override or probe, or the platform has minimums. Otherwise corosync keeps its own
+    """
+    timing = env.get("timing", {})
+    return bool(timing.get("preset") or timing.get("override") or timing.get("probe") or env["provider"] in platforms)
+
+
+def compute(env, latency = None):
+    """
+    Computes corosync and sbd timings for a deployment from its preset, platform, node count and,
+    if given, the latency measured between nodes. Values given in timing.override are kept as they are
+    """
+    timing = env.get("timing", {})
+    preset = timing.get("preset") or "default"
+    if preset not in presets:
+        return tasks.failure(f"Unknown timing preset {preset}, must be one of: {', '.join(presets)}"), None
+
+    values = dict(presets[preset])
+
+    # platform minimums, but for failover presets, which trade them for speed knowingly
+    for key, minimum in platforms.get(env["provider"], {}).items():
+        if preset != "fast-failover":
+            values[key] = max(values[key], minimum)
+
+    # corosync grows the token with the ring, by token_coefficient for every node past the second one,
+    # so the base token is written as it is and the derived timings follow the token it ends up with
+    nodes = int(env["node"]["count"])
+    growth = max(nodes - 2, 0) * values["token_coefficient"]
+    token = values["token"]
+
+    # which must cover the measured latency
+    if latency:
+        token = max(token, int(math.ceil(latency["maximum"] * latency_round_trips)) - growth)
+        values["join"] = max(values["join"], int(math.ceil(latency["maximum"] * 4)))
+
+    ring_token = token + growth
+
+    profile = {
+        "token": token,
+        "token_coefficient": values["token_coefficient"],
+        "consensus": int(ring_token * 1.2),
+        "join": values["join"],
+        "max_messages": values["max_messages"],
+        "token_retransmits_before_loss_const": values["token_retransmits_before_loss_const"],
+        # nodes join one after another, each one needs a full membership change
+        "join_timeout": max(180, 60 + nodes * int(math.ceil(ring_token * 1.2 * 2 / 1000))),
+        "sbd_watchdog": values["sbd_watchdog"],
+        "sbd_msgwait": values["sbd_watchdog"] * 2,
+    }
+
+    # the watchdog must not fire before corosync notices a lost node
+    profile["sbd_watchdog"] = max(profile["sbd_watchdog"], int(math.ceil(profile["consensus"] / 1000)) + 1)
+    profile["sbd_msgwait"] = max(profile["sbd_msgwait"], profile["sbd_watchdog"] * 2)
+
+    profile.update(timing.get("override", {}))
+
+    return tasks.success(), profile
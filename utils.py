@@ -3,6 +3,9 @@ import json
 import yaml
 import logging
 import copy
+import hashlib
+import shutil
+import urllib.request
 
 import jinja2
 
@@ -45,6 +48,24 @@ def path_deployment_infrastructure(deployment_name):
 def path_deployment_provision(deployment_name):
     return f"{path_deployment(deployment_name)}/salt"
 
+def path_deployment_saltssh(deployment_name):
+    return f"{path_deployment(deployment_name)}/salt-ssh"
+
+def path_deployment_known_hosts(deployment_name):
+    return f"{path_deployment(deployment_name)}/known_hosts"
+
+def path_deployment_bench(deployment_name):
+    return f"{path_deployment(deployment_name)}/bench"
+
+def path_deployment_logs(deployment_name):
+    return f"{path_deployment(deployment_name)}/logs"
+
+def path_deployment_diag(deployment_name):
+    return f"{path_deployment(deployment_name)}/diag"
+
+def path_deployment_snapshots(deployment_name):
+    return f"{path_deployment(deployment_name)}/snapshots"
+
 #
 # Deployment related
 #
@@ -100,7 +121,7 @@ def template_render(src_dir, template_name, dst_dir, output_name, **env):
     with open(input_path, "r") as input_file:
         template = jinja2.Template(input_file.read())
 
-    template.globals = { "jsonify": json.dumps }
+    template.globals.update({ "jsonify": json.dumps })
     
     #output_name = ".".join( template_name.split(".")[0:-1:] )
     
@@ -137,6 +158,10 @@ def sink_entry(parent, son, props):
         if "source_image" in son and son["source_image"] != "":
             son["volume_name"] = ""
 
+    # profiles, keys not given are taken from parent
+    if "performance" in props and "performance" in son:
+        son["performance"] = merge(parent["performance"], son["performance"])
+
     # rest of properties
     for prop in props:
         if prop not in ["source_image", "volume_name"] and prop not in son:
@@ -148,11 +173,14 @@ def delete_from_parent(parent, props):
 
 def sinkable_props_for_provider(name):
     if name == "libvirt":
-        return ["source_image", "volume_name", "cpus", "memory", "disk_size"]
+        return ["source_image", "volume_name", "cpus", "memory", "disk_size", "performance"]
 
     if name == "azure":
         return ["vm_size", "offer", "sku", "version", "authorized_keys_file", "public_key_file"]
 
+    if name == "container":
+        return ["base_image", "cpus", "memory"]
+
     return []
 
 
@@ -173,7 +201,8 @@ def sink(env):
 
     # first from common to the rest of roles
     for role in ["sbd", "node", "iscsi", "qdevice", "examiner"]:
-        sink_entry(new_env["common"], new_env[role], sinkable_props)
+        if role in new_env:
+            sink_entry(new_env["common"], new_env[role], sinkable_props)
 
     delete_from_parent(new_env["common"], sinkable_props)
 
@@ -183,11 +212,11 @@ def sink(env):
 
     delete_from_parent(new_env["node"], sinkable_props)
 
-    # erase sbd or iscsi entry
-    if new_env["common"]["shared_storage_type"] == "iscsi":
-        del new_env["sbd"]
-    else:
-        del new_env["iscsi"]
+    # erase sbd or iscsi entry, or both without shared storage
+    if new_env["common"]["shared_storage_type"] != "shared-disk":
+        new_env.pop("sbd", None)
+    if new_env["common"]["shared_storage_type"] != "iscsi":
+        new_env.pop("iscsi", None)
 
     
     if not new_env["qdevice"]["enabled"]:
@@ -247,3 +276,131 @@ def get_hosts_from_env(env):
         hosts.append( (role, index + 1, name, host, username, password) )
 
     return hosts
+
+
+def outputs_translate(env, outputs):
+    """
+    Adds terraform outputs to the environment. Outputs "a_b = v" are added as env[a][b] = v, and
+    "nodeNN_b = v" as env[node][NN][b] = v. Structured outputs "node = { NN = { b = v } }" are added
+    as env[node][NN][b] = v.
+    """
+    for k, v in outputs.items():
+        if not v["value"]:
+            continue
+
+        if k == "node":
+            for index, attributes in v["value"].items():
+                env["node"][int(index)].update({ subkey: value for subkey, value in attributes.items() if value })
+            continue
+
+        key, _, subkey = k.partition("_")
+        if "node" in key:
+            key, index = key[:len("node")], key[len("node"):]
+            env[key][int(index)][subkey] = v["value"]
+        else:
+            env[key][subkey] = v["value"]
+
+    return env
+
+
+def get_host_entry(env, role, index):
+    """
+    Returns the environment entry of a host from utils.get_hosts_from_env
+    """
+    return env[role][index] if role == "node" else env[role]
+
+
+def get_images_from_env(env):
+    """
+    Returns the environment entries of every machine that boots from an image, grouped by source_image
+    """
+    images = {}
+
+    entries = [ env[role] for role in ["iscsi", "qdevice", "examiner"] if role in env ]
+    entries += [ env["node"][index + 1] for index in range(0, int(env["node"]["count"])) ]
+
+    for entry in entries:
+        source = entry.get("source_image", "")
+        if source:
+            images.setdefault(source, []).append(entry)
+
+    return images
+
+
+#
+# Images
+#
+def image_is_url(source):
+    return "://" in source and not source.startswith("file://")
+
+
+def image_local_path(source):
+    return source[len("file://"):] if source.startswith("file://") else source
+
+
+def image_content_name(path):
+    """
+    Returns the name of the base volume holding an image file, after its content
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    return f"pacemaker-deploy-base-{digest.hexdigest()[:16]}"
+
+
+def image_cache_name(source):
+    """
+    Returns the name of the base volume holding a given image.
+    Local images are addressed by their content, remote ones by their url and the
+    validators returned by the server (ETag, Last-Modified, Content-Length), so a
+    changed image gets a new base volume without downloading it to find out.
+    Returns None if the server gives no validators, so the image must be downloaded to be named.
+    """
+    if not image_is_url(source):
+        return image_content_name(image_local_path(source))
+
+    try:
+        request = urllib.request.Request(source, method="HEAD")
+        with urllib.request.urlopen(request, timeout=30) as response:
+            validators = [ str(response.headers.get(header, "")) for header in ["ETag", "Last-Modified", "Content-Length"] ]
+    except Exception as e:
+        logging.warning(f"Cannot get validators for {source}, it will be named after its content: {e}")
+        return None
+
+    # the length alone does not tell two images apart
+    if not validators[0] and not validators[1]:
+        logging.warning(f"No ETag nor Last-Modified for {source}, it will be named after its content")
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(source.encode("utf-8"))
+    for validator in validators:
+        digest.update(validator.encode("utf-8"))
+
+    return f"pacemaker-deploy-base-{digest.hexdigest()[:16]}"
+
+
+def image_fetch(source, destination):
+    """
+    Downloads an image to a local file. Returns the path holding the image.
+    """
+    if not image_is_url(source):
+        return image_local_path(source)
+
+    with urllib.request.urlopen(source) as response, open(destination, "wb") as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+
+    return destination
+
+
+def image_format(path):
+    """
+    Returns the format of an image file, qcow2 or raw
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    return "qcow2" if magic == b"QFI\xfb" else "raw"